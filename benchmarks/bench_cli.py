@@ -0,0 +1,332 @@
+"""
+benchmarks/bench_cli.py
+
+Cold-start and end-to-end benchmarks of the bookshelf CLI.
+
+For every shelf size a synthetic shelf (database + one small file per
+record) is built under a temporary HOME, and main() is timed in a fresh
+interpreter for each command, so the numbers include interpreter start-up,
+imports and opening the shelf, as a user would see them:
+
+    help          bookshelf help
+    open          first Bookshelf() on the shelf (builds the FTS indexes)
+    search        bookshelf search <common word> --format ndjson
+    search_page   bookshelf search <common word> --format ndjson --limit 20
+    search_miss   bookshelf search <no such word> --format ndjson
+    add           bookshelf add <file>, metadata prefilled (no prompts)
+    merge         bookshelf merge --dry-run with a small secondary shelf
+
+Results are written as JSON (sorted keys, one entry per size and command),
+so two runs can be diffed, or compared with --compare.
+
+Run with:
+    python benchmarks/bench_cli.py                      # 1k, 10k, 100k rows
+    python benchmarks/bench_cli.py --sizes 1000 --repeat 3 -o before.json
+    python benchmarks/bench_cli.py --compare before.json after.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Union
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, "src")
+
+SIZES_DEFAULT = [1_000, 10_000, 100_000]
+REPEAT_DEFAULT = 5
+# Records in the secondary shelf of the merge benchmark
+MERGE_SECONDARY_DEFAULT = 10
+# Runs of the merge benchmark, which takes longer than all the others together
+MERGE_REPEAT_DEFAULT = 1
+# Skip the merge benchmark above this many primary records (0: never skip)
+MERGE_MAX_SIZE_DEFAULT = 10_000
+
+TABLE = "docs"
+
+# Word lists for synthetic metadata.  The secondary shelf of the merge
+# benchmark uses SECONDARY_WORDS only, so no record scores as an uncertain
+# match and the dry run never stops at a prompt.
+WORDS = """
+    algorithm analysis approximate binary bloom cache compiler concurrent
+    data database distributed dynamic efficient filter graph hash heap index
+    learning linear lock memory network optimal parallel probabilistic query
+    random scalable search sorting sparse storage stream structure system
+    theory tree
+""".split()
+SECONDARY_WORDS = """
+    zephyr quixotic jubilant vexillology xylograph kumquat wyvern yttrium
+    fjord glyph sphinx nymph crwth pneumatic rhythm quartz
+""".split()
+SURNAMES = """
+    Bloom Knuth Lamport Liskov Hoare Dijkstra Tarjan Karp Rivest Shamir
+    Adleman Hopper Lovelace Turing Church Kleene Backus Wirth Ritchie Thompson
+""".split()
+
+COMMON_WORD = "graph"
+MISSING_WORD = "nonexistentword"
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Synthetic shelves
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _record(rng: random.Random, words: List[str]) -> tuple:
+    identifier = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+    title = " ".join(rng.choice(words) for _ in range(rng.randint(3, 8)))
+    authors = ", ".join(
+        f"{chr(65 + rng.randrange(26))}. {rng.choice(SURNAMES)}"
+        for _ in range(rng.randint(1, 3))
+    )
+    keywords = ", ".join(rng.sample(words, 3))
+    description = " ".join(rng.choice(words) for _ in range(rng.randint(10, 40)))
+    return (identifier, f"{identifier}.pdf", title.capitalize(), authors,
+            "Paper", keywords, description)
+
+
+def build_shelf(root: str, size: int, seed: int, words=WORDS) -> str:
+    """Create <root>/_database.db and <root>/files with *size* records."""
+    rng = random.Random(seed)
+    files_dir = os.path.join(root, "files")
+    os.makedirs(files_dir, exist_ok=True)
+    db_path = os.path.join(root, "_database.db")
+
+    conn = sqlite3.connect(db_path)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {TABLE} (
+            id TEXT PRIMARY KEY, filename TEXT,
+            title TEXT, authors TEXT, category TEXT,
+            keywords TEXT, description TEXT
+        )
+    """)
+    rows = [_record(rng, words) for _ in range(size)]
+    conn.executemany(f"INSERT INTO {TABLE} VALUES (?,?,?,?,?,?,?)", rows)
+    conn.commit()
+    conn.close()
+
+    for row in rows:
+        sub_dir = os.path.join(files_dir, row[1][0:2])
+        os.makedirs(sub_dir, exist_ok=True)
+        with open(os.path.join(sub_dir, row[1]), "wb") as f:
+            f.write(f"%PDF-1.4 {row[0]} {row[2]}".encode())
+    return db_path
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Timing
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _child_main(argv: List[str]):
+    """Run main() with *argv*; 'add' gets its metadata without prompting."""
+    import bookshelf.util
+    from bookshelf.app import Bookshelf, main
+
+    # There is no terminal to size the banner with
+    bookshelf.util.get_terminal_width = lambda: 80
+
+    if argv[0] == "add":
+        def edit_metadata(self, filename, field_list, prefill=None):
+            field_list[:] = ["Benchmark title", "A. Bench", "Paper",
+                             "benchmark", "Added by the benchmark"]
+
+        Bookshelf.edit_metadata = edit_metadata
+        Bookshelf.show_main_menu = lambda self: None
+    elif argv[0] == "open":
+        Bookshelf(show_banner=False)
+        return
+
+    sys.argv = ["bookshelf", *argv]
+    main()
+
+
+def time_command(home: str, argv: List[str]) -> float:
+    """Wall time of one 'bookshelf <argv>' in a new interpreter, in ms."""
+    env = dict(os.environ, HOME=home, PYTHONPATH=SRC)
+    env.pop("BOOKSHELF_IMPORT_PROFILE", None)
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", *argv],
+        env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE, text=True,
+    )
+    elapsed = (time.perf_counter() - start) * 1000
+    if proc.returncode != 0:
+        raise RuntimeError(f"'bookshelf {' '.join(argv)}' failed:\n{proc.stderr}")
+    return elapsed
+
+
+def _summary(runs: List[float]) -> dict:
+    return {
+        "runs_ms": [round(r, 2) for r in runs],
+        "min_ms": round(min(runs), 2),
+        "median_ms": round(statistics.median(runs), 2),
+        "mean_ms": round(statistics.fmean(runs), 2),
+    }
+
+
+def bench_size(size: int, repeat: int, seed: int, merge_secondary: int,
+               merge_max_size: int, merge_repeat: int) -> Dict[str, dict]:
+    results: Dict[str, dict] = {}
+    with tempfile.TemporaryDirectory(prefix="bshelf-bench-") as home:
+        root = os.path.join(home, "bookshelf")
+        start = time.perf_counter()
+        db_path = build_shelf(root, size, seed)
+        build_ms = (time.perf_counter() - start) * 1000
+        print(f"  {size} rows built in {build_ms:.0f} ms", file=sys.stderr)
+
+        # The first open indexes the shelf; every later command reuses it
+        results["open"] = _summary([time_command(home, ["open"])])
+
+        # argv, or a function returning the argv of each run
+        commands: Dict[str, Union[List[str], Callable[[], List[str]]]] = {
+            "help": ["help"],
+            "search": ["search", COMMON_WORD, "--format", "ndjson"],
+            "search_page": ["search", COMMON_WORD, "--format", "ndjson",
+                            "--limit", "20"],
+            "search_miss": ["search", MISSING_WORD, "--format", "ndjson"],
+        }
+
+        # A new file for every run: adding the same one again would stop at
+        # the duplicate prompt
+        samples = iter(range(1 << 30))
+
+        def add_argv() -> List[str]:
+            sample = os.path.join(home, f"sample-{next(samples)}.pdf")
+            with open(sample, "wb") as f:
+                f.write(f"%PDF-1.4 benchmark sample {sample}\n".encode() * 1024)
+            return ["add", sample]
+
+        commands["add"] = add_argv
+
+        if merge_max_size == 0 or size <= merge_max_size:
+            secondary = os.path.join(home, "secondary")
+            secondary_db = build_shelf(
+                secondary, merge_secondary, seed + 1, SECONDARY_WORDS
+            )
+            commands["merge"] = [
+                "merge", "--dry-run", "--table", TABLE,
+                "--primary-db", db_path,
+                "--primary-files", os.path.join(root, "files"),
+                "--secondary-db", secondary_db,
+                "--secondary-files", os.path.join(secondary, "files"),
+                "--report", os.path.join(home, "merge_report.txt"),
+            ]
+
+        for name, argv in commands.items():
+            runs = merge_repeat if name == "merge" else repeat
+            results[name] = _summary([
+                time_command(home, argv() if callable(argv) else argv)
+                for _ in range(runs)
+            ])
+            print(f"  {size:>7} {name:<12} {results[name]['median_ms']:>10.1f} ms",
+                  file=sys.stderr)
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "-C", ROOT, "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes: List[int], repeat: int, seed: int, merge_secondary: int,
+        merge_max_size: int, merge_repeat: int) -> dict:
+    return {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "seed": seed,
+        "merge_secondary": merge_secondary,
+        "results": {
+            str(size): bench_size(size, repeat, seed, merge_secondary,
+                                  merge_max_size, merge_repeat)
+            for size in sizes
+        },
+    }
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Comparison
+# ─────────────────────────────────────────────────────────────────────────────
+
+def compare(before: dict, after: dict, out=None):
+    """Print the change in median time of every benchmark in both files."""
+    out = out or sys.stdout
+    print(f"{'size':>7} {'command':<12} {'before':>10} {'after':>10} {'change':>8}",
+          file=out)
+    for size, commands in before["results"].items():
+        for name, old in commands.items():
+            new = after["results"].get(size, {}).get(name)
+            if new is None:
+                continue
+            change = (new["median_ms"] / old["median_ms"] - 1) * 100
+            print(f"{size:>7} {name:<12} {old['median_ms']:>10.1f} "
+                  f"{new['median_ms']:>10.1f} {change:>+7.1f}%", file=out)
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(
+        description="Benchmark the bookshelf CLI on synthetic shelves.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    p.add_argument("--sizes", default=",".join(map(str, SIZES_DEFAULT)),
+                   help="Comma-separated shelf sizes (number of records)")
+    p.add_argument("--repeat", type=int, default=REPEAT_DEFAULT,
+                   help="Runs of each command")
+    p.add_argument("--seed", type=int, default=0,
+                   help="Seed of the synthetic metadata")
+    p.add_argument("--merge-secondary", type=int, default=MERGE_SECONDARY_DEFAULT,
+                   help="Records in the secondary shelf of the merge benchmark")
+    p.add_argument("--merge-repeat", type=int, default=MERGE_REPEAT_DEFAULT,
+                   help="Runs of the merge benchmark")
+    p.add_argument("--merge-max-size", type=int, default=MERGE_MAX_SIZE_DEFAULT,
+                   help="Skip the merge benchmark on larger shelves (0: never)")
+    p.add_argument("-o", "--output",
+                   help="Write the JSON results to this file instead of stdout")
+    p.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"),
+                   help="Compare two result files instead of running")
+    return p
+
+
+def main(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["--child"]:
+        _child_main(argv[1:])
+        return
+
+    args = _build_parser().parse_args(argv)
+    if args.compare:
+        with open(args.compare[0]) as f_before, open(args.compare[1]) as f_after:
+            compare(json.load(f_before), json.load(f_after))
+        return
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    results = run(sizes, args.repeat, args.seed, args.merge_secondary,
+                  args.merge_max_size, args.merge_repeat)
+    text = json.dumps(results, indent=2, sort_keys=True) + "\n"
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+
+if __name__ == "__main__":
+    main()
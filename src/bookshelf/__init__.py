@@ -1,2 +1,10 @@
 __all__ = ["__version__"]
 __version__ = "0.1.0"
+
+import os as _os
+
+# Time every import from here on (see bookshelf.importprofile)
+if _os.environ.get("BOOKSHELF_IMPORT_PROFILE", "") not in ("", "0"):
+    from bookshelf import importprofile as _importprofile
+
+    _importprofile.install()
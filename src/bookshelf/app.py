@@ -1,21 +1,34 @@
 #!/usr/bin/env python3
 
-import configparser
+# Modules only some commands need (readline, prompt_toolkit, subprocess,
+# argparse, the daemon, import and merge) are imported where they are used, so that
+# e.g. 'bookshelf help' or a scripted search start quickly.  Set
+# BOOKSHELF_IMPORT_PROFILE=1 to see what the start-up imports cost.
+
+import json
 import os
-import readline
 import shutil
 import sqlite3
-import subprocess
 import sys
 import uuid
 from dataclasses import dataclass
+from typing import Optional
 
+import bookshelf.cache
+import bookshelf.config
+import bookshelf.db
 import bookshelf.fuzzy
+import bookshelf.store
+import bookshelf.transfer
 import bookshelf.util
 
-# Enable history (optional)
-readline.parse_and_bind("tab: complete")  # Enable tab completion
-readline.parse_and_bind("set editing-mode vi")  # Enable Vi mode (optional)
+
+# Enable line editing for input() in interactive commands
+def setup_readline():
+    import readline
+
+    readline.parse_and_bind("tab: complete")  # Enable tab completion
+    readline.parse_and_bind("set editing-mode vi")  # Enable Vi mode (optional)
 
 
 # DataClass: Metadata ----------------------------------------------------------
@@ -27,10 +40,54 @@ class Metadata:
     category: str
     keywords: str
     description: str
+    # The stored file, filled in when it is copied into the shelf
+    sha256: Optional[str] = None
+    size: Optional[int] = None
+    mtime_ns: Optional[int] = None
+
+
+# Raised by a non-interactive add when the file is already in the shelf
+class DuplicateDocumentError(Exception):
+    def __init__(self, identifier):
+        super().__init__(f"Same file as record {identifier}")
+        self.identifier = identifier
+
+
+# Formats of the machine-readable search output (bshelf search --format)
+OUTPUT_FORMATS = ["ndjson", "tsv", "json"]
+
+
+# Make a value safe for one TSV cell
+def tsv_value(value):
+    if value is None:
+        return ""
+    return str(value).replace("\t", " ").replace("\r", " ").replace("\n", " ")
+
+
+# Write rows (lists of values of 'fields') to 'out' in one of OUTPUT_FORMATS.
+# Rows are written as they are produced.  Returns the number of rows written.
+def write_records(out, fmt, fields, rows):
+    if fmt == "json":
+        out.write("[")
+    count = 0
+    for values in rows:
+        if fmt == "tsv":
+            out.write("\t".join(tsv_value(v) for v in values) + "\n")
+        else:
+            item = json.dumps(dict(zip(fields, values)), ensure_ascii=False)
+            if fmt == "json":
+                out.write(("," if count > 0 else "") + "\n  " + item)
+            else:
+                out.write(item + "\n")
+        count += 1
+    if fmt == "json":
+        out.write("\n]\n" if count > 0 else "]\n")
+    out.flush()
+    return count
 
 
 class Bookshelf:
-    def __init__(self):
+    def __init__(self, show_banner=True):
         # Configuration
         self.icon_keyboard = "\uf11c"
 
@@ -38,23 +95,9 @@ class Bookshelf:
         self.icon_warn = "\uea6c"
         self.icon_err = "\uea87"
 
-        # First, go with default settings.
+        # First, go with default settings, then override them using config file.
         home_directory = os.path.expanduser("~")
-
-        config = configparser.ConfigParser()
-        config["settings"] = {
-            "root_directory": f"{home_directory}/bookshelf",
-            "db_filename": "_database.db",
-            "table_name": "docs",
-            "inbox_directory": "inbox",
-            "files_directory": "files",
-        }
-
-        # Then override settings using config file.
-        config_path = os.path.join(home_directory, ".config/bookshelf/config.ini")
-
-        if os.path.exists(config_path):
-            config.read(config_path)
+        config = bookshelf.config.load_config()
 
         # Set member variables related to the configuration
         # If the root directory begins with '~', replace it with full path.
@@ -69,33 +112,43 @@ class Bookshelf:
         self.table_name = config["settings"]["table_name"]
         self.inbox_dir = config["settings"]["inbox_directory"]
         self.files_dir = config["settings"]["files_directory"]
+        self.search_mode = config["settings"]["search_mode"].lower()
+        self.page_size = max(1, int(config["settings"]["page_size"]))
+        self.record_cache_size = int(config["settings"]["record_cache_size"])
+        self.storage_mode = config["settings"]["storage_mode"].lower()
+        self.transfer_strategy = config["settings"]["transfer_strategy"].lower()
+        bookshelf.transfer.strategy_order(self.transfer_strategy)   # validate
 
         # Create directories
         bookshelf.util.mkdir(self.root_dir)
         bookshelf.util.mkdir(os.path.join(self.root_dir, self.inbox_dir))
         bookshelf.util.mkdir(os.path.join(self.root_dir, self.files_dir))
+        bookshelf.store.init(
+            os.path.join(self.root_dir, self.files_dir), self.storage_mode
+        )
 
-        self.conn = sqlite3.connect(os.path.join(self.root_dir, self.db_filename))
+        # All modules share one long-lived, tuned connection per database
+        self.db_path = os.path.join(self.root_dir, self.db_filename)
+        self.db_settings = config["settings"]
+        bookshelf.db.configure(self.db_settings)
+        self.conn = bookshelf.db.get_connection(self.db_path)
         self.cursor = self.conn.cursor()
+        self.record_cache = bookshelf.cache.RecordCache(
+            self.conn, self.record_cache_size
+        )
+        self._hash_cache = None
 
         self.cursor.execute(f"""CREATE TABLE IF NOT EXISTS {self.table_name}
         (id TEXT PRIMARY KEY, filename TEXT, title TEXT, authors TEXT,
         category TEXT, keywords TEXT, description TEXT)""")
         self.conn.commit()
+        bookshelf.db.ensure_file_columns(self.conn, self.table_name)
 
-        # Setup FTS table
-        bookshelf.fuzzy.setup_fts(
-            os.path.join(self.root_dir, self.db_filename), self.table_name
-        )
-        bookshelf.fuzzy.setup_fts_triggers(
-            os.path.join(self.root_dir, self.db_filename), self.table_name
-        )
-
-        self.show_banner()
+        # Setup FTS table (built once, rebuilt only on schema change or drift)
+        bookshelf.fuzzy.setup_fts(self.db_path, self.table_name)
 
-    def __del__(self):
-        # Close connection
-        self.conn.close()
+        if show_banner:
+            self.show_banner()
 
     def show_config(self):
         # desired_width = min(80, bookshelf.util.get_terminal_width())
@@ -107,6 +160,17 @@ class Bookshelf:
         print(f" - Table name: {self.table_name}")
         print(f" - Inbox directory: {self.inbox_dir}")
         print(f" - Files directory: {self.files_dir}")
+        print(f" - Storage mode: {self.get_storage_layout()}")
+        print(f" - Transfer strategy: {self.transfer_strategy}")
+        print(f" - Search mode: {self.search_mode}")
+        print(f" - Page size: {self.page_size}")
+        print(
+            f" - SQLite: journal_mode={self.db_settings['journal_mode']},"
+            f" synchronous={self.db_settings['synchronous']},"
+            f" cache={self.db_settings['cache_size_kib']} KiB,"
+            f" mmap={self.db_settings['mmap_size_mib']} MiB,"
+            f" busy_timeout={self.db_settings['busy_timeout_ms']} ms"
+        )
 
     def show_banner(self):
         desired_width = min(80, bookshelf.util.get_terminal_width())
@@ -182,7 +246,8 @@ Quit        - quit bookshelf and exit
         except KeyboardInterrupt:
             print("")
 
-    def edit_metadata(self, filename, field_list):
+    # 'prefill' (see bookshelf.prefill) suggests values for empty fields
+    def edit_metadata(self, filename, field_list, prefill=None):
         done = False
 
         input_title = field_list[0]
@@ -191,14 +256,23 @@ Quit        - quit bookshelf and exit
         input_keywords = field_list[3]
         input_description = field_list[4]
 
+        def suggestion(name):
+            return prefill.get(name) if prefill is not None else None
+
         while not done:
             print(f"{self.icon_info}  Edit metadata")
-            input_title = bookshelf.util.string_input("Title", input_title)
-            input_authors = bookshelf.util.string_input("Authors", input_authors)
+            input_title = bookshelf.util.string_input(
+                "Title", input_title, pending=suggestion("title")
+            )
+            input_authors = bookshelf.util.string_input(
+                "Authors", input_authors, pending=suggestion("authors")
+            )
             input_category = bookshelf.util.string_input("Category", input_category)
-            input_keywords = bookshelf.util.string_input("Keywords", input_keywords)
+            input_keywords = bookshelf.util.string_input(
+                "Keywords", input_keywords, pending=suggestion("keywords")
+            )
             input_description = bookshelf.util.string_input(
-                "Description", input_description
+                "Description", input_description, pending=suggestion("description")
             )
 
             print("")
@@ -226,6 +300,107 @@ Quit        - quit bookshelf and exit
 
     # Add a Document
     def add_document(self, filename):
+        from bookshelf.prefill import start_prefill
+
+        # Read the PDF's own metadata while the user answers the prompts
+        prefill = start_prefill(filename)
+
+        duplicate, digest = self.find_duplicate(filename)
+        if duplicate is not None and not self.resolve_duplicate(duplicate):
+            return
+
+        new_name, dst = self.new_file_destination(filename)
+        # Check for duplicate name (even though it is extremely rare)
+        if os.path.exists(dst):
+            print("[ERROR] File already exists.")
+            return
+
+        md = self.get_metadata(new_name, prefill)
+        method = self.store_file(filename, dst, md, digest)
+        self.register_document(md)
+        print(f"{self.icon_info}  File stored ({method})")
+
+    # Add a document without prompting, with the metadata given
+    # Returns the id of the new record.  A file that is already in the shelf
+    # raises DuplicateDocumentError unless 'allow_duplicate' is set.
+    def add_document_with_metadata(
+        self, filename, title="", authors="", category="", keywords="", description="",
+        allow_duplicate=False,
+    ):
+        digest = None
+        if not allow_duplicate:
+            duplicate, digest = self.find_duplicate(filename)
+            if duplicate is not None:
+                raise DuplicateDocumentError(duplicate[0])
+
+        new_name, dst = self.new_file_destination(filename)
+        if os.path.exists(dst):
+            raise FileExistsError(f"File already exists: {dst}")
+
+        md = Metadata(new_name, title, authors, category, keywords, description)
+        self.store_file(filename, dst, md, digest)
+        self.register_document(md)
+        return os.path.splitext(new_name)[0]
+
+    # Hashes of files outside the shelf, by path, size and mtime, shared with
+    # merge (see bookshelf.hashcache)
+    @property
+    def hash_cache(self):
+        if self._hash_cache is None:
+            from bookshelf import hashcache
+
+            self._hash_cache = hashcache.HashCache(self.conn)
+        return self._hash_cache
+
+    # Find a record whose stored file has the same content as 'filename'.
+    # Only records of the same size are candidates, so the file is hashed
+    # only when one exists, and only once while it is unchanged (hash
+    # cache).  Records without a stored hash are not checked (see
+    # 'bookshelf hash update').
+    # Returns (record or None, hash of the file or None if it was not
+    # hashed); the hash saves reading the file again to store it.
+    def find_duplicate(self, filename):
+        size = os.path.getsize(filename)
+        candidates = self.conn.execute(
+            f"SELECT id, sha256 FROM {self.table_name}"
+            f" WHERE size = ? AND sha256 IS NOT NULL;",
+            (size,),
+        ).fetchall()
+        if len(candidates) == 0:
+            return None, None
+
+        digest = self.hash_cache.hash(filename)
+        for identifier, sha256 in candidates:
+            if sha256 == digest:
+                # None if the record was removed since the SELECT
+                record = self.find_record(identifier)
+                if record is not None:
+                    return record, digest
+        return None, digest
+
+    # Ask what to do about a file that is already stored as 'record'.
+    # Returns True if the file should be added anyway.
+    def resolve_duplicate(self, record):
+        print(
+            bookshelf.util.make_bold_green(
+                f"{self.icon_info}  This file is already in the bookshelf"
+            )
+        )
+        self.show_info(record[0])
+        answer = bookshelf.util.closed_ended_question(
+            msg=f"{self.icon_keyboard}  (o)pen it, (e)dit its record, "
+            f"(a)dd anyway, or (c)ancel",
+            options=["o", "e", "a", "c"],
+        )
+        if answer == "o":
+            self.open_file(record[0])
+        elif answer == "e":
+            self.edit_record(record[0])
+        return answer == "a"
+
+    # Generate a new uuid file name for 'filename' and the path it is stored
+    # at.  The sub-directory is created if needed.
+    def new_file_destination(self, filename):
         name_without_extension, ext = os.path.splitext(filename)
 
         # Generate new name
@@ -238,22 +413,35 @@ Quit        - quit bookshelf and exit
         sub_dir_path = os.path.join(self.root_dir, self.files_dir, sub_dir_name)
         bookshelf.util.mkdir(sub_dir_path)
 
-        dst = os.path.join(sub_dir_path, new_name)
-        # Check for duplicate name (even though it is extremely rare)
-        if os.path.exists(dst):
-            print("[ERROR] File already exists.")
-            return
-
-        md = self.get_metadata(new_name)
-        shutil.copy(filename, dst)
-        self.register_document(md)
+        return new_name, os.path.join(sub_dir_path, new_name)
+
+    # Copy 'src' to 'dst' and record the hash, size and mtime of the copy in
+    # 'md'.  The hash is the 'digest' find_duplicate took or is computed
+    # from the buffers being copied, so the file is read only once; it is
+    # kept in the hash cache for 'src' as well, so adding the same file again
+    # finds the duplicate without reading it.  In a content-addressed store,
+    # 'dst' becomes a link to the blob of the content (see bookshelf.store).
+    # Returns how the file was copied, e.g. 'reflink' (see bookshelf.transfer).
+    def store_file(self, src, dst, md, digest=None):
+        result = bookshelf.store.store_file(
+            src, dst, os.path.join(self.root_dir, self.files_dir),
+            digest=digest, strategy=self.transfer_strategy,
+        )
+        md.sha256, md.size = result.sha256, result.size
+        md.mtime_ns = os.stat(dst).st_mtime_ns
+        st = os.stat(src)
+        if st.st_size == result.size:
+            self.hash_cache.put(src, st, result.sha256)
+            self.conn.commit()
+        return result.method
 
     def register_document(self, md):
         unique_id, _ = os.path.splitext(md.filename)
         self.cursor.execute(
             f"""INSERT INTO {self.table_name}
-            (id, filename, title, authors, category, keywords, description)
-            VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (id, filename, title, authors, category, keywords, description,
+            sha256, size, mtime_ns)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
             (
                 unique_id,
                 md.filename,
@@ -262,31 +450,93 @@ Quit        - quit bookshelf and exit
                 md.category,
                 md.keywords,
                 md.description,
+                md.sha256,
+                md.size,
+                md.mtime_ns,
             ),
         )
         self.conn.commit()
-
-    def search_documents(self, keyword):
-        fuzzy_search = False
+        self.record_cache.invalidate(unique_id)
+
+    # mode: a search mode of query_documents, e.g. 'content' to search the
+    # text of the files; by default the configured one (resolve_search_mode)
+    def search_documents(self, keyword, mode=None):
+        # Keyset pagination: remember the key of the row preceding each page
+        # visited, so a page is re-queried from there and never needs the
+        # rows before it.  One extra row is fetched to detect a next page.
+        # The page shown last is reused as long as the record cache reports
+        # no write (by this app or another process) since it was fetched.
+        page_starts = [None]
+        mode = mode or self.resolve_search_mode(keyword)
+        with_content = mode != "content" and self.has_content_index()
+        last_page = None
         try:
             while True:
-                search_results = self.query_documents(keyword, fuzzy_search)
+                page_id = (tuple(page_starts), self.record_cache.validate())
+                if last_page is not None and last_page[0] == page_id:
+                    search_results = last_page[1]
+                else:
+                    search_results = list(
+                        self.query_documents(
+                            keyword, mode, page_starts[-1], self.page_size + 1
+                        )
+                    )
+                last_page = (page_id, search_results)
+                # Rows end with their keyset (score, rowid); cache the rest
+                self.record_cache.put_many(row[:-2] for row in search_results)
+
                 if len(search_results) == 0:
+                    if len(page_starts) > 1:
+                        # The rest of the last page was deleted; step back
+                        page_starts.pop()
+                        continue
                     print(
                         bookshelf.util.make_bold_green(
                             f"{self.icon_err}  No matching records in db"
                         )
                     )
+                    if with_content:
+                        print(f"{self.icon_info}  Searching the text of the documents")
+                        self.search_documents(keyword, "content")
                     return
 
+                has_next = len(search_results) > self.page_size
+                search_results = search_results[: self.page_size]
+                has_prev = len(page_starts) > 1
+                first_index = (len(page_starts) - 1) * self.page_size + 1
+
+                snippets = None
+                if mode == "content":
+                    snippets = self.get_content_snippets(keyword, search_results)
                 file_indices = self.print_search_result(
-                    keyword, search_results, fuzzy_search
+                    keyword, search_results, first_index, len(page_starts), snippets
                 )
-                file_index = bookshelf.util.closed_ended_question(
-                    f"{self.icon_keyboard}  Index for more detail, or Ctrl-C to cancel",
-                    file_indices,
+                options = list(file_indices)
+                msg = f"{self.icon_keyboard}  Index for more detail"
+                if has_next:
+                    options.append("n")
+                    msg += ", (n)ext page"
+                if has_prev:
+                    options.append("p")
+                    msg += ", (p)revious page"
+                if with_content:
+                    options.append("b")
+                    msg += ", search (b)ody text"
+                answer = bookshelf.util.closed_ended_question(
+                    f"{msg}, or Ctrl-C to cancel", options
                 )
-                record = search_results[int(file_index) - 1]
+
+                if answer == "n":
+                    page_starts.append(bookshelf.fuzzy.row_key(search_results[-1]))
+                    continue
+                if answer == "p":
+                    page_starts.pop()
+                    continue
+                if answer == "b":
+                    self.search_documents(keyword, "content")
+                    return
+
+                record = search_results[int(answer) - first_index]
                 self.show_info(record[0])
                 self.get_command_for_record(record[0])
 
@@ -294,21 +544,26 @@ Quit        - quit bookshelf and exit
             print("")
             return
 
-    def print_search_result(self, keyword, search_results, fuzzy_search):
+    # 'snippets' ({rowid: text}) are shown under the records of a search of
+    # the document text
+    def print_search_result(
+        self, keyword, search_results, first_index=1, page=1, snippets=None
+    ):
         print("")
         bookshelf.util.print_horizontal_line("-")
-        print(f"{self.icon_info}  Records found with: {keyword}")
+        where = " in document text" if snippets is not None else ""
+        if page > 1:
+            print(f"{self.icon_info}  Records found{where} with: {keyword} (page {page})")
+        else:
+            print(f"{self.icon_info}  Records found{where} with: {keyword}")
         bookshelf.util.print_horizontal_line("-")
 
-        file_counter = 1
         file_indices = []
-        for result in search_results:
-            if fuzzy_search == True:
-                print(f"[{file_counter}] {result[2]}")
-            else:
-                print(f"[{file_counter}] {result[4]}: {result[2]}")
-            file_indices = file_indices + [str(file_counter)]
-            file_counter += 1
+        for file_counter, result in enumerate(search_results, first_index):
+            print(f"[{file_counter}] {result[4]}: {result[2]}")
+            if snippets is not None and result[-1] in snippets:
+                bookshelf.util.print_wrapped(f"      {snippets[result[-1]]}")
+            file_indices.append(str(file_counter))
 
         bookshelf.util.print_horizontal_line("-")
         return file_indices
@@ -320,7 +575,11 @@ Quit        - quit bookshelf and exit
         _, ext = os.path.splitext(record[1])
         filename = bookshelf.util.make_safe_filename(record[2]) + ext
         dst_path = os.path.join(self.root_dir, self.inbox_dir, filename)
-        shutil.copy(src_path, dst_path)
+        method = bookshelf.store.export_file(
+            src_path, dst_path, os.path.join(self.root_dir, self.files_dir),
+            self.transfer_strategy,
+        )
+        print(f"{self.icon_info}  Copied to {dst_path} ({method})")
 
     def open_file(self, identifier):
         record = self.get_record_with_id(identifier)
@@ -387,36 +646,151 @@ Copy file to inbox - copy the file to inbox
         """)
 
     # Query Document
-    def query_documents(self, keyword, fuzzy_search):
-        if fuzzy_search == True:
-            return bookshelf.fuzzy.fuzzy_search_fts(
-                os.path.join(self.root_dir, self.db_filename), self.table_name, keyword
+    # - fts: ranked word search on the full-text index.  The 'fts' search
+    #   mode of the configuration searches substrings first (see
+    #   resolve_search_mode).
+    # - substring: substring search on the trigram index (same matches as
+    #   LIKE '%keyword%').
+    # - like: plain LIKE scan of the table.
+    # - content: word search on the text of the files (see bookshelf.content).
+    # Substring searches shorter than 3 characters cannot use the trigram
+    # index and fall back to the LIKE scan.
+    #
+    # Returns a cursor over full rows, each followed by its keyset
+    # (score, rowid).  Pass the key of the last row seen as 'after' to
+    # continue from there; 'limit' caps the number of rows (-1: no limit)
+    # and 'offset' skips rows.
+    def query_documents(self, keyword, mode="fts", after=None, limit=-1, offset=0):
+        if mode == "content":
+            from bookshelf import content
+
+            return content.search_content(
+                self.db_path, self.table_name, keyword, after, limit, offset
             )
 
-        self.cursor.execute(
-            f"""SELECT * FROM {self.table_name} WHERE
-            title LIKE ? OR
+        if mode == "fts":
+            return bookshelf.fuzzy.search_fts(
+                self.db_path, self.table_name, keyword, after, limit, offset
+            )
+
+        if (
+            mode == "substring"
+            and len(keyword.strip()) >= bookshelf.fuzzy.TRIGRAM_MIN_LENGTH
+        ):
+            return bookshelf.fuzzy.search_substring(
+                self.db_path, self.table_name, keyword, after, limit, offset
+            )
+
+        keyset = ""
+        params = [f"%{keyword}%"] * 4
+        if after is not None:
+            keyset = "AND rowid > ?"
+            params.append(after[1])
+        params += [limit, offset]
+
+        return self.conn.execute(
+            f"""SELECT *, 0.0, rowid FROM {self.table_name} WHERE
+            (title LIKE ? OR
             authors LIKE ? OR
             keywords LIKE ? OR
-            description LIKE ?""",
-            (f"%{keyword}%", f"%{keyword}%", f"%{keyword}%", f"%{keyword}%"),
+            description LIKE ?) {keyset}
+            ORDER BY rowid
+            LIMIT ? OFFSET ?""",
+            params,
         )
-        return self.cursor.fetchall()
+
+    # Get the search mode to use for a keyword.
+    # In 'fts' mode, the keyword is searched as a substring on the trigram
+    # index, which finds everything a LIKE scan finds ('loom' in 'bloom
+    # filter'), ranked.  A keyword without any substring match is searched
+    # word by word instead (e.g. 'filter bloom'); all pages of the search
+    # must then come from that mode.  Keywords too short for the trigram
+    # index are answered by the LIKE scan.
+    def resolve_search_mode(self, keyword):
+        if self.search_mode != "fts":
+            return self.search_mode
+        if len(keyword.strip()) < bookshelf.fuzzy.TRIGRAM_MIN_LENGTH:
+            return "like"
+        first = next(iter(self.query_documents(keyword, "substring", limit=1)), None)
+        return "fts" if first is None else "substring"
+
+    # True when the text of some files has been indexed
+    # ('bookshelf content update')
+    def has_content_index(self):
+        from bookshelf import content
+
+        return content.has_content(self.conn)
+
+    # Text around the match of 'keyword' in the files of the rows of a
+    # content search, by rowid; matches are shown in bold
+    def get_content_snippets(self, keyword, search_results):
+        from bookshelf import content
+
+        return content.snippets(
+            self.db_path, self.table_name, keyword,
+            (row[-1] for row in search_results), mark=("\033[1m", "\033[0m"),
+        )
+
+    # Names of the columns of the documents table
+    def get_columns(self):
+        cursor = self.conn.execute(f"SELECT * FROM {self.table_name} LIMIT 0")
+        return [d[0] for d in cursor.description]
+
+    # Search and yield the values of 'fields' of every matching record, one
+    # row at a time as it comes off the cursor.  Also returns the field list,
+    # which defaults to all columns.
+    def iter_search_results(self, keyword, fields=None, limit=-1, offset=0):
+        columns = self.get_columns()
+        fields = fields or columns
+        unknown = [f for f in fields if f not in columns]
+        if len(unknown) > 0:
+            raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+        positions = [columns.index(f) for f in fields]
+
+        mode = self.resolve_search_mode(keyword)
+        cursor = self.query_documents(keyword, mode, limit=limit, offset=offset)
+
+        def rows():
+            for row in cursor:
+                # Rows end with their keyset (score, rowid); cache the rest
+                self.record_cache.put(row[:-2])
+                yield [row[i] for i in positions]
+
+        return fields, rows()
+
+    # Write search results to 'out' in a machine-readable format, so memory
+    # use does not depend on the number of matches.  Returns the number of
+    # rows written.
+    def stream_search_results(
+        self, keyword, fmt="ndjson", fields=None, limit=-1, offset=0, out=None
+    ):
+        fields, rows = self.iter_search_results(keyword, fields, limit, offset)
+        return write_records(out or sys.stdout, fmt, fields, rows)
 
     def get_record_with_id(self, identifier):
         print(f"ID: {identifier}")
-        self.cursor.execute(
-            f"SELECT * FROM {self.table_name} WHERE id = ?;", (identifier,)
-        )
-        records = self.cursor.fetchall()
-        if len(records) == 0:
+        record = self.find_record(identifier)
+        if record is None:
             raise Exception(
                 bookshelf.util.make_bold_green(
                     f"{self.icon_err}  No record with the identifier in db"
                 )
             )
+        return record
+
+    # The record with 'identifier', or None, without printing anything
+    # (e.g. for the daemon)
+    def find_record(self, identifier):
+        record = self.record_cache.get(identifier)
+        if record is not None:
+            return record
 
-        return records[0]
+        record = self.conn.execute(
+            f"SELECT * FROM {self.table_name} WHERE id = ?;", (identifier,)
+        ).fetchone()
+        if record is not None:
+            self.record_cache.put(record)
+        return record
 
     # Delete a record
     def remove_record(self, identifier):
@@ -425,6 +799,7 @@ Copy file to inbox - copy the file to inbox
                 f"DELETE FROM {self.table_name} WHERE id = ?;", (identifier,)
             )
             self.conn.commit()
+            self.record_cache.invalidate(identifier)
             print(f"{self.icon_info}  Record deleted successfully")
 
         except sqlite3.Error as e:
@@ -458,7 +833,16 @@ Copy file to inbox - copy the file to inbox
             dst = os.path.join(self.root_dir, self.files_dir, record[0][0:2], record[1])
             print(f"SRC: {src}")
             print(f"DST: {dst}")
-            shutil.copy(src, dst)
+            md = Metadata(*record[1:7])
+            method = self.store_file(src, dst, md)
+            print(f"{self.icon_info}  File replaced ({method})")
+            self.cursor.execute(
+                f"UPDATE {self.table_name} SET sha256 = ?, size = ?, mtime_ns = ?"
+                f" WHERE id = ?;",
+                (md.sha256, md.size, md.mtime_ns, identifier),
+            )
+            self.conn.commit()
+            self.record_cache.invalidate(identifier)
         else:
             print(
                 bookshelf.util.make_bold_green(
@@ -468,6 +852,8 @@ Copy file to inbox - copy the file to inbox
 
     # Open document
     def open_document(self, filename):
+        import subprocess
+
         subprocess.run(["open", f"{filename}"])
 
     # Edit record
@@ -491,6 +877,38 @@ Copy file to inbox - copy the file to inbox
         )
         self.cursor.execute(sql_update_query, data)
         self.conn.commit()
+        self.record_cache.invalidate(identifier)
+
+    # Go through the records added by 'watch' (see bookshelf.watch), oldest
+    # first, to check and complete their metadata
+    def review_documents(self):
+        from bookshelf.watch import mark_reviewed, review_queue
+
+        queue = review_queue(self.conn, self.table_name)
+        if len(queue) == 0:
+            print(f"{self.icon_info}  Nothing to review")
+            return
+        for n, (identifier, source) in enumerate(queue, 1):
+            print(f"\n{self.icon_info}  [{n}/{len(queue)}] From {source}")
+            self.show_info(identifier)
+            answer = bookshelf.util.closed_ended_question(
+                msg=f"{self.icon_keyboard}  (e)dit, (k)eep as is, (o)pen, "
+                f"(s)kip for now, or (q)uit",
+                options=["e", "k", "o", "s", "q"],
+            )
+            if answer == "o":
+                self.open_file(identifier)
+                answer = bookshelf.util.closed_ended_question(
+                    msg=f"{self.icon_keyboard}  (e)dit, (k)eep as is, "
+                    f"(s)kip for now, or (q)uit",
+                    options=["e", "k", "s", "q"],
+                )
+            if answer == "q":
+                return
+            if answer == "e":
+                self.edit_record(identifier)
+            if answer in ("e", "k"):
+                mark_reviewed(self.conn, identifier)
 
     # Show info
     def show_info(self, identifier):
@@ -504,9 +922,9 @@ Copy file to inbox - copy the file to inbox
         bookshelf.util.print_wrapped(f" Description: {record[6]}")
 
     # Get metadata interactively
-    def get_metadata(self, filename):
+    def get_metadata(self, filename, prefill=None):
         metadata = ["", "", "", "", ""]
-        self.edit_metadata(filename, metadata)
+        self.edit_metadata(filename, metadata, prefill)
 
         return Metadata(
             filename,
@@ -517,6 +935,119 @@ Copy file to inbox - copy the file to inbox
             metadata[4],
         )
 
+    # Rebuild the FTS index from scratch
+    def rebuild_fts(self):
+        print(f"{self.icon_info}  Rebuilding full-text index ...")
+        bookshelf.fuzzy.rebuild_fts(self.db_path, self.table_name)
+        print(f"{self.icon_info}  Full-text index rebuilt")
+
+    # Check the FTS index against the table
+    def check_fts(self):
+        problems = bookshelf.fuzzy.check_fts(self.db_path, self.table_name)
+        if len(problems) == 0:
+            print(f"{self.icon_info}  Full-text index is consistent")
+            return
+
+        for problem in problems:
+            print(bookshelf.util.make_bold_red(f"{self.icon_err}  {problem}"))
+        print(f"{self.icon_info}  Run 'bookshelf fts rebuild' to fix the index")
+
+    # Record the hash, size and mtime of files stored before these were kept.
+    # With 'verify', re-read every file and compare it with its recorded hash.
+    # Entries of the hash cache whose file is gone or changed are dropped.
+    # Returns the ids of the records whose file is missing or changed.
+    def update_hashes(self, verify=False):
+        condition = "" if verify else "WHERE sha256 IS NULL"
+        records = self.conn.execute(
+            f"SELECT id, filename, sha256 FROM {self.table_name} {condition};"
+        ).fetchall()
+        print(f"{self.icon_info}  Hashing {len(records)} files ...")
+
+        problems = []
+        updated = 0
+        for identifier, filename, recorded in records:
+            path = os.path.join(self.root_dir, self.files_dir, filename[0:2], filename)
+            if not os.path.isfile(path):
+                print(bookshelf.util.make_bold_red(
+                    f"{self.icon_err}  Missing file: {filename}"))
+                problems.append(identifier)
+                continue
+
+            digest = bookshelf.util.sha256_file(path)
+            if recorded is not None:
+                if digest != recorded:
+                    print(bookshelf.util.make_bold_red(
+                        f"{self.icon_err}  Content changed: {filename}"))
+                    problems.append(identifier)
+                continue
+
+            st = os.stat(path)
+            self.conn.execute(
+                f"UPDATE {self.table_name} SET sha256 = ?, size = ?, mtime_ns = ?"
+                f" WHERE id = ?;",
+                (digest, st.st_size, st.st_mtime_ns, identifier),
+            )
+            updated += 1
+        self.conn.commit()
+        self.record_cache.clear()
+        pruned = self.hash_cache.prune()
+
+        print(f"{self.icon_info}  {updated} hashes recorded, {len(problems)} problems")
+        if pruned:
+            print(f"{self.icon_info}  {pruned} stale entries dropped from the hash cache")
+        return problems
+
+    # 'cas' once the store has an objects directory, whatever the setting
+    def get_storage_layout(self):
+        files_path = os.path.join(self.root_dir, self.files_dir)
+        if bookshelf.store.is_content_addressed(files_path):
+            return "cas"
+        return "uuid"
+
+    # Convert the file store to the content-addressed layout in place:
+    # identical files are replaced by links to one blob.  Hashes computed on
+    # the way are recorded.
+    def migrate_store(self):
+        records = self.conn.execute(
+            f"SELECT filename, sha256 FROM {self.table_name};"
+        ).fetchall()
+        print(f"{self.icon_info}  Converting {len(records)} files ...")
+        stats = bookshelf.store.migrate(
+            os.path.join(self.root_dir, self.files_dir), records
+        )
+
+        for filename, (digest, size) in stats.hashed.items():
+            path = os.path.join(self.root_dir, self.files_dir, filename[0:2], filename)
+            self.conn.execute(
+                f"UPDATE {self.table_name} SET sha256 = ?, size = ?, mtime_ns = ?"
+                f" WHERE filename = ?;",
+                (digest, size, os.stat(path).st_mtime_ns, filename),
+            )
+        self.conn.commit()
+        self.record_cache.clear()
+
+        for filename in stats.missing:
+            print(bookshelf.util.make_bold_red(
+                f"{self.icon_err}  Missing file: {filename}"))
+        print(
+            f"{self.icon_info}  {stats.linked} files in the content-addressed store,"
+            f" {stats.deduplicated} duplicates linked"
+            f" ({stats.bytes_saved / (1 << 20):.1f} MiB saved)"
+        )
+        if self.storage_mode != "cas":
+            print(f"{self.icon_info}  New files are stored as blobs from now on;"
+                  " set storage_mode = cas in the config file to match")
+        return stats
+
+    # Remove blobs that no record links to any more
+    def gc_store(self):
+        removed, freed = bookshelf.store.gc(
+            os.path.join(self.root_dir, self.files_dir)
+        )
+        print(f"{self.icon_info}  Removed {removed} unused blobs"
+              f" ({freed / (1 << 20):.1f} MiB)")
+        return removed
+
     # Get list of categories, i.e., sub-directories excluding the 'inbox'
     def get_categories(self):
         categories = bookshelf.util.scandir(self.root_dir)
@@ -526,33 +1057,174 @@ Copy file to inbox - copy the file to inbox
 
 
 def interactive_main():
+    setup_readline()
     bookshelf = Bookshelf()
     bookshelf.show_main_menu()
 
 
 def add_document(filename):
+    setup_readline()
     bookshelf = Bookshelf()
     bookshelf.add_document(filename)
     bookshelf.show_main_menu()
 
 
 def search_documents(keyword):
+    setup_readline()
     bookshelf = Bookshelf()
     bookshelf.search_documents(keyword)
     bookshelf.show_main_menu()
 
 
+def build_search_parser():
+    import argparse
+
+    p = argparse.ArgumentParser(
+        prog="bookshelf search",
+        description="Search documents by keyword.",
+    )
+    p.add_argument("keyword", help="Keyword to search for")
+    p.add_argument("--format", choices=OUTPUT_FORMATS,
+                   help="Write machine-readable results to stdout, no prompts")
+    p.add_argument("--limit", type=int, default=-1,
+                   help="Maximum number of records to write")
+    p.add_argument("--offset", type=int, default=0,
+                   help="Number of matching records to skip")
+    p.add_argument("--fields",
+                   help="Comma-separated list of fields to write, e.g. id,title")
+    return p
+
+
+def search_cli(argv):
+    args = build_search_parser().parse_args(argv)
+    keyword = args.keyword.lower()
+    if len(keyword) == 0:
+        return
+
+    # Without --format, this is the interactive quick search
+    if args.format is None:
+        search_documents(keyword)
+        return
+
+    fields = None
+    if args.fields:
+        fields = [f.strip() for f in args.fields.split(",") if f.strip()]
+
+    try:
+        # A running daemon answers without opening the shelf here
+        if forward_search(keyword, args.format, fields, args.limit, args.offset):
+            return
+
+        bookshelf = Bookshelf(show_banner=False)
+        bookshelf.stream_search_results(
+            keyword, args.format, fields, args.limit, args.offset
+        )
+    except ValueError as e:
+        print(f"[ERROR] {e}", file=sys.stderr)
+        sys.exit(2)
+    except BrokenPipeError:
+        # The reader (e.g. 'head') went away; stop quietly
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+
+# Send a search to the daemon, if one is running, and write its results.
+# Returns False if there is no daemon to forward to, or it does not answer
+# in time (see bookshelf.daemon).
+def forward_search(keyword, fmt, fields, limit, offset):
+    import bookshelf.daemon
+
+    client = bookshelf.daemon.connect()
+    if client is None:
+        return False
+    with client:
+        try:
+            try:
+                fields, rows = client.search(keyword, fields, limit, offset)
+            except OSError:
+                # Busy or gone since the ping: nothing written yet, search here
+                return False
+            write_records(sys.stdout, fmt, fields, rows)
+        except bookshelf.daemon.DaemonError as e:
+            raise ValueError(str(e)) from None
+    return True
+
+
+def serve(command):
+    import bookshelf.daemon
+
+    if command == "":
+        bookshelf.daemon.serve()
+        return
+
+    client = bookshelf.daemon.connect()
+    if client is None:
+        print("[INFO] No daemon is running")
+        return
+    with client:
+        if command == "status":
+            reply = client.call("ping")
+            print(f"[INFO] Daemon {reply['pid']} is serving {reply['db']}")
+        elif command == "stop":
+            client.call("shutdown")
+            print("[INFO] Daemon stopped")
+        else:
+            print_usage()
+
+
+def manage_fts(command):
+    bookshelf = Bookshelf()
+    if command == "rebuild":
+        bookshelf.rebuild_fts()
+    elif command == "check":
+        bookshelf.check_fts()
+    else:
+        print_usage()
+
+
+def manage_hashes(command):
+    bookshelf = Bookshelf()
+    if command == "update":
+        bookshelf.update_hashes()
+    elif command == "verify":
+        if bookshelf.update_hashes(verify=True):
+            sys.exit(1)
+    else:
+        print_usage()
+
+
+def manage_store(command):
+    bookshelf = Bookshelf()
+    if command == "migrate":
+        bookshelf.migrate_store()
+    elif command == "gc":
+        bookshelf.gc_store()
+    else:
+        print_usage()
+
+
 def print_usage():
     print("[USAGE]")
     print("  For interactive mode: bookshelf")
     print("  For quick addition:   bookshelf add (or -a) file_name")
     print("  For quick search:     bookshelf search (or -s) keyword")
+    print("  For bulk import:      bookshelf import directory \\ ")
+    print("                        [--metadata list.csv|list.json] [--jobs N]")
+    print("  For the inbox:        bookshelf watch [--once] [--interval S]")
+    print("  For added records:    bookshelf review")
+    print("  For scripts:          bookshelf search keyword \\ ")
+    print("                        --format ndjson|tsv|json \\ ")
+    print("                        [--limit N] [--offset N] [--fields id,title]")
     print("  For merge (dry-run):  bookshelf merge \\ ")
     print("                        --primary-db ~/bookshelf/_database.db \\ ")
     print("                        --primary-files ~/bookshelf/files \\ ")
     print("                        --secondary-db ~/other/_database.db \\ ")
     print("                        --secondary-files ~/other/files \\ ")
     print("                        --dry-run ")
+    print("  For FTS maintenance:  bookshelf fts rebuild|check")
+    print("  For file hashes:      bookshelf hash update|verify")
+    print("  For document text:    bookshelf content update|status|rebuild")
+    print("  For the file store:   bookshelf store migrate|gc")
+    print("  For a query daemon:   bookshelf serve [status|stop]")
     print("  For help:             bookshelf help (or -h)")
 
 
@@ -567,14 +1239,39 @@ def main() -> None:
             add_document(file_path)
 
     elif sys.argv[1] == "search" or sys.argv[1] == "-s":
-        keyword = sys.argv[2]
-        if len(keyword) > 0:
-            search_documents(keyword.lower())
+        search_cli(sys.argv[2:])
+
+    elif sys.argv[1] == "import":
+        from bookshelf.ingest import run_import_cli
+        run_import_cli(sys.argv[2:])
+
+    elif sys.argv[1] == "content":
+        from bookshelf.content import run_content_cli
+        run_content_cli(sys.argv[2:])
+
+    elif sys.argv[1] == "watch":
+        from bookshelf.watch import run_watch_cli
+        run_watch_cli(sys.argv[2:])
+
+    elif sys.argv[1] == "review":
+        Bookshelf().review_documents()
 
     elif sys.argv[1] == "merge":
         from bookshelf.merge import run_merge_cli
         run_merge_cli(sys.argv[2:])
 
+    elif sys.argv[1] == "fts":
+        manage_fts(sys.argv[2] if len(sys.argv) > 2 else "")
+
+    elif sys.argv[1] == "hash":
+        manage_hashes(sys.argv[2] if len(sys.argv) > 2 else "")
+
+    elif sys.argv[1] == "store":
+        manage_store(sys.argv[2] if len(sys.argv) > 2 else "")
+
+    elif sys.argv[1] == "serve":
+        serve(sys.argv[2] if len(sys.argv) > 2 else "")
+
     elif sys.argv[1] == "help" or sys.argv[1] == "-h":
         print_usage()
 
@@ -0,0 +1,88 @@
+"""
+bookshelf/cache.py
+
+In-process LRU cache of records keyed by id.
+
+An interactive session looks the same record up several times in a row
+(show_info, then open_file / edit_record / ...), and re-displays the same
+search page after every action.  The cache answers those lookups without
+running a query.
+
+Invalidation:
+  * The app's own writes call invalidate() (or clear()) explicitly.
+  * Writes by other processes are detected with PRAGMA data_version, whose
+    value changes whenever another connection commits to the database.
+    The pragma only reads a counter in memory, so the check is cheap.
+"""
+
+from __future__ import annotations
+
+import sqlite3
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+RECORD_CACHE_SIZE_DEFAULT = 256
+
+
+class RecordCache:
+
+    def __init__(self, conn: sqlite3.Connection,
+                 max_size: int = RECORD_CACHE_SIZE_DEFAULT):
+        self._conn = conn
+        self._max_size = max(0, max_size)
+        self._records: OrderedDict[str, tuple] = OrderedDict()
+        self._data_version: Optional[int] = None
+        # Incremented whenever cached data may have become stale, so callers
+        # holding derived data (e.g. a page of search results) can tell
+        # whether it is still valid.
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _check_data_version(self):
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._data_version:
+            if self._data_version is not None:
+                self.clear()
+            self._data_version = version
+
+    def validate(self) -> int:
+        """Drop everything if another process wrote; return the generation."""
+        self._check_data_version()
+        return self.generation
+
+    def get(self, identifier: str) -> Optional[tuple]:
+        self._check_data_version()
+        record = self._records.get(identifier)
+        if record is None:
+            self.misses += 1
+            return None
+        self._records.move_to_end(identifier)
+        self.hits += 1
+        return record
+
+    def put(self, record: tuple):
+        """Store a full row; its first column is the id."""
+        if self._max_size == 0:
+            return
+        self._records[record[0]] = record
+        self._records.move_to_end(record[0])
+        while len(self._records) > self._max_size:
+            self._records.popitem(last=False)
+
+    def put_many(self, records: Iterable[tuple]):
+        self._check_data_version()
+        for record in records:
+            self.put(record)
+
+    def invalidate(self, identifier: str):
+        """Forget one record after the app itself changed it."""
+        self._records.pop(identifier, None)
+        self.generation += 1
+
+    def clear(self):
+        self._records.clear()
+        self.generation += 1
+
+    def __len__(self):
+        return len(self._records)
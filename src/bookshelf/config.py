@@ -0,0 +1,49 @@
+import configparser
+import os
+
+# Default values of the [settings] section.  Every key can be overridden in
+# $HOME/.config/bookshelf/config.ini
+DEFAULT_SETTINGS = {
+    "root_directory": "~/bookshelf",
+    "db_filename": "_database.db",
+    "table_name": "docs",
+    "inbox_directory": "inbox",
+    "files_directory": "files",
+    # Keyword search: 'fts' (ranked words), 'substring' or 'like' (table scan)
+    "search_mode": "fts",
+    # Number of search results shown per page
+    "page_size": "20",
+    # Number of records kept in the in-process LRU cache (0 disables it)
+    "record_cache_size": "256",
+    # Layout of new file stores: 'uuid' (one copy per record) or 'cas'
+    # (one blob per content, shared via hard links; see bookshelf.store)
+    "storage_mode": "uuid",
+    # How files are copied: 'auto' (reflink, then in-kernel copy, then a
+    # buffered copy), or one of them (see bookshelf.transfer)
+    "transfer_strategy": "auto",
+    # SQLite connection tuning (see bookshelf.db)
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "cache_size_kib": "65536",
+    "mmap_size_mib": "256",
+    "busy_timeout_ms": "5000",
+    # Unix socket of 'bookshelf serve' (see bookshelf.daemon)
+    "socket_path": "~/.config/bookshelf/daemon.sock",
+}
+
+
+# Path of the configuration file
+def get_config_path():
+    return os.path.join(os.path.expanduser("~"), ".config/bookshelf/config.ini")
+
+
+# Load default settings, then override them using the config file.
+def load_config():
+    config = configparser.ConfigParser()
+    config["settings"] = dict(DEFAULT_SETTINGS)
+
+    config_path = get_config_path()
+    if os.path.exists(config_path):
+        config.read(config_path)
+
+    return config
@@ -0,0 +1,411 @@
+"""
+bookshelf/content.py
+
+Full-text index of the documents' contents, next to the metadata indexes.
+
+Tables (in the shelf database):
+  bookshelf_content        FTS5 table of the extracted text, one row per
+                           distinct file content
+  bookshelf_content_files  docid (= rowid in bookshelf_content), sha256 of the
+                           content, extraction status, page count, error
+
+Contents are tracked by their SHA-256 (the sha256 column of the documents
+table), not by record: identical files are extracted once, a replaced file
+gets a new hash and is extracted again, and text whose hash no record has
+any more is dropped.  'update' therefore only processes new or replaced
+files, and records without a hash are skipped (see 'bookshelf hash update').
+
+Extraction (PDF with pypdf, plain text) runs on a pool of sandboxed worker
+processes (bookshelf.extract), since pypdf is pure Python and single-core,
+and a file that hangs, runs out of memory or crashes its worker must only
+fail itself; the parent only writes the results, in batched transactions.
+Extracted text also goes to the text cache (bookshelf.textcache), so a
+content already extracted, e.g. by an earlier index or a merge, is not
+parsed again; 'rebuild' re-indexes from the cache and only retries the
+files that failed.  'bookshelf content update' runs it in the foreground;
+the query daemon runs it in the background when it starts and after every
+'add'.
+
+Searching matches the words of the keyword as prefixes, like the metadata
+search, and returns the matching records ranked by bm25, with the keyset
+(score, rowid) of bookshelf.fuzzy so the results page the same way.
+snippets() gives the context of the match for each record shown.
+
+Usage:
+    bookshelf content update [--jobs 4] [--timeout 60] [--memory-limit 2048]
+    bookshelf content status
+    bookshelf content rebuild
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import os
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import bookshelf.db as db
+from bookshelf.extract import (
+    JOBS_DEFAULT,
+    MEMORY_LIMIT_DEFAULT,
+    TIMEOUT_DEFAULT,
+    ExtractionPool,
+    ExtractResult,
+)
+from bookshelf.textcache import TextCache, forget_errors, is_cacheable
+
+# ---------------------------------------------------------------------------
+# Constants & tuneable defaults
+# ---------------------------------------------------------------------------
+
+# Results written per transaction
+BATCH_SIZE = 50
+# Seconds between two progress lines
+PROGRESS_INTERVAL = 2.0
+# Tokens of context around a match in a snippet
+SNIPPET_TOKENS = 12
+
+TEXT_EXTENSIONS = (".txt", ".md")
+
+# Extraction statuses kept in bookshelf_content_files
+STATUS_OK = "ok"
+STATUS_EMPTY = "empty"      # no text layer, e.g. a scanned PDF
+STATUS_ERROR = "error"
+
+ICON_INFO = "\uf02d"
+ICON_WARN = "\uea6c"
+
+# pypdf is optional; only its presence is checked here
+_PYPDF_AVAILABLE = importlib.util.find_spec("pypdf") is not None
+
+
+@dataclass
+class UpdateStats:
+    indexed: int = 0
+    empty: int = 0
+    errors: int = 0
+    skipped: int = 0        # missing file or unsupported type
+    cached: int = 0         # text found in the text cache, not extracted
+    removed: int = 0        # contents no record refers to any more
+    elapsed: float = 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{ICON_INFO}  Content index: {self.indexed} indexed, "
+            f"{self.empty} without text, {self.errors} failed, "
+            f"{self.skipped} skipped, {self.removed} removed, "
+            f"{self.cached} from the text cache "
+            f"in {self.elapsed:.1f} s"
+        )
+
+
+# ---------------------------------------------------------------------------
+# Extraction
+# ---------------------------------------------------------------------------
+
+def can_extract(filename: str) -> bool:
+    ext = os.path.splitext(filename)[1].lower()
+    return ext in TEXT_EXTENSIONS or (ext == ".pdf" and _PYPDF_AVAILABLE)
+
+
+def _status(entry: ExtractResult) -> str:
+    if entry.error is not None:
+        return STATUS_ERROR
+    return STATUS_OK if entry.text else STATUS_EMPTY
+
+
+# ---------------------------------------------------------------------------
+# Schema
+# ---------------------------------------------------------------------------
+
+def setup_content(conn):
+    conn.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS bookshelf_content
+    USING fts5(body, tokenize='unicode61 remove_diacritics 2');
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS bookshelf_content_files (
+        docid INTEGER PRIMARY KEY,
+        sha256 TEXT NOT NULL UNIQUE,
+        status TEXT NOT NULL,
+        pages INTEGER,
+        error TEXT
+    );
+    """)
+    conn.commit()
+
+
+def has_content(conn) -> bool:
+    """True once any text has been indexed."""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'bookshelf_content_files';"
+    ).fetchone()
+    return exists is not None and conn.execute(
+        "SELECT 1 FROM bookshelf_content_files WHERE status = ? LIMIT 1;",
+        (STATUS_OK,),
+    ).fetchone() is not None
+
+
+def drop_content(conn):
+    conn.execute("DROP TABLE IF EXISTS bookshelf_content;")
+    conn.execute("DROP TABLE IF EXISTS bookshelf_content_files;")
+    conn.commit()
+
+
+# ---------------------------------------------------------------------------
+# Update
+# ---------------------------------------------------------------------------
+
+def pending_files(conn, table: str) -> List[Tuple[str, str]]:
+    """(sha256, filename) of each content not processed yet, one file each."""
+    return conn.execute(f"""
+    SELECT d.sha256, MIN(d.filename) FROM {table} d
+    LEFT JOIN bookshelf_content_files f ON f.sha256 = d.sha256
+    WHERE d.sha256 IS NOT NULL AND f.sha256 IS NULL
+    GROUP BY d.sha256
+    ORDER BY MIN(d.rowid);
+    """).fetchall()
+
+
+def remove_stale(conn, table: str) -> int:
+    """Drop the text of contents no record has any more."""
+    stale = [row[0] for row in conn.execute(f"""
+    SELECT docid FROM bookshelf_content_files
+    WHERE sha256 NOT IN (SELECT sha256 FROM {table} WHERE sha256 IS NOT NULL);
+    """)]
+    with conn:
+        conn.executemany(
+            "DELETE FROM bookshelf_content WHERE rowid = ?;", ((d,) for d in stale)
+        )
+        conn.executemany(
+            "DELETE FROM bookshelf_content_files WHERE docid = ?;",
+            ((d,) for d in stale),
+        )
+    return len(stale)
+
+
+def _store(conn, sha256: str, entry: ExtractResult) -> str:
+    status = _status(entry)
+    # Every content gets a row, empty without text, so the docids of both
+    # tables come from the same sequence
+    docid = conn.execute(
+        "INSERT INTO bookshelf_content(body) VALUES (?);", (entry.text,)
+    ).lastrowid
+    conn.execute(
+        "INSERT INTO bookshelf_content_files(docid, sha256, status, pages, error)"
+        " VALUES (?, ?, ?, ?, ?);",
+        (docid, sha256, status, entry.pages,
+         entry.error and f"{entry.error}: {entry.message}"),
+    )
+    return status
+
+
+def update_content(
+    db_path: str,
+    table: str,
+    files_dir: str,
+    jobs: int = JOBS_DEFAULT,
+    out=None,
+    stop: Optional[threading.Event] = None,
+    timeout: float = TIMEOUT_DEFAULT,
+    memory_limit: int = MEMORY_LIMIT_DEFAULT,
+) -> UpdateStats:
+    """Extract and index every content not indexed yet.
+
+    Each file gets *timeout* seconds and *memory_limit* MiB in its worker
+    (see bookshelf.extract).  A file the extraction code fails on is
+    recorded as failed; one that times out or crashes its worker only fails
+    this run and stays pending for the next.
+    Setting *stop* (from another thread) ends the update at the next result,
+    killing the files still being extracted; what was extracted so far is
+    kept.
+    """
+    conn = db.get_connection(db_path)
+    setup_content(conn)
+    cache = TextCache(conn)
+    stats = UpdateStats()
+    start = time.perf_counter()
+    stats.removed = remove_stale(conn, table)
+
+    def record(sha256: str, entry: ExtractResult):
+        status = _store(conn, sha256, entry)
+        stats.indexed += status == STATUS_OK
+        stats.empty += status == STATUS_EMPTY
+        stats.errors += status == STATUS_ERROR
+
+    work = []
+    for sha256, filename in pending_files(conn, table):
+        path = os.path.join(files_dir, filename[:2], filename)
+        entry = cache.get(sha256)
+        if entry is not None:
+            # Extracted before (by an earlier index, or a merge)
+            record(sha256, entry)
+            stats.cached += 1
+        elif can_extract(filename) and os.path.isfile(path):
+            work.append((sha256, path))
+        else:
+            stats.skipped += 1
+    conn.commit()
+    if out is not None and work:
+        print(f"{ICON_INFO}  Extracting the text of {len(work)} files ...", file=out)
+
+    # Results are written a batch at a time, each batch in one short
+    # transaction: none stays open while waiting on the workers, which
+    # would lock every other writer out of the shelf for that long
+    batch = []
+
+    def write_batch():
+        with conn:
+            for sha256, entry in batch:
+                if not is_cacheable(entry):
+                    # Timed out, crashed or gone: left pending for the
+                    # next update rather than recorded as failed
+                    stats.errors += 1
+                    continue
+                cache.put(sha256, entry)
+                record(sha256, entry)
+        batch.clear()
+
+    done = 0
+    last_progress = start
+    if work:
+        pool = ExtractionPool(jobs=jobs, timeout=timeout, memory_limit=memory_limit)
+        try:
+            for sha256, entry in pool.imap(work):
+                batch.append((sha256, entry))
+                done += 1
+                if len(batch) >= BATCH_SIZE:
+                    write_batch()
+
+                now = time.perf_counter()
+                if out is not None and now - last_progress >= PROGRESS_INTERVAL:
+                    last_progress = now
+                    print(f"    {done}/{len(work)} files", file=out)
+                if stop is not None and stop.is_set():
+                    break
+        finally:
+            pool.close()
+            write_batch()
+
+    stats.elapsed = time.perf_counter() - start
+    if out is not None:
+        print(stats.summary(), file=out)
+    return stats
+
+
+# ---------------------------------------------------------------------------
+# Search
+# ---------------------------------------------------------------------------
+
+def make_content_query(keyword: str) -> str:
+    # Every term quoted and matched as a prefix; all terms must occur
+    terms = ['"' + term.replace('"', '""') + '"*' for term in keyword.split()]
+    return " ".join(terms)
+
+
+def search_content(db_path: str, table: str, keyword: str,
+                   after=None, limit: int = -1, offset: int = 0):
+    """Records whose file contains the keyword, best match first; rows are
+    like those of bookshelf.fuzzy.search_fts (full row, score, rowid)."""
+    conn = db.get_connection(db_path)
+    query = make_content_query(keyword)
+    if query == "" or not has_content(conn):
+        return iter(())
+
+    score = "bm25(bookshelf_content)"
+    params = [query]
+    keyset = ""
+    if after is not None:
+        keyset = f"AND ({score} > ? OR ({score} = ? AND b.rowid > ?))"
+        params += [after[0], after[0], after[1]]
+    params += [limit, offset]
+
+    return conn.execute(f"""
+    SELECT b.*, {score} AS score, b.rowid
+    FROM bookshelf_content
+    JOIN bookshelf_content_files f ON f.docid = bookshelf_content.rowid
+    JOIN {table} b ON b.sha256 = f.sha256
+    WHERE bookshelf_content MATCH ? {keyset}
+    ORDER BY score, b.rowid
+    LIMIT ? OFFSET ?
+    """, params)
+
+
+def snippets(db_path: str, table: str, keyword: str, rowids: Iterable[int],
+             mark: Tuple[str, str] = ("[", "]")) -> Dict[int, str]:
+    """{record rowid: text around the match} for the records given."""
+    rowids = list(rowids)
+    query = make_content_query(keyword)
+    if query == "" or not rowids:
+        return {}
+    conn = db.get_connection(db_path)
+    marks = ", ".join("?" for _ in rowids)
+    return dict(conn.execute(f"""
+    SELECT b.rowid, snippet(bookshelf_content, 0, ?, ?, '...', {SNIPPET_TOKENS})
+    FROM bookshelf_content
+    JOIN bookshelf_content_files f ON f.docid = bookshelf_content.rowid
+    JOIN {table} b ON b.sha256 = f.sha256
+    WHERE bookshelf_content MATCH ? AND b.rowid IN ({marks})
+    """, [mark[0], mark[1], query, *rowids]))
+
+
+def status(db_path: str, table: str) -> Dict[str, int]:
+    """Number of contents per status, and of contents still pending."""
+    conn = db.get_connection(db_path)
+    setup_content(conn)
+    counts = dict(conn.execute(
+        "SELECT status, COUNT(*) FROM bookshelf_content_files GROUP BY status;"
+    ).fetchall())
+    counts["pending"] = len(pending_files(conn, table))
+    return counts
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def _build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(
+        prog="bookshelf content",
+        description="Maintain the full-text index of the documents' contents.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    p.add_argument("command", choices=("update", "status", "rebuild"))
+    p.add_argument("--jobs", type=int, default=JOBS_DEFAULT,
+                   help="Number of extraction worker processes")
+    p.add_argument("--timeout", type=float, default=TIMEOUT_DEFAULT,
+                   help="Seconds allowed for one file")
+    p.add_argument("--memory-limit", type=int, default=MEMORY_LIMIT_DEFAULT,
+                   help="Memory of an extraction worker, in MiB (0: no limit)")
+    return p
+
+
+def run_content_cli(argv: list[str] | None = None):
+    from bookshelf.app import Bookshelf
+
+    args = _build_parser().parse_args(argv)
+    shelf = Bookshelf(show_banner=False)
+    files_dir = os.path.join(shelf.root_dir, shelf.files_dir)
+
+    if args.command == "status":
+        counts = status(shelf.db_path, shelf.table_name)
+        print(f"{ICON_INFO}  {counts.get(STATUS_OK, 0)} files indexed, "
+              f"{counts.get(STATUS_EMPTY, 0)} without text, "
+              f"{counts.get(STATUS_ERROR, 0)} failed, "
+              f"{counts['pending']} pending")
+        return
+
+    if args.command == "rebuild":
+        # The text cache is kept, but its failures are retried
+        drop_content(shelf.conn)
+        forget_errors(shelf.conn)
+    if not _PYPDF_AVAILABLE:
+        print(f"{ICON_WARN}  pypdf is not installed: PDF files are skipped",
+              file=sys.stderr)
+    update_content(shelf.db_path, shelf.table_name, files_dir, args.jobs,
+                   out=sys.stdout, timeout=args.timeout,
+                   memory_limit=args.memory_limit)
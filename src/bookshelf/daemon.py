@@ -0,0 +1,322 @@
+"""
+bookshelf/daemon.py
+
+Optional long-lived server that answers queries over a Unix domain socket.
+
+Every 'bookshelf' command pays for the interpreter start-up, the imports,
+Bookshelf.__init__ (directories, connection, FTS check) and a cold SQLite
+page cache.  'bookshelf serve' pays for that once and then keeps the
+connection, the record cache and the FTS indexes warm, so repeated lookups
+from scripts and editor plugins take milliseconds.
+
+Protocol: one JSON object per line in each direction.  A connection carries
+one request: the daemon answers it and closes the connection (Client opens a
+connection per request).  A client that connects and sends nothing, or stops
+reading its reply, is dropped after a timeout, so it cannot hold up the
+others.
+
+    {"op": "ping"}
+        -> {"ok": true, "pid": 1234, "db": "/home/me/bookshelf/_database.db"}
+
+    {"op": "search", "keyword": "bloom", "fields": ["id", "title"],
+     "limit": 20, "offset": 0}
+        -> {"fields": ["id", "title"]}
+           {"row": ["d01f...", "Space/time trade-offs in hash coding"]}
+           ...
+           {"ok": true, "count": 1}
+
+    {"op": "get", "id": "d01f..."}
+        -> {"ok": true, "record": {"id": "d01f...", "filename": ..., ...}}
+
+    {"op": "add", "path": "/abs/path/paper.pdf", "title": ..., "authors": ...,
+     "category": ..., "keywords": ..., "description": ...}
+        -> {"ok": true, "id": "..."}
+        A file already in the shelf is refused with "duplicate_of": "<id>"
+        in the error reply, unless the request has "allow_duplicate": true.
+
+    {"op": "shutdown"}
+        -> {"ok": true}
+
+A request that fails is answered with {"ok": false, "error": "..."}.  The
+last line of every reply has an "ok" key.
+
+Requests are served one at a time on a single thread: the connection and the
+record cache belong to the thread that opened them (see bookshelf.db).
+Clients give up on a daemon that does not answer in time, and 'bookshelf
+search' then opens the shelf itself.
+
+The text of new files is indexed in the background (see bookshelf.content)
+when the daemon starts and after every 'add', on a thread with its own
+connection, so requests are answered meanwhile.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+from typing import Iterator, Optional
+
+import bookshelf.config
+
+# Field names accepted by the 'add' request
+ADD_FIELDS = ("title", "authors", "category", "keywords", "description")
+
+# Seconds a client waits for each line of a reply
+CLIENT_TIMEOUT = 5.0
+# Seconds the daemon waits for the request of a new connection, and for a
+# client to take each part of its reply
+REQUEST_TIMEOUT = 1.0
+REPLY_TIMEOUT = 10.0
+
+
+def get_socket_path(config=None) -> str:
+    """Path of the daemon socket from the [settings] section."""
+    config = config or bookshelf.config.load_config()
+    return os.path.expanduser(config["settings"]["socket_path"])
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Client
+# ─────────────────────────────────────────────────────────────────────────────
+
+class DaemonError(Exception):
+    """The daemon answered a request with an error (the reply is kept)."""
+
+    def __init__(self, reply: dict):
+        super().__init__(reply.get("error", "unknown error"))
+        self.reply = reply
+
+
+class Client:
+    """Requests to the daemon at *socket_path*, each on its own connection.
+    Waiting longer than *timeout* for a line raises TimeoutError."""
+
+    def __init__(self, socket_path: str, timeout: float = CLIENT_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def close(self):
+        pass    # connections are closed after each request
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def send(self, message: dict) -> Iterator[dict]:
+        """Send one request and yield the lines of its reply."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+            with sock.makefile("w", encoding="utf-8") as wfile:
+                wfile.write(json.dumps(message) + "\n")
+            with sock.makefile("r", encoding="utf-8") as rfile:
+                for line in rfile:
+                    reply = json.loads(line)
+                    if reply.get("ok") is False:
+                        raise DaemonError(reply)
+                    yield reply
+                    if "ok" in reply:
+                        return
+            raise ConnectionError("Daemon closed the connection")
+        finally:
+            sock.close()
+
+    def call(self, op: str, **kwargs) -> dict:
+        """Send a request with a single-line reply and return it."""
+        *_, reply = self.send(dict(op=op, **kwargs))
+        return reply
+
+    def search(self, keyword: str, fields=None, limit=-1, offset=0):
+        """Return (fields, rows) where rows is an iterator over value lists."""
+        replies = self.send({
+            "op": "search", "keyword": keyword, "fields": fields,
+            "limit": limit, "offset": offset,
+        })
+        header = next(replies)
+        if "ok" in header:
+            return [], iter(())
+        return header["fields"], (r["row"] for r in replies if "row" in r)
+
+
+def connect(socket_path: Optional[str] = None,
+            timeout: float = CLIENT_TIMEOUT) -> Optional[Client]:
+    """A client of the running daemon, or None if there is none or it does
+    not answer a ping within *timeout*."""
+    socket_path = socket_path or get_socket_path()
+    if not os.path.exists(socket_path):
+        return None
+    client = Client(socket_path, timeout)
+    try:
+        client.call("ping")
+    except (OSError, ValueError, DaemonError):
+        return None
+    return client
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Server
+# ─────────────────────────────────────────────────────────────────────────────
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    # Applies to reading the request (see module docstring)
+    timeout = REQUEST_TIMEOUT
+
+    def reply(self, message: dict):
+        self.wfile.write((json.dumps(message, ensure_ascii=False) + "\n").encode())
+
+    def handle(self):
+        try:
+            line = self.rfile.readline()
+        except OSError:
+            return      # nothing sent in time
+        if not line:
+            return
+        self.connection.settimeout(REPLY_TIMEOUT)
+        try:
+            try:
+                request = json.loads(line)
+                op = request.get("op")
+                handler = getattr(self, f"do_{op}", None)
+                if handler is None:
+                    raise ValueError(f"Unknown op: {op}")
+                handler(request)
+            except OSError:
+                raise
+            except Exception as e:
+                self.reply({"ok": False, "error": str(e)})
+            self.wfile.flush()
+        except OSError:
+            pass        # the client went away or stopped reading
+
+    def do_ping(self, request):
+        self.reply({"ok": True, "pid": os.getpid(),
+                    "db": self.server.bookshelf.db_path})
+
+    def do_search(self, request):
+        keyword = str(request.get("keyword", "")).lower()
+        fields, rows = self.server.bookshelf.iter_search_results(
+            keyword, request.get("fields"),
+            int(request.get("limit", -1)), int(request.get("offset", 0)),
+        )
+        self.reply({"fields": fields})
+        count = 0
+        for values in rows:
+            self.reply({"row": values})
+            count += 1
+        self.reply({"ok": True, "count": count})
+
+    def do_get(self, request):
+        shelf = self.server.bookshelf
+        identifier = request.get("id")
+        record = shelf.find_record(identifier)
+        if record is None:
+            raise KeyError(f"No record with id {identifier}")
+        self.reply({"ok": True, "record": dict(zip(shelf.get_columns(), record))})
+
+    def do_add(self, request):
+        from bookshelf.app import DuplicateDocumentError
+
+        path = request.get("path", "")
+        if not os.path.isabs(path) or not os.path.isfile(path):
+            raise FileNotFoundError(f"No such file (absolute path needed): {path}")
+        metadata = {key: str(request.get(key, "")) for key in ADD_FIELDS}
+        try:
+            identifier = self.server.bookshelf.add_document_with_metadata(
+                path, allow_duplicate=bool(request.get("allow_duplicate")), **metadata
+            )
+        except DuplicateDocumentError as e:
+            self.reply({"ok": False, "error": str(e), "duplicate_of": e.identifier})
+            return
+        self.reply({"ok": True, "id": identifier})
+        self.server.index_contents()
+
+    def do_shutdown(self, request):
+        self.server.running = False
+        self.reply({"ok": True})
+
+
+class _Server(socketserver.UnixStreamServer):
+
+    def __init__(self, socket_path, shelf):
+        self.bookshelf = shelf
+        self.running = True
+        self.content_thread: Optional[threading.Thread] = None
+        self.content_pending = threading.Event()
+        self.content_stop = threading.Event()
+        super().__init__(socket_path, _Handler)
+
+    def index_contents(self):
+        """Index the text of new files in the background."""
+        self.content_pending.set()
+        if self.content_thread is None or not self.content_thread.is_alive():
+            self.content_thread = threading.Thread(
+                target=self._index_contents, name="bookshelf-content", daemon=True
+            )
+            self.content_thread.start()
+
+    def _index_contents(self):
+        import bookshelf.content
+        import bookshelf.db
+
+        shelf = self.bookshelf
+        try:
+            # Files added while an update runs are picked up by the next one
+            while self.content_pending.is_set() and not self.content_stop.is_set():
+                self.content_pending.clear()
+                bookshelf.content.update_content(
+                    shelf.db_path, shelf.table_name,
+                    os.path.join(shelf.root_dir, shelf.files_dir),
+                    stop=self.content_stop,
+                )
+        except Exception as e:
+            print(f"Content indexing failed: {e}", file=sys.stderr)
+        finally:
+            bookshelf.db.close(shelf.db_path)
+
+    def stop_indexing(self, timeout=None):
+        self.content_stop.set()
+        if self.content_thread is not None:
+            self.content_thread.join(timeout)
+
+
+def serve(socket_path: Optional[str] = None, shelf=None):
+    """Serve requests until a 'shutdown' request or Ctrl-C."""
+    from bookshelf.app import Bookshelf
+
+    socket_path = socket_path or get_socket_path()
+    client = connect(socket_path)
+    if client is not None:
+        client.close()
+        raise RuntimeError(f"A daemon is already listening on {socket_path}")
+    # Left behind by a daemon that did not exit cleanly
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+
+    shelf = shelf or Bookshelf(show_banner=False)
+    old_umask = os.umask(0o077)
+    try:
+        server = _Server(socket_path, shelf)
+    finally:
+        os.umask(old_umask)
+
+    print(f"Serving {shelf.db_path} on {socket_path}", file=sys.stderr)
+    try:
+        with server:
+            server.index_contents()
+            while server.running:
+                server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server.stop_indexing()
@@ -0,0 +1,144 @@
+"""
+bookshelf/db.py
+
+Shared SQLite connections for the app, the FTS helpers and merge.
+
+Every caller asks for a connection with get_connection(db_path) instead of
+calling sqlite3.connect() itself.  Connections are opened once per database
+file and per thread, tuned with the pragmas below, and kept open until the
+process exits, so the page cache stays warm between operations.
+
+The pragmas are read from the [settings] section of config.ini:
+
+    journal_mode    = wal       # any SQLite journal mode
+    synchronous     = normal    # off | normal | full | extra
+    cache_size_kib  = 65536     # page cache size per connection
+    mmap_size_mib   = 256       # memory-mapped I/O size, 0 disables it
+    busy_timeout_ms = 5000      # wait this long for a lock held by others
+"""
+
+from __future__ import annotations
+
+import atexit
+import os
+import sqlite3
+import threading
+import urllib.parse
+from typing import Mapping, Optional
+
+import bookshelf.config
+
+_local = threading.local()
+_settings: Optional[dict] = None
+_settings_lock = threading.Lock()
+
+
+def configure(settings: Mapping[str, str]):
+    """Use *settings* (e.g. config["settings"]) for connections opened later."""
+    global _settings
+    with _settings_lock:
+        _settings = {
+            key: settings.get(key, default)
+            for key, default in bookshelf.config.DEFAULT_SETTINGS.items()
+        }
+
+
+def _get_settings() -> dict:
+    if _settings is None:
+        configure(bookshelf.config.load_config()["settings"])
+    return _settings
+
+
+def _open(db_path: str, readonly: bool) -> sqlite3.Connection:
+    settings = _get_settings()
+    busy_timeout_ms = int(settings["busy_timeout_ms"])
+
+    if readonly:
+        # '?' and '#' (and '%') in the path would be read as URI syntax
+        uri = f"file:{urllib.parse.quote(db_path)}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, timeout=busy_timeout_ms / 1000)
+    else:
+        conn = sqlite3.connect(db_path, timeout=busy_timeout_ms / 1000)
+        # journal_mode is persistent and needs write access to the file
+        conn.execute(f"PRAGMA journal_mode = {settings['journal_mode']};")
+
+    conn.execute(f"PRAGMA synchronous = {settings['synchronous']};")
+    # A negative cache_size is interpreted by SQLite as KiB, not pages
+    conn.execute(f"PRAGMA cache_size = -{int(settings['cache_size_kib'])};")
+    conn.execute(f"PRAGMA mmap_size = {int(settings['mmap_size_mib']) * 1024 * 1024};")
+    conn.execute(f"PRAGMA busy_timeout = {busy_timeout_ms};")
+    conn.execute("PRAGMA foreign_keys = ON;")
+    return conn
+
+
+def _thread_connections() -> dict:
+    conns = getattr(_local, "connections", None)
+    if conns is None:
+        conns = _local.connections = {}
+    return conns
+
+
+def get_connection(db_path: str, readonly: bool = False) -> sqlite3.Connection:
+    """
+    Return the long-lived connection to *db_path* for the calling thread,
+    opening it on first use.  Threads never share a connection, so worker
+    threads can call this freely.
+
+    readonly
+        Open the file with mode=ro and leave its journal mode untouched
+        (used for the secondary shelf of a merge).
+    """
+    conns = _thread_connections()
+    key = (os.path.realpath(db_path), readonly)
+    conn = conns.get(key)
+    if conn is None:
+        conn = _open(db_path, readonly)
+        conns[key] = conn
+    return conn
+
+
+def close(db_path: str):
+    """Close the calling thread's connections to *db_path*, if any."""
+    conns = _thread_connections()
+    path = os.path.realpath(db_path)
+    for key in [k for k in conns if k[0] == path]:
+        conns.pop(key).close()
+
+
+def close_all():
+    """Close every connection opened by the calling thread."""
+    conns = _thread_connections()
+    while conns:
+        _, conn = conns.popitem()
+        conn.close()
+
+
+atexit.register(close_all)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Schema
+# ─────────────────────────────────────────────────────────────────────────────
+
+# Columns describing the stored file of a record.  They are added to shelves
+# created by older versions when the shelf is opened, and stay NULL for old
+# records until 'bookshelf hash update' fills them in.
+FILE_COLUMNS = {"sha256": "TEXT", "size": "INTEGER", "mtime_ns": "INTEGER"}
+
+
+def table_columns(conn: sqlite3.Connection, table: str) -> list:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table});")]
+
+
+def ensure_file_columns(conn: sqlite3.Connection, table: str):
+    """Add FILE_COLUMNS and their indexes to *table* if missing."""
+    columns = table_columns(conn, table)
+    for name in FILE_COLUMNS:
+        if name not in columns:
+            conn.execute(
+                f"ALTER TABLE {table} ADD COLUMN {name} {FILE_COLUMNS[name]};"
+            )
+    # Duplicate lookups: by size first (cheap to get), then by hash
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_size ON {table}(size);")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_sha256 ON {table}(sha256);")
+    conn.commit()
@@ -0,0 +1,263 @@
+"""
+bookshelf/extract.py
+
+Sandboxed extraction of the text and metadata of files.
+
+pypdf is pure Python: a pathological PDF can loop for minutes, use gigabytes
+of memory or, through a C extension, crash the interpreter.  Every
+extraction (the content index, merge's annotated-copy check, the prefill of
+the add prompts) therefore runs in a worker process of an ExtractionPool:
+
+  * Each file has a wall-clock timeout; a worker that does not answer in
+    time is killed and replaced.
+  * Workers run with an address-space limit (RLIMIT_AS, where the platform
+    has it), so a runaway file fails with MemoryError instead of pushing the
+    machine into swap.  A worker that ran out of memory is replaced too.
+  * A worker that dies is replaced; only its file fails.
+
+Workers are started with 'spawn' (forking a process that holds SQLite
+connections and threads is not safe), lazily and at most *jobs* of them, and
+are reused across files.  Every file gives an ExtractResult: the text and
+page count, or the class of the error and its message, and the time taken.
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from multiprocessing.connection import wait
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:     # Windows
+    resource = None
+
+# ---------------------------------------------------------------------------
+# Constants & tuneable defaults
+# ---------------------------------------------------------------------------
+
+JOBS_DEFAULT = max(1, min(4, os.cpu_count() or 1))
+# Seconds a worker has for one file
+TIMEOUT_DEFAULT = 60.0
+# Address space of a worker, in MiB
+MEMORY_LIMIT_DEFAULT = 2048
+
+# What a worker extracts
+KIND_TEXT = "text"              # whole text and page count
+KIND_METADATA = "metadata"      # suggested metadata (see bookshelf.prefill)
+
+# Error classes of failures outside the extraction code
+ERROR_TIMEOUT = "Timeout"
+ERROR_CRASHED = "Crashed"
+ERROR_MISSING = "FileNotFoundError"
+
+
+@dataclass
+class ExtractResult:
+    text: str = ""
+    pages: int = 0
+    error: Optional[str] = None     # class of the error, e.g. "Timeout"
+    message: str = ""
+    seconds: float = 0.0
+    metadata: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+# ---------------------------------------------------------------------------
+# Worker process
+# ---------------------------------------------------------------------------
+
+def _limit_memory(memory_limit: int):
+    if resource is None or memory_limit <= 0:
+        return
+    limit = memory_limit << 20
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, OSError):
+        pass    # e.g. above a hard limit set by the user: keep theirs
+
+
+def run_task(kind: str, path: str) -> ExtractResult:
+    """Extract *kind* from the file at *path*, in this process."""
+    start = time.perf_counter()
+    result = ExtractResult()
+    try:
+        if kind == KIND_METADATA:
+            from bookshelf.prefill import extract_metadata
+
+            result.metadata = extract_metadata(path)
+        else:
+            from bookshelf.textcache import read_text
+
+            result.text, result.pages = read_text(path)
+    except (Exception, MemoryError) as e:
+        result = ExtractResult(error=type(e).__name__, message=str(e))
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def _worker(conn, memory_limit: int):
+    _limit_memory(memory_limit)
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if task is None:
+            return
+        conn.send(run_task(*task))
+
+
+# ---------------------------------------------------------------------------
+# Pool
+# ---------------------------------------------------------------------------
+
+class _Worker:
+
+    def __init__(self, context, memory_limit: int):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(
+            target=_worker, args=(child, memory_limit),
+            name="bookshelf-extract", daemon=True,
+        )
+        self.process.start()
+        child.close()
+        self.key: Hashable = None
+        self.started = 0.0
+
+    def submit(self, kind: str, key: Hashable, path: str):
+        self.key = key
+        self.started = time.monotonic()
+        self.conn.send((kind, path))
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self, timeout: float = 1.0):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class ExtractionPool:
+    """Worker processes extracting *kind* from files (see module docstring).
+
+    Use as a context manager, or call close(), to stop the workers.
+    """
+
+    def __init__(
+        self,
+        kind: str = KIND_TEXT,
+        jobs: int = JOBS_DEFAULT,
+        timeout: float = TIMEOUT_DEFAULT,
+        memory_limit: int = MEMORY_LIMIT_DEFAULT,
+    ):
+        self.kind = kind
+        self.jobs = max(1, jobs)
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self._context = multiprocessing.get_context("spawn")
+        self._idle: List[_Worker] = []
+        self.replaced = 0
+
+    def __enter__(self) -> "ExtractionPool":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for worker in self._idle:
+            worker.stop()
+        self._idle.clear()
+
+    def _retire(self, worker: _Worker):
+        worker.kill()
+        self.replaced += 1
+
+    def imap(
+        self, items: Iterable[Tuple[Hashable, str]]
+    ) -> Iterator[Tuple[Hashable, ExtractResult]]:
+        """(key, result) for each (key, path) of *items*, as they complete.
+
+        Abandoning the iterator kills the workers still busy, so a caller
+        can stop at any time without waiting for a slow file.
+        """
+        queue = deque(items)
+        busy: Dict[object, _Worker] = {}
+        try:
+            while queue or busy:
+                while queue and len(busy) < self.jobs:
+                    key, path = queue.popleft()
+                    if not os.path.isfile(path):
+                        yield key, ExtractResult(error=ERROR_MISSING, message=path)
+                        continue
+                    worker = self._idle.pop() if self._idle else \
+                        _Worker(self._context, self.memory_limit)
+                    worker.submit(self.kind, key, path)
+                    busy[worker.conn] = worker
+                if not busy:
+                    continue
+
+                first = min(worker.started for worker in busy.values())
+                remaining = first + self.timeout - time.monotonic()
+                for conn in wait(list(busy), timeout=max(0.0, remaining)):
+                    worker = busy.pop(conn)
+                    try:
+                        result = conn.recv()
+                    except (EOFError, OSError):
+                        worker.process.join()
+                        result = ExtractResult(
+                            error=ERROR_CRASHED,
+                            message=f"worker exited with {worker.process.exitcode}",
+                            seconds=time.monotonic() - worker.started,
+                        )
+                        self._retire(worker)
+                    else:
+                        if result.error == "MemoryError":
+                            # Its heap is likely fragmented: start afresh
+                            self._retire(worker)
+                        else:
+                            self._idle.append(worker)
+                    yield worker.key, result
+
+                now = time.monotonic()
+                for conn, worker in list(busy.items()):
+                    if now - worker.started >= self.timeout:
+                        del busy[conn]
+                        self._retire(worker)
+                        yield worker.key, ExtractResult(
+                            error=ERROR_TIMEOUT,
+                            message=f"no result after {self.timeout:g} s",
+                            seconds=now - worker.started,
+                        )
+        finally:
+            for worker in busy.values():
+                self._retire(worker)
+
+    def extract(self, path: str) -> ExtractResult:
+        """The result of a single file."""
+        (_, result), = self.imap([(None, path)])
+        return result
+
+
+def extract_one(path: str, kind: str = KIND_TEXT,
+                timeout: float = TIMEOUT_DEFAULT) -> ExtractResult:
+    """Extract one file in a worker process of its own."""
+    with ExtractionPool(kind, jobs=1, timeout=timeout) as pool:
+        return pool.extract(path)
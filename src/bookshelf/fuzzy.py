@@ -1,12 +1,18 @@
 import sqlite3
 
-def setup_fts(db_path: str, table_name: str):
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
+import bookshelf.db
+
+# Bump this whenever the layout of the FTS table or its triggers changes.
+# The value is stored in the database header via PRAGMA user_version, so an
+# existing shelf is re-indexed exactly once after an upgrade.
+FTS_SCHEMA_VERSION = 2
+
+# The trigram tokenizer indexes every 3-character sequence, so it can answer
+# substring queries of at least this many characters.
+TRIGRAM_MIN_LENGTH = 3
 
-    # Enable foreign keys (good practice)
-    cur.execute("PRAGMA foreign_keys = ON;")
 
+def _create_fts_table(cur, table_name: str):
     # Create FTS5 virtual table
     cur.execute(f"""
     CREATE VIRTUAL TABLE IF NOT EXISTS bookshelf_fts
@@ -21,20 +27,152 @@ def setup_fts(db_path: str, table_name: str):
     );
     """)
 
-    # Populate FTS table from the content table
+    # Second index with the trigram tokenizer for substring (infix) queries,
+    # e.g. 'filter' in 'bloom_filter' or 'loom'.
     cur.execute(f"""
-    INSERT INTO bookshelf_fts(rowid, id, title, authors, keywords, description)
-    SELECT rowid, id, title, authors, keywords, description
-    FROM {table_name};
+    CREATE VIRTUAL TABLE IF NOT EXISTS bookshelf_trigram
+    USING fts5(
+        title,
+        authors,
+        keywords,
+        description,
+        content='{table_name}',
+        content_rowid='rowid',
+        tokenize='trigram'
+    );
     """)
 
+
+def _drop_fts(cur):
+    for trigger in ("ai", "ad", "au"):
+        cur.execute(f"DROP TRIGGER IF EXISTS bookshelf_{trigger};")
+        cur.execute(f"DROP TRIGGER IF EXISTS bookshelf_trigram_{trigger};")
+    cur.execute("DROP TABLE IF EXISTS bookshelf_fts;")
+    cur.execute("DROP TABLE IF EXISTS bookshelf_trigram;")
+
+
+def _rebuild_fts(cur):
+    # 'rebuild' discards the whole index and re-reads the content table,
+    # so it also removes duplicate postings left behind by older versions.
+    cur.execute("INSERT INTO bookshelf_fts(bookshelf_fts) VALUES('rebuild');")
+    cur.execute("INSERT INTO bookshelf_trigram(bookshelf_trigram) VALUES('rebuild');")
+
+
+def fts_drift(cur, table_name: str) -> bool:
+    # Cheap consistency check: every row of the content table must have
+    # exactly one entry in the docsize shadow table of each index.
+    n_docs = cur.execute(f"SELECT COUNT(*) FROM {table_name};").fetchone()[0]
+    for index in ("bookshelf_fts", "bookshelf_trigram"):
+        n_fts = cur.execute(f"SELECT COUNT(*) FROM {index}_docsize;").fetchone()[0]
+        if n_docs != n_fts:
+            return True
+    return False
+
+
+def setup_fts(db_path: str, table_name: str) -> bool:
+    # Build the FTS index once per schema version.  On later launches only
+    # the row counts are compared, and the index is rebuilt when they drift.
+    # Returns True when the index was (re)built.
+    conn = bookshelf.db.get_connection(db_path)
+    cur = conn.cursor()
+
+    version = cur.execute("PRAGMA user_version;").fetchone()[0]
+    rebuilt = False
+
+    if version < FTS_SCHEMA_VERSION:
+        _drop_fts(cur)
+        _create_fts_table(cur, table_name)
+        _create_fts_triggers(cur, table_name)
+        _rebuild_fts(cur)
+        cur.execute(f"PRAGMA user_version = {FTS_SCHEMA_VERSION};")
+        rebuilt = True
+    elif fts_drift(cur, table_name):
+        _rebuild_fts(cur)
+        rebuilt = True
+
+    # Put back triggers an interrupted bulk import may have left suspended
+    _create_fts_triggers(cur, table_name)
+
     conn.commit()
-    conn.close()
+    return rebuilt
+
+
+def rebuild_fts(db_path: str, table_name: str):
+    # Explicit full rebuild (bshelf fts rebuild)
+    conn = bookshelf.db.get_connection(db_path)
+    cur = conn.cursor()
+
+    _drop_fts(cur)
+    _create_fts_table(cur, table_name)
+    _create_fts_triggers(cur, table_name)
+    _rebuild_fts(cur)
+    cur.execute(f"PRAGMA user_version = {FTS_SCHEMA_VERSION};")
+
+    conn.commit()
+
+
+def check_fts(db_path: str, table_name: str) -> list:
+    # Returns a list of problems found; an empty list means the index is sound.
+    conn = bookshelf.db.get_connection(db_path)
+    cur = conn.cursor()
+    problems = []
+
+    version = cur.execute("PRAGMA user_version;").fetchone()[0]
+    if version < FTS_SCHEMA_VERSION:
+        problems.append(
+            f"schema version {version} is older than {FTS_SCHEMA_VERSION}"
+        )
+    else:
+        if fts_drift(cur, table_name):
+            problems.append("row counts of the table and the FTS index differ")
+        for index in ("bookshelf_fts", "bookshelf_trigram"):
+            try:
+                cur.execute(
+                    f"INSERT INTO {index}({index}) VALUES('integrity-check');"
+                )
+            except sqlite3.DatabaseError as e:
+                problems.append(f"integrity-check of {index} failed: {e}")
+        conn.rollback()
+
+    return problems
+
+
+def suspend_fts_insert_triggers(db_path: str):
+    # Bulk inserts index their rows afterwards with index_new_rows(), which
+    # is much faster than one trigger call per row.
+    conn = bookshelf.db.get_connection(db_path)
+    conn.execute("DROP TRIGGER IF EXISTS bookshelf_ai;")
+    conn.execute("DROP TRIGGER IF EXISTS bookshelf_trigram_ai;")
+    conn.commit()
+
+
+def index_new_rows(db_path: str, table_name: str, first_rowid: int):
+    # Index the rows from 'first_rowid' on that are not indexed yet, then
+    # put back the insert triggers dropped by suspend_fts_insert_triggers().
+    conn = bookshelf.db.get_connection(db_path)
+    cur = conn.cursor()
+    cur.execute(f"""
+    INSERT INTO bookshelf_fts(rowid, id, title, authors, keywords, description)
+    SELECT rowid, id, title, authors, keywords, description FROM {table_name}
+    WHERE rowid >= ? AND rowid NOT IN (SELECT id FROM bookshelf_fts_docsize);
+    """, (first_rowid,))
+    cur.execute(f"""
+    INSERT INTO bookshelf_trigram(rowid, title, authors, keywords, description)
+    SELECT rowid, title, authors, keywords, description FROM {table_name}
+    WHERE rowid >= ? AND rowid NOT IN (SELECT id FROM bookshelf_trigram_docsize);
+    """, (first_rowid,))
+    _create_fts_triggers(cur, table_name)
+    conn.commit()
+
 
 def setup_fts_triggers(db_path: str, table_name: str):
-    conn = sqlite3.connect(db_path)
+    conn = bookshelf.db.get_connection(db_path)
     cur = conn.cursor()
+    _create_fts_triggers(cur, table_name)
+    conn.commit()
 
+
+def _create_fts_triggers(cur, table_name: str):
     # Insert trigger
     cur.execute(f"""
     CREATE TRIGGER IF NOT EXISTS bookshelf_ai
@@ -82,11 +220,40 @@ def setup_fts_triggers(db_path: str, table_name: str):
     END;
     """)
 
-    conn.commit()
-    conn.close()
+    # The trigram index is maintained the same way
+    cur.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS bookshelf_trigram_ai
+    AFTER INSERT ON {table_name}
+    BEGIN
+        INSERT INTO bookshelf_trigram(rowid, title, authors, keywords, description)
+        VALUES (new.rowid, new.title, new.authors, new.keywords, new.description);
+    END;
+    """)
+
+    cur.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS bookshelf_trigram_ad
+    AFTER DELETE ON {table_name}
+    BEGIN
+        INSERT INTO bookshelf_trigram(bookshelf_trigram, rowid, title, authors, keywords, description)
+        VALUES('delete', old.rowid, old.title, old.authors, old.keywords, old.description);
+    END;
+    """)
+
+    cur.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS bookshelf_trigram_au
+    AFTER UPDATE ON {table_name}
+    BEGIN
+        INSERT INTO bookshelf_trigram(bookshelf_trigram, rowid, title, authors, keywords, description)
+        VALUES('delete', old.rowid, old.title, old.authors, old.keywords, old.description);
+
+        INSERT INTO bookshelf_trigram(rowid, title, authors, keywords, description)
+        VALUES (new.rowid, new.title, new.authors, new.keywords, new.description);
+    END;
+    """)
+
 
 def test_fts(db_path: str, query: str):
-    conn = sqlite3.connect(db_path)
+    conn = bookshelf.db.get_connection(db_path)
     cur = conn.cursor()
 
     cur.execute("""
@@ -98,25 +265,100 @@ def test_fts(db_path: str, query: str):
     for row in cur.fetchall():
         print(row)
 
-    conn.close()
 
-def fuzzy_search_fts(db_path, table_name, query):
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
+# bm25() weights of the FTS columns: id, title, authors, keywords, description
+# A match in the title counts most, then keywords, authors and description.
+BM25_WEIGHTS = (0.0, 10.0, 3.0, 5.0, 1.0)
 
-    sql = f"""
-    SELECT b.id, b.filename, b.title, rank
-    FROM bookshelf_fts f
-    JOIN {table_name} b ON b.rowid = f.rowid
-    WHERE bookshelf_fts MATCH ?
-    ORDER BY rank
-    """
+# Same weights for the trigram index, which has no id column
+TRIGRAM_BM25_WEIGHTS = BM25_WEIGHTS[1:]
+
+# Columns searched by a keyword query (the id column is never matched)
+SEARCH_COLUMNS = ("title", "authors", "keywords", "description")
+
+
+def make_fts_query(keyword: str) -> str:
+    # Turn free text into an FTS5 query: every whitespace separated term is
+    # quoted (so punctuation never raises a syntax error) and matched as a
+    # prefix, and all terms must occur.  Returns "" when nothing is left.
+    terms = []
+    for term in keyword.split():
+        term = term.replace('"', '""')
+        terms.append(f'"{term}"*')
+
+    if len(terms) == 0:
+        return ""
+
+    return "{" + " ".join(SEARCH_COLUMNS) + "} : (" + " ".join(terms) + ")"
+
+
+def make_substring_query(keyword: str) -> str:
+    # The whole keyword as one quoted phrase: on the trigram index this
+    # matches wherever the keyword occurs as a substring, like LIKE '%kw%'.
+    # Returns "" when the keyword is too short for the trigram index.
+    keyword = keyword.strip()
+    if len(keyword) < TRIGRAM_MIN_LENGTH:
+        return ""
+
+    return '"' + keyword.replace('"', '""') + '"'
+
+
+def _search_index(db_path, table_name, index, weights, query, after, limit,
+                  offset):
+    # Full rows of the content table, best bm25 match first, followed by two
+    # extra columns (score, rowid) that form the keyset of the row.  Passing
+    # the key of the last row seen as *after* continues from there, so a
+    # page never costs more than *limit* rows, however many rows match.
+    # *offset* skips rows after that, for callers without a key.
+    conn = bookshelf.db.get_connection(db_path)
+
+    weights = ", ".join(str(w) for w in weights)
+    score = f"bm25({index}, {weights})"
+    params = [query]
+    keyset = ""
+    if after is not None:
+        keyset = f"AND ({score} > ? OR ({score} = ? AND b.rowid > ?))"
+        params += [after[0], after[0], after[1]]
+    params += [limit, offset]
+
+    return conn.execute(f"""
+    SELECT b.*, {score} AS score, b.rowid
+    FROM {index}
+    JOIN {table_name} b ON b.rowid = {index}.rowid
+    WHERE {index} MATCH ? {keyset}
+    ORDER BY score, b.rowid
+    LIMIT ? OFFSET ?
+    """, params)
+
+
+def row_key(row) -> tuple:
+    # Keyset (score, rowid) of a row returned by one of the searches
+    return (row[-2], row[-1])
+
+
+def search_fts(db_path: str, table_name: str, keyword: str,
+               after=None, limit: int = -1, offset: int = 0):
+    # Word (prefix) search on the unicode61 index.  Returns a cursor; rows
+    # are fetched only as the caller iterates over it.
+    fts_query = make_fts_query(keyword)
+    if fts_query == "":
+        return iter(())
 
-    cur.execute(sql, (query,))
-    results = cur.fetchall()
+    return _search_index(
+        db_path, table_name, "bookshelf_fts", BM25_WEIGHTS, fts_query,
+        after, limit, offset,
+    )
 
-    print(results)
 
-    conn.close()
-    return results
+def search_substring(db_path: str, table_name: str, keyword: str,
+                     after=None, limit: int = -1, offset: int = 0):
+    # Substring search on the trigram index; keywords shorter than
+    # TRIGRAM_MIN_LENGTH cannot be answered by it and return no rows.
+    substring_query = make_substring_query(keyword)
+    if substring_query == "":
+        return iter(())
 
+    return _search_index(
+        db_path, table_name, "bookshelf_trigram", TRIGRAM_BM25_WEIGHTS,
+        substring_query, after, limit, offset,
+    )
@@ -0,0 +1,210 @@
+"""
+bookshelf/hashcache.py
+
+SHA-256 of files, cached in the shelf database by path, size and mtime.
+
+Table (in the shelf database):
+  bookshelf_hash_cache  absolute path of a file, its size and mtime (ns) when
+                        it was hashed, and its SHA-256
+
+Records store the hash of their own file, but merge also hashes the files of
+the other shelf and the primary files stored without a hash (not saved in a
+dry run), and 'add' hashes the new file to look for a duplicate.  Reading a
+whole shelf again on every run is minutes of disk I/O; with the cache, a
+file whose size and mtime are unchanged costs one stat().  Any write to a
+file changes its mtime, so a stale entry is never used: the file is hashed
+again and the entry replaced.
+
+Misses are hashed on a thread pool (with bookshelf.util.sha256_file, which
+reads into one reused buffer per thread).  The pool is sized for the
+storage: on a rotational disk concurrent reads only add seeks, so one
+thread reads there.
+
+Entries of files that were moved, deleted or changed since they were hashed
+are never used again; 'bookshelf hash update' drops them (prune()).
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import stat
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional
+
+import bookshelf.util as util
+
+# Hashing threads on solid-state or unknown storage
+JOBS_DEFAULT = min(8, (os.cpu_count() or 1) * 2)
+
+
+def is_rotational(path: str) -> Optional[bool]:
+    """Whether *path* is on a spinning disk; None where unknown (not Linux,
+    network or virtual file systems, ...)."""
+    try:
+        dev = os.stat(path).st_dev
+        block = os.path.realpath(
+            f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}")
+        for queue in (os.path.join(block, "queue"),
+                      os.path.join(os.path.dirname(block), "queue")):  # partition
+            flag = os.path.join(queue, "rotational")
+            if os.path.isfile(flag):
+                with open(flag) as f:
+                    return f.read().strip() == "1"
+    except (OSError, AttributeError):
+        pass
+    return None
+
+
+def storage_jobs(path: str) -> int:
+    """Hashing threads for files at *path* (see module docstring)."""
+    return 1 if is_rotational(path) else JOBS_DEFAULT
+
+
+# ---------------------------------------------------------------------------
+# Schema
+# ---------------------------------------------------------------------------
+
+def setup_hash_cache(conn: sqlite3.Connection):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS bookshelf_hash_cache (
+        path TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        sha256 TEXT NOT NULL
+    ) WITHOUT ROWID;
+    """)
+    conn.commit()
+
+
+# ---------------------------------------------------------------------------
+# Cache
+# ---------------------------------------------------------------------------
+
+class HashCache:
+    """Cache of file hashes on one connection.
+
+    With *readonly* (e.g. a dry-run merge, whose primary database is opened
+    read-only) entries are looked up but nothing is stored.  put() leaves
+    committing to the caller; hash() and hash_many() commit what they add.
+    The hashing threads never touch the connection.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, readonly: bool = False):
+        self._conn = conn
+        self._readonly = readonly
+        self.hits = 0
+        self.misses = 0
+        if readonly:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'bookshelf_hash_cache';"
+            ).fetchone()
+            self._table = exists is not None
+        else:
+            setup_hash_cache(conn)
+            self._table = True
+
+    def get(self, path: str, st: os.stat_result) -> Optional[str]:
+        """The cached hash of *path*, if it was taken at size and mtime *st*."""
+        if not self._table:
+            return None
+        row = self._conn.execute(
+            "SELECT sha256 FROM bookshelf_hash_cache"
+            " WHERE path = ? AND size = ? AND mtime_ns = ?;",
+            (os.path.abspath(path), st.st_size, st.st_mtime_ns),
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, path: str, st: os.stat_result, sha256: str):
+        if self._readonly:
+            return
+        self._conn.execute(
+            "INSERT OR REPLACE INTO bookshelf_hash_cache"
+            "(path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?);",
+            (os.path.abspath(path), st.st_size, st.st_mtime_ns, sha256),
+        )
+
+    def prune(self) -> int:
+        """Drop the entries of files that are gone or have changed since they
+        were hashed; returns how many."""
+        if self._readonly or not self._table:
+            return 0
+        stale = []
+        for path, size, mtime_ns in self._conn.execute(
+            "SELECT path, size, mtime_ns FROM bookshelf_hash_cache;"
+        ).fetchall():
+            try:
+                st = os.stat(path)
+            except OSError:
+                stale.append((path,))
+                continue
+            if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                stale.append((path,))
+        with self._conn:
+            self._conn.executemany(
+                "DELETE FROM bookshelf_hash_cache WHERE path = ?;", stale)
+        return len(stale)
+
+    def hash(self, path: str) -> Optional[str]:
+        """SHA-256 of the file at *path*, or None if there is no such file."""
+        return self.hash_many([path], jobs=1)[path]
+
+    def hash_many(
+        self, paths: Iterable[str], jobs: Optional[int] = None
+    ) -> Dict[str, Optional[str]]:
+        """{path: SHA-256, or None if there is no such file} for *paths*.
+        Misses are hashed on *jobs* threads (by default storage_jobs() of
+        the first of them)."""
+        hashes: Dict[str, Optional[str]] = {}
+        missed: Dict[str, os.stat_result] = {}
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                st = None
+            if st is None or not stat.S_ISREG(st.st_mode):
+                hashes[path] = None
+                continue
+            sha256 = self.get(path, st)
+            if sha256 is not None:
+                self.hits += 1
+                hashes[path] = sha256
+            else:
+                missed[path] = st
+        if not missed:
+            return hashes
+
+        self.misses += len(missed)
+        if jobs is None:
+            jobs = storage_jobs(next(iter(missed)))
+        if jobs <= 1:
+            self._add_hashed(missed, map(_hash_or_none, missed), hashes)
+        else:
+            with ThreadPoolExecutor(max_workers=jobs) as pool:
+                self._add_hashed(missed, pool.map(_hash_or_none, missed), hashes)
+        if not self._readonly:
+            self._conn.commit()
+        return hashes
+
+    def _add_hashed(self, missed: Dict[str, os.stat_result],
+                    results: Iterable[Optional[str]],
+                    hashes: Dict[str, Optional[str]]):
+        for path, sha256 in zip(missed, results):
+            hashes[path] = sha256
+            if sha256 is None:
+                continue
+            # A file written while it was read is not cached
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            before = missed[path]
+            if (st.st_size, st.st_mtime_ns) == (before.st_size, before.st_mtime_ns):
+                self.put(path, st, sha256)
+
+
+def _hash_or_none(path: str) -> Optional[str]:
+    try:
+        return util.sha256_file(path)
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,136 @@
+"""
+bookshelf/importprofile.py
+
+Per-module import timing for tracking the CLI's cold-start latency.
+
+Enabled by setting BOOKSHELF_IMPORT_PROFILE=1 in the environment (the
+package __init__ installs the hook before anything else is imported):
+
+    ❯ BOOKSHELF_IMPORT_PROFILE=1 bshelf help
+
+When the process exits, the modules imported since then are written to
+stderr, slowest first, with the time spent importing each one including
+(cumulative) and excluding (self) the modules it imported itself:
+
+    [import profile]   cumul.     self  module
+                      14.2 ms   1.1 ms  bookshelf.app
+                       ...
+    [import profile] total 21.7 ms, budget 100 ms
+
+BOOKSHELF_IMPORT_BUDGET_MS overrides the budget.  A total above it is
+reported as OVER BUDGET, so a regression (e.g. a module-level import of
+prompt_toolkit) shows up at once.  Python's own '-X importtime' gives the
+same numbers, but cannot be passed through the 'bshelf' entry point.
+"""
+
+from __future__ import annotations
+
+import atexit
+import os
+import sys
+import time
+from typing import Dict, List
+
+# Start-up import budget for any subcommand, in milliseconds
+IMPORT_BUDGET_MS_DEFAULT = 100.0
+
+# Number of modules listed in the report
+REPORT_LINES = 25
+
+_installed = False
+# module name -> [cumulative seconds, self seconds]
+_timings: Dict[str, List[float]] = {}
+# Cumulative time of the imports in progress, innermost last
+_stack: List[float] = []
+_total = 0.0
+
+
+class _TimedLoader:
+    """Wraps a loader and times its exec_module()."""
+
+    def __init__(self, loader, name: str):
+        self._loader = loader
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._loader, attr)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        global _total
+        _stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = _stack.pop()
+            _timings[self._name] = [elapsed, elapsed - children]
+            if _stack:
+                _stack[-1] += elapsed
+            else:
+                _total += elapsed
+
+
+class _TimingFinder:
+    """Meta path finder that asks the other finders and wraps their loader."""
+
+    @classmethod
+    def find_spec(cls, name, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is cls or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader, name)
+                return spec
+        return None
+
+
+def get_budget_ms() -> float:
+    try:
+        return float(os.environ["BOOKSHELF_IMPORT_BUDGET_MS"])
+    except (KeyError, ValueError):
+        return IMPORT_BUDGET_MS_DEFAULT
+
+
+def report(out=None, limit: int = REPORT_LINES) -> float:
+    """Write the slowest imports to *out* (stderr); return the total in ms."""
+    out = out or sys.stderr
+    total_ms = _total * 1000
+    budget_ms = get_budget_ms()
+    ranked = sorted(_timings.items(), key=lambda item: -item[1][0])
+
+    print("[import profile]   cumul.     self  module", file=out)
+    for name, (cumulative, own) in ranked[:limit]:
+        print(f"{'':17}{cumulative * 1000:7.1f} ms {own * 1000:5.1f} ms  {name}",
+              file=out)
+    status = "" if total_ms <= budget_ms else "  OVER BUDGET"
+    print(f"[import profile] total {total_ms:.1f} ms, "
+          f"budget {budget_ms:g} ms{status}", file=out)
+    return total_ms
+
+
+def install(report_at_exit: bool = True):
+    """Start timing imports (only those not imported yet are seen)."""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    sys.meta_path.insert(0, _TimingFinder)
+    if report_at_exit:
+        atexit.register(report)
+
+
+def timings() -> Dict[str, List[float]]:
+    """Copy of the timings recorded so far: name -> [cumulative, self] (s)."""
+    return {name: list(values) for name, values in _timings.items()}
+
+
+def total_ms() -> float:
+    """Time spent in top-level imports since install(), in milliseconds."""
+    return _total * 1000
+
@@ -0,0 +1,354 @@
+"""
+bookshelf/ingest.py
+
+Bulk import of a directory tree into the shelf, without prompts.
+
+Every file under the directory is copied into the usual files/<uuid[:2]>/
+layout under a new uuid name and registered with the metadata found in a
+sidecar file, or with empty metadata to be filled in later (e.g. with
+'edit' in the interactive search).
+
+Sidecar metadata (optional):
+  metadata.csv or metadata.json at the top of the directory, or any file
+  given with --metadata.  Each entry names a file by its path relative to
+  the directory (or by its bare file name) and may give any of the fields
+  title, authors, category, keywords, description:
+
+    path,title,authors,category,keywords,description
+    papers/bloom.pdf,Space/time trade-offs in hash coding,Burton H. Bloom,Paper,,
+
+    [{"path": "papers/bloom.pdf", "title": "Space/time trade-offs ..."}]
+
+Performance:
+  * Files are copied on a bounded thread pool, with the fastest transfer
+    the file system allows (a reflink clone or an in-kernel copy; see
+    bookshelf.transfer).  A buffered copy reads each file
+    once and hashes (SHA-256) the same buffers it writes; the hash, size and
+    mtime are stored with the record.  Files whose hash is already in the
+    shelf, or repeated in the tree, are detected by their hash and not
+    imported again.
+  * Rows are inserted in batched transactions.  The FTS insert triggers are
+    suspended during the import and the new rows are indexed in one pass at
+    the end (bookshelf.fuzzy.index_new_rows).  If the import is interrupted,
+    the next start-up finds the drift and rebuilds the index.
+
+Usage:
+    bookshelf import ~/archive [--metadata list.csv] [--jobs 8] [--batch 500]
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+import uuid
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import bookshelf.db as db
+import bookshelf.fuzzy as fuzzy
+import bookshelf.store as store
+import bookshelf.util as util
+
+# ---------------------------------------------------------------------------
+# Constants & tuneable defaults
+# ---------------------------------------------------------------------------
+
+JOBS_DEFAULT = min(8, (os.cpu_count() or 1) * 2)
+BATCH_SIZE_DEFAULT = 500
+# Seconds between two progress lines
+PROGRESS_INTERVAL = 1.0
+
+SIDECAR_NAMES = ("metadata.csv", "metadata.json")
+METADATA_FIELDS = ("title", "authors", "category", "keywords", "description")
+
+ICON_INFO = "\uf02d"
+ICON_WARN = "\uea6c"
+
+
+# ---------------------------------------------------------------------------
+# Data structures
+# ---------------------------------------------------------------------------
+
+@dataclass
+class CopyResult:
+    src: str
+    filename: str       # new uuid file name in the store
+    sha256: str
+    size: int
+    mtime_ns: int
+    method: str         # how the file was copied (see bookshelf.transfer)
+
+
+@dataclass
+class ImportStats:
+    imported: int = 0
+    bytes: int = 0
+    duplicates: List[str] = field(default_factory=list)
+    errors: List[Tuple[str, str]] = field(default_factory=list)
+    elapsed: float = 0.0
+    methods: Counter = field(default_factory=Counter)
+
+    def throughput(self) -> str:
+        seconds = max(self.elapsed, 1e-9)
+        return (f"{self.imported / seconds:.1f} files/s, "
+                f"{self.bytes / seconds / (1 << 20):.1f} MiB/s")
+
+    def summary(self) -> str:
+        lines = [
+            f"{ICON_INFO}  Imported {self.imported} files "
+            f"({self.bytes / (1 << 20):.1f} MiB) in {self.elapsed:.1f} s: "
+            f"{self.throughput()}",
+        ]
+        if self.methods:
+            lines.append(f"{ICON_INFO}  Copied with " + ", ".join(
+                f"{method} ({count})" for method, count in self.methods.most_common()
+            ))
+        if self.duplicates:
+            lines.append(f"{ICON_INFO}  Skipped {len(self.duplicates)} "
+                         "files already in the shelf")
+        for path, error in self.errors:
+            lines.append(util.make_bold_red(f"{ICON_WARN}  {path}: {error}"))
+        return "\n".join(lines)
+
+
+# ---------------------------------------------------------------------------
+# Sidecar metadata
+# ---------------------------------------------------------------------------
+
+def load_sidecar(path: str) -> Dict[str, Dict[str, str]]:
+    """Read a CSV or JSON sidecar into {path or file name: {field: value}}."""
+    if path.lower().endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        entries = (
+            [dict(value, path=key) for key, value in data.items()]
+            if isinstance(data, dict) else data
+        )
+    else:
+        with open(path, newline="", encoding="utf-8") as f:
+            entries = list(csv.DictReader(f))
+
+    metadata = {}
+    for entry in entries:
+        key = entry.get("path") or entry.get("filename")
+        if not key:
+            continue
+        metadata[os.path.normpath(key)] = {
+            name: str(entry.get(name) or "").strip() for name in METADATA_FIELDS
+        }
+    return metadata
+
+
+def find_sidecar(directory: str) -> Optional[str]:
+    for name in SIDECAR_NAMES:
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def _metadata_for(metadata: Dict[str, Dict[str, str]], directory: str,
+                  src: str) -> Dict[str, str]:
+    relative = os.path.normpath(os.path.relpath(src, directory))
+    entry = metadata.get(relative) or metadata.get(os.path.basename(src))
+    return entry or {name: "" for name in METADATA_FIELDS}
+
+
+# ---------------------------------------------------------------------------
+# Copying
+# ---------------------------------------------------------------------------
+
+def walk_files(directory: str, skip: Tuple[str, ...] = ()) -> List[str]:
+    """Regular files under *directory*, hidden files and *skip* excluded."""
+    files = []
+    for root, dirs, names in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            if name.startswith(".") or path in skip or not os.path.isfile(path):
+                continue
+            files.append(path)
+    return files
+
+
+def copy_and_hash(src: str, files_dir: str, strategy: str = "auto") -> CopyResult:
+    """Copy *src* into the store under a new uuid name, hashing on the way.
+
+    In a content-addressed store the new name is a link to the blob.
+    """
+    _, ext = os.path.splitext(src)
+    filename = f"{uuid.uuid4()}{ext}"
+    sub_dir = os.path.join(files_dir, filename[0:2])
+    os.makedirs(sub_dir, exist_ok=True)
+    dst = os.path.join(sub_dir, filename)
+
+    result = store.store_file(src, dst, files_dir, exclusive=True, strategy=strategy)
+    return CopyResult(src, filename, result.sha256, result.size,
+                      os.stat(dst).st_mtime_ns, result.method)
+
+
+# ---------------------------------------------------------------------------
+# Import
+# ---------------------------------------------------------------------------
+
+def import_directory(
+    directory: str,
+    db_path: str,
+    table: str,
+    files_dir: str,
+    metadata_path: Optional[str] = None,
+    jobs: int = JOBS_DEFAULT,
+    batch_size: int = BATCH_SIZE_DEFAULT,
+    out=None,
+    strategy: str = "auto",
+) -> ImportStats:
+    out = out or sys.stdout
+    directory = os.path.abspath(directory)
+    metadata_path = metadata_path or find_sidecar(directory)
+    metadata = load_sidecar(metadata_path) if metadata_path else {}
+
+    sources = walk_files(
+        directory, skip=(os.path.abspath(metadata_path),) if metadata_path else ()
+    )
+    total = len(sources)
+    print(f"{ICON_INFO}  {total} files to import from {directory}"
+          + (f" (metadata: {metadata_path})" if metadata_path else ""), file=out)
+
+    conn = db.get_connection(db_path)
+    db.ensure_file_columns(conn, table)
+    first_rowid = conn.execute(
+        f"SELECT COALESCE(MAX(rowid), 0) + 1 FROM {table}"
+    ).fetchone()[0]
+    fuzzy.suspend_fts_insert_triggers(db_path)
+
+    stats = ImportStats()
+    seen_hashes: Dict[str, str] = {}
+    pending_rows: List[tuple] = []
+    start = time.perf_counter()
+    last_progress = start
+
+    def flush():
+        if pending_rows:
+            with conn:
+                conn.executemany(
+                    f"""INSERT INTO {table}
+                    (id, filename, title, authors, category, keywords, description,
+                    sha256, size, mtime_ns)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    pending_rows,
+                )
+            pending_rows.clear()
+
+    def handle(src: str, result: CopyResult):
+        if result.sha256 in seen_hashes or conn.execute(
+            f"SELECT 1 FROM {table} WHERE sha256 = ? LIMIT 1", (result.sha256,)
+        ).fetchone():
+            # Same content as a stored file or one imported earlier in this run
+            os.unlink(os.path.join(files_dir, result.filename[0:2], result.filename))
+            stats.duplicates.append(src)
+            return
+        seen_hashes[result.sha256] = src
+        md = _metadata_for(metadata, directory, src)
+        pending_rows.append((
+            os.path.splitext(result.filename)[0], result.filename,
+            md["title"], md["authors"], md["category"],
+            md["keywords"], md["description"],
+            result.sha256, result.size, result.mtime_ns,
+        ))
+        stats.imported += 1
+        stats.bytes += result.size
+        stats.methods[result.method] += 1
+        if len(pending_rows) >= batch_size:
+            flush()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            # Keep a bounded number of copies in flight, and handle the
+            # results in the order of the files so batches are reproducible.
+            queue = deque(sources)
+            in_flight: deque = deque()
+            try:
+                while queue or in_flight:
+                    while queue and len(in_flight) < max(1, jobs) * 4:
+                        src = queue.popleft()
+                        in_flight.append((src, pool.submit(copy_and_hash, src, files_dir, strategy)))
+                    src, future = in_flight.popleft()
+                    try:
+                        handle(src, future.result())
+                    except OSError as e:
+                        stats.errors.append((src, str(e)))
+
+                    now = time.perf_counter()
+                    if now - last_progress >= PROGRESS_INTERVAL:
+                        last_progress = now
+                        stats.elapsed = now - start
+                        done = stats.imported + len(stats.duplicates) + len(stats.errors)
+                        print(f"    {done}/{total} files, "
+                              f"{stats.bytes / (1 << 20):.1f} MiB, "
+                              f"{stats.throughput()}", file=out)
+            except BaseException:
+                # Register the copies already made, so no file is orphaned
+                for _, future in in_flight:
+                    future.cancel()
+                for src, future in in_flight:
+                    if not future.cancelled() and future.exception() is None:
+                        handle(src, future.result())
+                raise
+    finally:
+        flush()
+        # Index everything committed, even after an error or Ctrl-C
+        fuzzy.index_new_rows(db_path, table, first_rowid)
+        stats.elapsed = time.perf_counter() - start
+
+    print(stats.summary(), file=out)
+    return stats
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def _build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(
+        prog="bookshelf import",
+        description="Import every file under a directory into the shelf.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    p.add_argument("directory", help="Directory to import")
+    p.add_argument("--metadata",
+                   help="Sidecar CSV/JSON metadata (default: metadata.csv or "
+                        "metadata.json in the directory, if present)")
+    p.add_argument("--jobs", type=int, default=JOBS_DEFAULT,
+                   help="Number of files copied in parallel")
+    p.add_argument("--batch", type=int, default=BATCH_SIZE_DEFAULT,
+                   help="Rows inserted per transaction")
+    return p
+
+
+def run_import_cli(argv: list[str] | None = None):
+    from bookshelf.app import Bookshelf
+
+    args = _build_parser().parse_args(argv)
+    directory = os.path.expanduser(args.directory)
+    if not os.path.isdir(directory):
+        print(f"[ERROR] No such directory: {args.directory}", file=sys.stderr)
+        sys.exit(2)
+
+    # Opening the shelf creates the table and the FTS indexes if needed
+    shelf = Bookshelf(show_banner=False)
+    import_directory(
+        directory,
+        shelf.db_path,
+        shelf.table_name,
+        os.path.join(shelf.root_dir, shelf.files_dir),
+        metadata_path=os.path.expanduser(args.metadata) if args.metadata else None,
+        jobs=args.jobs,
+        batch_size=args.batch,
+        strategy=shelf.transfer_strategy,
+    )
@@ -5,8 +5,12 @@ Merge a secondary Bookshelf database + file store into the primary one.
 
 Duplicate-detection strategy (in priority order):
   1. File hash (SHA-256)     – exact content match → definitive duplicate
+     (read from the sha256 column; only files without one are hashed,
+     through the hash cache of the primary shelf, see bookshelf.hashcache)
   2. Weighted fuzzy score    – title (50%), authors (25%), description (25%)
-     using difflib.SequenceMatcher (no extra dependencies)
+     using difflib.SequenceMatcher (no extra dependencies), against the
+     primary records sharing the most title words, author last names and
+     title trigrams (CandidateIndex), not against all of them
 
 Behaviour by score:
   score >= high_threshold  → auto-skip, write to report
@@ -38,29 +42,34 @@ Wiring into existing CLI (bookshelf/__main__.py or wherever main() lives):
 from __future__ import annotations
 
 import argparse
-import hashlib
+import importlib.util
+import multiprocessing
 import os
 import shutil
+import signal
 import sqlite3
 import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
 from datetime import datetime
 from difflib import SequenceMatcher
 from enum import Enum, auto
-from typing import List, Optional
-
+from typing import Iterator, List, Optional, Tuple
+
+import bookshelf.db as db
+import bookshelf.extract as extract
+import bookshelf.hashcache as hashcache
+import bookshelf.store as store
+import bookshelf.textcache as textcache
+import bookshelf.transfer as transfer
 import bookshelf.util as util
 
 # pypdf is optional.  When present, PDF text extraction is used to detect
 # annotated copies of the same document (whose binary hashes differ).
-try:
-    import pypdf as _pypdf
-    _PYPDF_AVAILABLE = True
-except ImportError:
-    _pypdf = None           # type: ignore[assignment]
-    _PYPDF_AVAILABLE = False
-
-import logging as _logging
+# Only its presence is checked here; the (slow) import happens the first time
+# a PDF's text is actually needed.
+_PYPDF_AVAILABLE = importlib.util.find_spec("pypdf") is not None
 
 # ---------------------------------------------------------------------------
 # Constants & tuneable defaults
@@ -73,6 +82,18 @@ LOW_THRESHOLD_DEFAULT  = 0.50   # ask user  (uncertain)
 # them the "same document" even when their binary hashes differ (annotations).
 PDF_TEXT_THRESHOLD = 0.95
 
+# Candidate blocking (see CandidateIndex)
+CANDIDATES_DEFAULT   = 50     # primary records scored per secondary; 0 = all
+MIN_SHARED_DEFAULT   = 3.0    # weight of the keys a candidate must share
+MAX_POSTINGS_DEFAULT = 2000   # keys of more primary records are ignored
+# Weight of a shared key, by kind: title word, author last name, title trigram
+KEY_WEIGHTS = {"t": 1.0, "a": 2.0, "g": 1.0}
+
+# Parallel scoring (see score_records)
+JOBS_DEFAULT       = os.cpu_count() or 1
+SCORE_CHUNK_SIZE   = 64        # secondary records per work unit
+PARALLEL_MIN_PAIRS = 200_000   # fewer pairs are scored in-process
+
 # Field weights for fuzzy score – must sum to 1.0
 W_TITLE       = 0.50
 W_AUTHORS     = 0.25
@@ -104,6 +125,9 @@ class Record:
     category:    str
     keywords:    str
     description: str
+    sha256:      Optional[str] = None   # stored hash of the file, if known
+    size:        Optional[int] = None   # size and mtime of the file when
+    mtime_ns:    Optional[int] = None   # the hash was stored
 
 
 @dataclass
@@ -116,6 +140,28 @@ class ReportEntry:
     reason:       str
 
 
+@dataclass
+class ScoreStats:
+    """Candidate pairs scored, and how many were pruned by each bound
+    (see _bounded_similarity)."""
+    pairs:       int = 0
+    length:      int = 0    # title lengths too far apart
+    chars:       int = 0    # titles share too few characters
+    title:       int = 0    # title score too low
+    description: int = 0    # description bounds too low, with the rest exact
+
+    @property
+    def pruned(self) -> int:
+        return self.length + self.chars + self.title + self.description
+
+    def add(self, other: "ScoreStats"):
+        self.pairs += other.pairs
+        self.length += other.length
+        self.chars += other.chars
+        self.title += other.title
+        self.description += other.description
+
+
 @dataclass
 class MergeReport:
     started_at: str = field(
@@ -123,6 +169,10 @@ class MergeReport:
     )
     entries:  List[ReportEntry] = field(default_factory=list)
     dry_run:  bool = False
+    # Secondary records with more candidates than were scored
+    candidate_limit: int = 0
+    limited:  int = 0
+    scoring:  ScoreStats = field(default_factory=ScoreStats)
 
     def add(self, entry: ReportEntry):
         self.entries.append(entry)
@@ -142,8 +192,20 @@ class MergeReport:
             f"  Replaced  (primary overwritten)  : {counts[MergeAction.REPLACED]}",
             f"  Kept both (both records retained): {counts[MergeAction.KEPT_BOTH]}",
             f"  Total processed                  : {len(self.entries)}",
-            "=" * 72,
         ]
+        if self.limited:
+            lines.append(
+                f"  Candidate limit ({self.candidate_limit}) reached for"
+                f" {self.limited} records: their best match may have been missed"
+            )
+        if self.scoring.pairs:
+            st = self.scoring
+            lines.append(
+                f"  Candidate pairs: {st.pairs}, pruned early: {st.pruned}"
+                f" ({st.pruned / st.pairs:.0%}; length {st.length}, characters"
+                f" {st.chars}, title {st.title}, description {st.description})"
+            )
+        lines.append("=" * 72)
         return "\n".join(lines)
 
     def detail_lines(self) -> List[str]:
@@ -170,24 +232,24 @@ class MergeReport:
 # Similarity helpers
 # ---------------------------------------------------------------------------
 
-def _sha256(path: str) -> Optional[str]:
-    """Return hex SHA-256 of *path*, or None if the file does not exist."""
-    if not os.path.isfile(path):
-        return None
-    h = hashlib.sha256()
-    with open(path, "rb") as fh:
-        for chunk in iter(lambda: fh.read(65_536), b""):
-            h.update(chunk)
-    return h.hexdigest()
+def _normalise(s: str) -> Optional[str]:
+    """Lower-cased and stripped, or None for an empty string (which _fuzzy
+    tells apart from a blank one)."""
+    return s.lower().strip() if s else None
 
 
-def _fuzzy(a: str, b: str) -> float:
-    """0.0-1.0 similarity between two strings (case-insensitive)."""
-    if not a and not b:
+def _fuzzy_normalised(a: Optional[str], b: Optional[str]) -> float:
+    """_fuzzy of two _normalise'd strings."""
+    if a is None and b is None:
         return 1.0
-    if not a or not b:
+    if a is None or b is None:
         return 0.0
-    return SequenceMatcher(None, a.lower().strip(), b.lower().strip()).ratio()
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def _fuzzy(a: str, b: str) -> float:
+    """0.0-1.0 similarity between two strings (case-insensitive)."""
+    return _fuzzy_normalised(_normalise(a), _normalise(b))
 
 
 # ---------------------------------------------------------------------------
@@ -280,7 +342,11 @@ def _names_match(a: str, b: str) -> bool:
          a subset of the larger.  A side with no initials at all (bare last
          name) matches anything with the same last name.
     """
-    pa, pb = _parse_name(a), _parse_name(b)
+    return _parsed_names_match(_parse_name(a), _parse_name(b))
+
+
+def _parsed_names_match(pa: _ParsedName, pb: _ParsedName) -> bool:
+    """_names_match of two parsed names."""
     if not pa.last or not pb.last:
         return False
     if pa.last != pb.last:
@@ -351,43 +417,384 @@ def _author_similarity(a: str, b: str) -> float:
     Falls back to plain character-level fuzzy ratio when either side is
     unparseable (e.g. an organisation name).
     """
-    authors_a = _split_authors(a)
-    authors_b = _split_authors(b)
+    return _names_similarity(
+        _parse_authors(a), _normalise(a), _parse_authors(b), _normalise(b)
+    )
+
+
+def _parse_authors(s: str) -> Tuple[_ParsedName, ...]:
+    return tuple(_parse_name(name) for name in _split_authors(s))
+
 
-    if not authors_a and not authors_b:
+def _names_similarity(
+    names_a: Tuple[_ParsedName, ...], authors_a: Optional[str],
+    names_b: Tuple[_ParsedName, ...], authors_b: Optional[str],
+) -> float:
+    """_author_similarity of parsed names, with the _normalise'd author
+    strings for the fallback."""
+    if not names_a and not names_b:
         return 1.0
-    if not authors_a or not authors_b:
+    if not names_a or not names_b:
         return 0.0
 
     # Greedy matching: for each name in A find the first unmatched name in B
-    used = [False] * len(authors_b)
+    used = [False] * len(names_b)
     matched = 0
-    for na in authors_a:
-        for j, nb in enumerate(authors_b):
-            if not used[j] and _names_match(na, nb):
+    for na in names_a:
+        for j, nb in enumerate(names_b):
+            if not used[j] and _parsed_names_match(na, nb):
                 matched += 1
                 used[j] = True
                 break
 
-    score = matched / max(len(authors_a), len(authors_b))
+    score = matched / max(len(names_a), len(names_b))
 
     # If no name-level match at all, fall back to string similarity so that
     # organisation names and unusual formats still get a reasonable score.
     if score == 0.0:
-        score = _fuzzy(a, b)
+        score = _fuzzy_normalised(authors_a, authors_b)
 
     return score
 
 
 def weighted_similarity(sec: Record, pri: Record) -> float:
     """Weighted metadata similarity, ignoring file content."""
-    return (
-        W_TITLE       * _fuzzy(sec.title,              pri.title)
-        + W_AUTHORS     * _author_similarity(sec.authors, pri.authors)
-        + W_DESCRIPTION * _fuzzy(sec.description,        pri.description)
+    return feature_similarity(RecordFeatures(sec), RecordFeatures(pri))
+
+
+# ---------------------------------------------------------------------------
+# Record features
+# ---------------------------------------------------------------------------
+# The similarity of two records only depends on their normalised title,
+# description and author string, their parsed author names, and (for
+# blocking) their title words.  Each record is normalised once into a
+# RecordFeatures instead of once per pair: over a big merge the parsing,
+# not the comparison, dominated.
+# ---------------------------------------------------------------------------
+
+_WORD = _re.compile(r"\w+")
+
+
+def _title_words(title: str) -> List[str]:
+    return _WORD.findall(title.lower())
+
+
+class RecordFeatures:
+    """What the similarity functions need of one record, computed once.
+
+    title / description / authors   _normalise'd field
+    title_chars / description_chars character counts of the field, or None
+    names                           parsed author names (_parse_name)
+    title_words                     set of the lower-cased title words
+    keys                            blocking keys (see CandidateIndex)
+    """
+
+    __slots__ = ("title", "description", "authors", "title_chars",
+                 "description_chars", "names", "title_words", "keys")
+
+    def __init__(self, rec: Record):
+        words = _title_words(rec.title)
+        names = _parse_authors(rec.authors)
+        title, description = _normalise(rec.title), _normalise(rec.description)
+        init = object.__setattr__
+        init(self, "title", title)
+        init(self, "description", description)
+        init(self, "authors", _normalise(rec.authors))
+        init(self, "title_chars", None if title is None else Counter(title))
+        init(self, "description_chars",
+             None if description is None else Counter(description))
+        init(self, "names", names)
+        init(self, "title_words", frozenset(words))
+        init(self, "keys", frozenset(_blocking_keys(words, names)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"RecordFeatures is immutable: cannot set {name}")
+
+    def __reduce__(self):
+        # Unpickling would set the slots one by one, which __setattr__ forbids
+        return _restore_features, tuple(getattr(self, n) for n in self.__slots__)
+
+
+def _restore_features(*values) -> RecordFeatures:
+    features = RecordFeatures.__new__(RecordFeatures)
+    for name, value in zip(RecordFeatures.__slots__, values):
+        object.__setattr__(features, name, value)
+    return features
+
+
+def _features(rec) -> RecordFeatures:
+    return rec if isinstance(rec, RecordFeatures) else RecordFeatures(rec)
+
+
+def _weighted(title: float, authors: float, description: float) -> float:
+    return W_TITLE * title + W_AUTHORS * authors + W_DESCRIPTION * description
+
+
+def feature_similarity(sec: RecordFeatures, pri: RecordFeatures) -> float:
+    """weighted_similarity of two records' features."""
+    return _weighted(
+        _fuzzy_normalised(sec.title, pri.title),
+        _names_similarity(sec.names, sec.authors, pri.names, pri.authors),
+        _fuzzy_normalised(sec.description, pri.description),
+    )
+
+
+# ---------------------------------------------------------------------------
+# Early exit
+# ---------------------------------------------------------------------------
+# Only a pair scoring above the best so far can change a secondary record's
+# match, and most candidates are far below it.  SequenceMatcher.ratio() is
+# 2*M/T, with M the characters of its matching blocks and T both lengths,
+# so cheap upper bounds of it come first, as in real_quick_ratio() and
+# quick_ratio(): M is at most the shorter length, and at most the number of
+# characters the strings share (counted once per record in RecordFeatures).
+# A similarity is at most 1, so the bounds of the title (half the weight)
+# prune a pair before the authors or the description are compared.
+#
+# A pair is only pruned when even its bound cannot beat the best score, so
+# the scores of the pairs that are not pruned, and the best matches, are
+# exactly those of feature_similarity.
+# ---------------------------------------------------------------------------
+
+def _length_bound(a: Optional[str], b: Optional[str]) -> float:
+    """Upper bound of _fuzzy_normalised(a, b) from the lengths."""
+    if a is None or b is None:
+        return _fuzzy_normalised(a, b)
+    total = len(a) + len(b)
+    return 2.0 * min(len(a), len(b)) / total if total else 1.0
+
+
+def _chars_bound(a: Optional[str], b: Optional[str],
+                 a_chars: Optional[Counter], b_chars: Optional[Counter]) -> float:
+    """Upper bound of _fuzzy_normalised(a, b) from the shared characters."""
+    if a is None or b is None:
+        return _fuzzy_normalised(a, b)
+    total = len(a) + len(b)
+    return 2.0 * sum((a_chars & b_chars).values()) / total if total else 1.0
+
+
+def _bounded_similarity(
+    sec: RecordFeatures, pri: RecordFeatures, floor: float, stats: ScoreStats
+) -> Optional[float]:
+    """feature_similarity(sec, pri), or None if it is at most *floor*."""
+    stats.pairs += 1
+    if _weighted(_length_bound(sec.title, pri.title), 1.0, 1.0) <= floor:
+        stats.length += 1
+        return None
+    if _weighted(_chars_bound(sec.title, pri.title, sec.title_chars,
+                              pri.title_chars), 1.0, 1.0) <= floor:
+        stats.chars += 1
+        return None
+    title = _fuzzy_normalised(sec.title, pri.title)
+    if _weighted(title, 1.0, 1.0) <= floor:
+        stats.title += 1
+        return None
+
+    authors = _names_similarity(sec.names, sec.authors, pri.names, pri.authors)
+    if (
+        _weighted(title, authors,
+                  _length_bound(sec.description, pri.description)) <= floor
+        or _weighted(title, authors, _chars_bound(
+            sec.description, pri.description,
+            sec.description_chars, pri.description_chars)) <= floor
+    ):
+        stats.description += 1
+        return None
+    return _weighted(
+        title, authors, _fuzzy_normalised(sec.description, pri.description)
     )
 
 
+# ---------------------------------------------------------------------------
+# Candidate blocking
+# ---------------------------------------------------------------------------
+# Scoring every secondary record against every primary one is N x M runs of
+# weighted_similarity.  Instead, the primary records are indexed by keys
+# that similar records share:
+#   t:<word>   normalised title words
+#   a:<last>   author last names (_parse_name)
+#   g:<abc>    character trigrams of the title, which survive typos
+# An empty title or author field is a key of its own, since two empty fields
+# are a perfect match for _fuzzy and _author_similarity.
+#
+# A secondary record is scored only against the top-K primary records by
+# total weight of shared keys (KEY_WEIGHTS), among those sharing at least
+# min_shared.  Keys of more than max_postings primary records (e.g. "the")
+# are skipped: they would only add candidates that rank low.
+# ---------------------------------------------------------------------------
+
+def _blocking_keys(words: List[str], names: Tuple[_ParsedName, ...]) -> set:
+    keys = {"t:" + w for w in words if len(w) > 1} if words else {"t:"}
+    padded = " " + " ".join(words) + " "
+    keys.update("g:" + padded[i:i + 3] for i in range(len(padded) - 2))
+    if not names:
+        keys.add("a:")
+    keys.update("a:" + name.last for name in names if name.last)
+    return keys
+
+
+def blocking_keys(rec: Record) -> frozenset:
+    """The keys of *rec* in the candidate index."""
+    return _features(rec).keys
+
+
+class CandidateIndex:
+    """Inverted index of primary records by blocking key."""
+
+    def __init__(
+        self,
+        records: List,      # Record or RecordFeatures
+        top_k: int = CANDIDATES_DEFAULT,
+        min_shared: float = MIN_SHARED_DEFAULT,
+        max_postings: int = MAX_POSTINGS_DEFAULT,
+    ):
+        self.size = len(records)
+        self.top_k = top_k
+        self.min_shared = min_shared
+        self.max_postings = max_postings
+        self.postings: dict[str, List[int]] = {}
+        if not self.exhaustive:
+            for i, rec in enumerate(records):
+                for key in _features(rec).keys:
+                    self.postings.setdefault(key, []).append(i)
+
+    @property
+    def exhaustive(self) -> bool:
+        """True when every record is a candidate anyway."""
+        return self.top_k <= 0 or self.size <= self.top_k
+
+    def candidates(self, rec) -> tuple[List[int], bool]:
+        """Indices of the records to score *rec* against, in index order,
+        and whether more records qualified than top_k."""
+        if self.exhaustive:
+            return list(range(self.size)), False
+        shared: dict[int, float] = {}
+        for key in _features(rec).keys:
+            posting = self.postings.get(key)
+            if posting is None or len(posting) > self.max_postings:
+                continue
+            weight = KEY_WEIGHTS[key[0]]
+            for i in posting:
+                shared[i] = shared.get(i, 0.0) + weight
+        qualified = [i for i, w in shared.items() if w >= self.min_shared]
+        limited = len(qualified) > self.top_k
+        if limited:
+            qualified.sort(key=lambda i: (-shared[i], i))
+            qualified = qualified[: self.top_k]
+        # Index order keeps weighted_similarity's tie-breaking (first wins)
+        return sorted(qualified), limited
+
+
+# ---------------------------------------------------------------------------
+# Scoring
+# ---------------------------------------------------------------------------
+# weighted_similarity is pure-Python difflib work, so with many records the
+# scoring runs on a pool of processes, before any prompt: each worker gets
+# the primary records and builds its own CandidateIndex once (initializer),
+# then scores chunks of secondary records.  All chunks are submitted when
+# score_records is called, before the first prompt of the merge, and the
+# results are yielded in secondary order as they arrive, so the interactive
+# phase starts with the first chunk while the workers go on.
+# ---------------------------------------------------------------------------
+
+# Per-worker state set by _init_scorer: the primary features and their index
+_scorer: dict = {}
+
+
+def _best_match(
+    sec: RecordFeatures, pri_features: List[RecordFeatures],
+    index: CandidateIndex, stats: ScoreStats,
+) -> Tuple[float, Optional[int], bool]:
+    best_score, best_i = 0.0, None
+    candidate_ids, limited = index.candidates(sec)
+    for i in candidate_ids:
+        s = _bounded_similarity(sec, pri_features[i], best_score, stats)
+        if s is not None and s > best_score:
+            best_score, best_i = s, i
+    return best_score, best_i, limited
+
+
+def _init_scorer(pri_records: List[Record], top_k: int, min_shared: float):
+    # Ctrl-C is for the parent, which shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    features = [RecordFeatures(rec) for rec in pri_records]
+    _scorer["features"] = features
+    _scorer["index"] = CandidateIndex(features, top_k, min_shared)
+
+
+def _score_chunk(
+    chunk: List[Record],
+) -> Tuple[List[Tuple[float, Optional[int], bool]], ScoreStats]:
+    features, index = _scorer["features"], _scorer["index"]
+    stats = ScoreStats()
+    return [
+        _best_match(RecordFeatures(sec), features, index, stats) for sec in chunk
+    ], stats
+
+
+def score_records(
+    sec_records: List[Record],
+    pri_records: List[Record],
+    top_k: int = CANDIDATES_DEFAULT,
+    min_shared: float = MIN_SHARED_DEFAULT,
+    jobs: int = JOBS_DEFAULT,
+    min_pairs: int = PARALLEL_MIN_PAIRS,
+    stats: Optional[ScoreStats] = None,
+) -> Iterator[Tuple[float, Optional[int], bool]]:
+    """
+    (best score, index of the best primary record or None, candidate limit
+    reached) for each secondary record, in order.  Runs on *jobs* processes
+    when there are at least *min_pairs* pairs to score, in-process otherwise
+    (starting the workers would cost more than it saves).  The pairs scored
+    and pruned are added to *stats* as the results are yielded.
+
+    The scoring starts before this returns: in-process, every record is
+    scored; otherwise the workers are started and all chunks submitted, and
+    the iterator waits for each chunk in turn.  Close the iterator to stop
+    the workers.
+    """
+    if stats is None:
+        stats = ScoreStats()
+    per_record = min(top_k, len(pri_records)) if top_k > 0 else len(pri_records)
+    if jobs <= 1 or len(sec_records) * per_record < min_pairs:
+        features = [RecordFeatures(rec) for rec in pri_records]
+        index = CandidateIndex(features, top_k, min_shared)
+        results = [
+            _best_match(RecordFeatures(sec), features, index, stats)
+            for sec in sec_records
+        ]
+        return (result for result in results)
+
+    pool = ProcessPoolExecutor(
+        max_workers=jobs,
+        # Forking a process that holds SQLite connections is not safe
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_scorer,
+        initargs=(pri_records, top_k, min_shared),
+    )
+    try:
+        futures = [
+            pool.submit(_score_chunk, sec_records[i:i + SCORE_CHUNK_SIZE])
+            for i in range(0, len(sec_records), SCORE_CHUNK_SIZE)
+        ]
+    except BaseException:
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    return _chunk_results(pool, futures, stats)
+
+
+def _chunk_results(
+    pool: ProcessPoolExecutor, futures: list, stats: ScoreStats,
+) -> Iterator[Tuple[float, Optional[int], bool]]:
+    try:
+        for future in futures:
+            results, chunk_stats = future.result()
+            stats.add(chunk_stats)
+            yield from results
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
 def _metadata_identical(a: Record, b: Record) -> bool:
     """True when every user-visible metadata field is exactly equal."""
     return (
@@ -403,27 +810,38 @@ def _metadata_identical(a: Record, b: Record) -> bool:
 # PDF content similarity  (requires pypdf; graceful fallback otherwise)
 # ---------------------------------------------------------------------------
 
-def _pdf_text(path: str) -> Optional[str]:
+def _pdf_text(
+    path: str,
+    sha256: Optional[str] = None,
+    cache: Optional[textcache.TextCache] = None,
+) -> Optional[str]:
     """
     Extract all text from a PDF and return it as a single normalised string.
     Returns None if pypdf is not installed, the file is not a PDF, or
-    extraction fails for any reason.
+    extraction fails for any reason (including a timeout or a crash: it
+    runs in a sandboxed worker process, see bookshelf.extract).
+
+    With a text cache and the file's hash, the text is read through the
+    cache, so a file is only parsed once across merges.
     """
     if not _PYPDF_AVAILABLE:
         return None
     if not path.lower().endswith(".pdf"):
         return None
-    try:
-        _logging.getLogger("pypdf").setLevel(_logging.ERROR)
-        reader = _pypdf.PdfReader(path)
-        pages  = (page.extract_text() or "" for page in reader.pages)
-        text   = " ".join(pages)
-        return " ".join(text.split())   # collapse all whitespace
-    except Exception:
-        return None
+    if cache is not None:
+        result = cache.text(sha256, path)
+    else:
+        result = extract.extract_one(path)
+    return result.text if result.ok else None
 
 
-def _same_pdf_content(path_a: str, path_b: str) -> bool:
+def _same_pdf_content(
+    path_a: str,
+    path_b: str,
+    hash_a: Optional[str] = None,
+    hash_b: Optional[str] = None,
+    cache: Optional[textcache.TextCache] = None,
+) -> bool:
     """
     Return True when two PDF files contain the same text content at or above
     PDF_TEXT_THRESHOLD similarity, even if their binary representations differ
@@ -431,8 +849,8 @@ def _same_pdf_content(path_a: str, path_b: str) -> bool:
 
     Returns False whenever pypdf is unavailable or either file cannot be read.
     """
-    text_a = _pdf_text(path_a)
-    text_b = _pdf_text(path_b)
+    text_a = _pdf_text(path_a, hash_a, cache)
+    text_b = _pdf_text(path_b, hash_b, cache)
     if text_a is None or text_b is None:
         return False
     # Both empty (e.g. scanned image PDFs with no text layer)
@@ -448,34 +866,66 @@ def _same_pdf_content(path_a: str, path_b: str) -> bool:
 # Database helpers
 # ---------------------------------------------------------------------------
 
-def _load_records(db_path: str, table: str) -> List[Record]:
-    conn = sqlite3.connect(db_path)
+def _load_records(db_path: str, table: str, readonly: bool = False) -> List[Record]:
+    conn = db.get_connection(db_path, readonly=readonly)
     cur  = conn.cursor()
+    # Shelves written by older versions have no file columns
+    columns = db.table_columns(conn, table)
+    file_columns = ", ".join(
+        name if name in columns else "NULL" for name in db.FILE_COLUMNS
+    )
     cur.execute(
-        f"SELECT id, filename, title, authors, category, keywords, description"
-        f" FROM {table}"
+        f"SELECT id, filename, title, authors, category, keywords, description,"
+        f" {file_columns} FROM {table}"
     )
     rows = cur.fetchall()
-    conn.close()
     return [Record(*row) for row in rows]
 
 
-def _insert(conn: sqlite3.Connection, table: str, rec: Record):
+def _insert(conn: sqlite3.Connection, table: str, rec: Record,
+            size: Optional[int] = None, mtime_ns: Optional[int] = None):
     """
-    Insert *rec* into *table*.
+    Insert *rec* into *table*, with the size and mtime of its stored file.
     The bookshelf_ai trigger (set up by bookshelf.fuzzy.setup_fts_triggers)
     will automatically keep the FTS index in sync.
     """
     conn.execute(
         f"INSERT INTO {table}"
-        f" (id, filename, title, authors, category, keywords, description)"
-        f" VALUES (?, ?, ?, ?, ?, ?, ?)",
+        f" (id, filename, title, authors, category, keywords, description,"
+        f"  sha256, size, mtime_ns)"
+        f" VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
         (rec.id, rec.filename, rec.title, rec.authors,
-         rec.category, rec.keywords, rec.description),
+         rec.category, rec.keywords, rec.description,
+         rec.sha256, size, mtime_ns),
     )
     conn.commit()
 
 
+def _needs_hash(rec: Record, path: str) -> bool:
+    """
+    True unless the stored hash of *rec* still describes its file at *path*.
+    A file changed in place since it was stored (e.g. a PDF annotated in its
+    shelf) has another size or mtime.  A missing file keeps its stored hash.
+    """
+    if not rec.sha256:
+        return True
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return (st.st_size, st.st_mtime_ns) != (rec.size, rec.mtime_ns)
+
+
+def _store_hash(conn: sqlite3.Connection, table: str, rec_id: str,
+                path: str, digest: str):
+    """Record the hash of a primary file stored without an up-to-date one."""
+    st = os.stat(path)
+    conn.execute(
+        f"UPDATE {table} SET sha256=?, size=?, mtime_ns=? WHERE id=?",
+        (digest, st.st_size, st.st_mtime_ns, rec_id),
+    )
+
+
 def _update(conn: sqlite3.Connection, table: str, rec: Record):
     """
     Overwrite metadata for an existing record (identified by rec.id).
@@ -705,6 +1155,10 @@ def merge(
     low_threshold:    float = LOW_THRESHOLD_DEFAULT,
     report_path:      str   = "merge_report.txt",
     dry_run:          bool  = False,
+    transfer_strategy: str  = "auto",
+    candidates:       int   = CANDIDATES_DEFAULT,
+    min_shared:       float = MIN_SHARED_DEFAULT,
+    jobs:             int   = JOBS_DEFAULT,
 ) -> MergeReport:
     """
     Merge secondary into primary.
@@ -724,16 +1178,29 @@ def merge(
         Where to write the merge report.
     dry_run
         When True, nothing is written to disk or to either database.
+    transfer_strategy
+        How migrated files are copied (see bookshelf.transfer); the strategy
+        used is noted in the report.
+    candidates / min_shared
+        Each secondary record is scored against at most *candidates* primary
+        records sharing keys of weight *min_shared* (see CandidateIndex);
+        0 scores every primary record.
+    jobs
+        Number of processes scoring the records (see score_records).
     """
 
-    report = MergeReport(dry_run=dry_run)
+    report = MergeReport(dry_run=dry_run, candidate_limit=candidates)
 
     # ------------------------------------------------------------------
     # 1. Load records from both sides
     # ------------------------------------------------------------------
-    sec_records = _load_records(secondary_db, table)
+    sec_records = _load_records(secondary_db, table, readonly=True)
     pri_records = _load_records(primary_db,   table)
 
+    # The secondary shelf is read exactly once; the primary connection
+    # stays open for the rest of the process.
+    db.close(secondary_db)
+
     print(f"\n  {ICON_INFO}  Secondary records : {len(sec_records)}")
     print(f"  {ICON_INFO}  Primary records   : {len(pri_records)}")
 
@@ -743,245 +1210,333 @@ def merge(
         return report
 
     # ------------------------------------------------------------------
-    # 2. Build a hash -> Record map for every primary file
-    # ------------------------------------------------------------------
-    print(f"\n  {ICON_INFO}  Hashing primary files ...")
-    pri_hash_map: dict[str, Record] = {}
-    for rec in pri_records:
-        h = _sha256(_file_path(primary_files, rec.filename))
-        if h:
-            pri_hash_map[h] = rec
-
-    # ------------------------------------------------------------------
-    # 3. Open the primary DB for writing
+    # 2. Use the shared primary connection for writing
     #    Triggers (bookshelf_ai / bookshelf_au) were already created by
     #    bookshelf.fuzzy.setup_fts_triggers and will keep the FTS index
     #    up to date automatically on every INSERT or UPDATE below.
     # ------------------------------------------------------------------
     pri_conn: Optional[sqlite3.Connection] = None
     if not dry_run:
-        pri_conn = sqlite3.connect(primary_db)
-        pri_conn.execute("PRAGMA foreign_keys = ON;")
-
-    # ------------------------------------------------------------------
-    # 4. Process each secondary record
-    # ------------------------------------------------------------------
-    total = len(sec_records)
-    for idx, sec in enumerate(sec_records, 1):
-        label = sec.title[:60] or sec.filename
-        print(f"\n  [{idx}/{total}]  {label}")
-
-        sec_fp   = _file_path(secondary_files, sec.filename)
-        sec_hash = _sha256(sec_fp)
-
-        # ── 4a. Exact file-content match ──────────────────────────────
-        # The physical file is identical, so we never need to copy it.
-        # • If metadata also match  → plain duplicate, skip entirely.
-        # • If metadata differ      → same file, two sets of metadata;
-        #   let the user reconcile the fields in the primary record.
-        if sec_hash and sec_hash in pri_hash_map:
-            matched = pri_hash_map[sec_hash]
-            if _metadata_identical(sec, matched):
-                print(
-                    f"         {ICON_INFO}  Exact file + metadata match"
-                    f" -> [{matched.id[:8]}...]. Auto-skipping."
-                )
-                report.add(ReportEntry(
-                    action=MergeAction.SKIPPED,
-                    secondary_id=sec.id,
-                    primary_id=matched.id,
-                    title=sec.title,
-                    score=1.0,
-                    reason="exact SHA-256 file match and identical metadata",
-                ))
-            else:
-                print(
-                    f"         {ICON_INFO}  Exact file match but metadata differ"
-                    f" -> [{matched.id[:8]}...]. Prompting for metadata merge."
-                )
-                merged = _merge_fields(sec, matched)
-                if not dry_run and pri_conn:
-                    _update(pri_conn, table, merged)
-                report.add(ReportEntry(
-                    action=MergeAction.REPLACED,
-                    secondary_id=sec.id,
-                    primary_id=matched.id,
-                    title=merged.title,
-                    score=1.0,
-                    reason="same file, metadata merged by user",
-                ))
-            continue
+        pri_conn = db.get_connection(primary_db)
+        db.ensure_file_columns(pri_conn, table)
 
-        # ── 4b. Best fuzzy metadata match across all primary records ──
-        best_score  = 0.0
-        best_match: Optional[Record] = None
-        for pri in pri_records:
-            s = weighted_similarity(sec, pri)
-            if s > best_score:
-                best_score, best_match = s, pri
-
-        # ── 4b'. Same PDF content despite different hash? ─────────────
-        # Happens when one copy has annotations, highlights, or was
-        # re-saved (binary differs but text is identical).
-        # We only run the expensive text extraction when:
-        #   • pypdf is installed
-        #   • a metadata best_match was found (so we have a candidate)
-        #   • both files are PDFs
-        # If text matches, treat exactly like Case 2 (same file, possibly
-        # different metadata) and jump straight to metadata reconciliation.
-        if (
-            best_match is not None
-            and _PYPDF_AVAILABLE
-            and sec_fp.lower().endswith(".pdf")
-        ):
-            pri_fp = _file_path(primary_files, best_match.filename)
-            if _same_pdf_content(sec_fp, pri_fp):
-                print(
-                    f"         {ICON_INFO}  Same PDF text content (annotated copy?)"
-                    f" -> [{best_match.id[:8]}...]. Checking metadata."
-                )
-                if _metadata_identical(sec, best_match):
+    extraction: Optional[extract.ExtractionPool] = None
+    scores: Optional[Iterator[Tuple[float, Optional[int], bool]]] = None
+    try:
+        # Extracted PDF text is cached in the primary DB by file hash (only
+        # looked up in a dry run), so repeated merges don't parse files again
+        # Extraction runs in a sandboxed worker (per-file timeout, memory limit)
+        cache_conn = pri_conn or db.get_connection(primary_db, readonly=True)
+        text_cache: Optional[textcache.TextCache] = None
+        if _PYPDF_AVAILABLE:
+            extraction = extract.ExtractionPool(jobs=1)
+            text_cache = textcache.TextCache(
+                cache_conn, readonly=dry_run, extractor=extraction.extract,
+            )
+        # Hashes of files without a stored one, of both shelves, are cached in
+        # the primary DB by path, size and mtime (see bookshelf.hashcache)
+        hash_cache = hashcache.HashCache(cache_conn, readonly=dry_run)
+
+        # ------------------------------------------------------------------
+        # 3. Build a hash -> Record map for every primary file
+        #    Stored hashes are used while the size and mtime stored with them
+        #    match the file; other files are hashed (through the hash cache),
+        #    and the hash is saved unless this is a dry run.
+        # ------------------------------------------------------------------
+        print(f"\n  {ICON_INFO}  Looking up primary file hashes ...")
+        pri_paths = [_file_path(primary_files, rec.filename) for rec in pri_records]
+        stale = [
+            (rec, path) for rec, path in zip(pri_records, pri_paths)
+            if _needs_hash(rec, path)
+        ]
+        pri_hashed = hash_cache.hash_many(path for _, path in stale)
+        n_hashed = 0
+        for rec, path in stale:
+            h = pri_hashed[path]
+            if h:
+                n_hashed += 1
+                rec.sha256 = h
+                if pri_conn:
+                    _store_hash(pri_conn, table, rec.id, path, h)
+        if pri_conn:
+            pri_conn.commit()
+        if n_hashed:
+            print(f"  {ICON_INFO}  Hashed {n_hashed} files without an up-to-date"
+                  f" stored hash")
+        pri_hash_map: dict[str, Record] = {
+            rec.sha256: rec for rec in pri_records if rec.sha256
+        }
+
+        # ------------------------------------------------------------------
+        # 3b. Score the secondary records no file hash matches
+        #     Scoring does not depend on the answers given below, so it runs
+        #     ahead of the prompts (in parallel, see score_records).
+        # ------------------------------------------------------------------
+        sec_paths = [_file_path(secondary_files, sec.filename) for sec in sec_records]
+        sec_hashed = hash_cache.hash_many(
+            path for sec, path in zip(sec_records, sec_paths) if _needs_hash(sec, path)
+        )
+        sec_hashes = [
+            sec_hashed.get(path) or sec.sha256
+            for sec, path in zip(sec_records, sec_paths)
+        ]
+        to_score = [
+            sec for sec, h in zip(sec_records, sec_hashes)
+            if not (h and h in pri_hash_map)
+        ]
+        if to_score:
+            print(f"  {ICON_INFO}  Scoring {len(to_score)} records"
+                  f" against {len(pri_records)} primary records ...")
+        scores = score_records(to_score, pri_records, candidates, min_shared, jobs,
+                               stats=report.scoring)
+
+        # ------------------------------------------------------------------
+        # 4. Process each secondary record
+        # ------------------------------------------------------------------
+        total = len(sec_records)
+        for idx, sec in enumerate(sec_records, 1):
+            label = sec.title[:60] or sec.filename
+            print(f"\n  [{idx}/{total}]  {label}")
+
+            sec_fp   = _file_path(secondary_files, sec.filename)
+            sec_hash = sec_hashes[idx - 1]
+
+            # ── 4a. Exact file-content match ──────────────────────────────
+            # The physical file is identical, so we never need to copy it.
+            # • If metadata also match  → plain duplicate, skip entirely.
+            # • If metadata differ      → same file, two sets of metadata;
+            #   let the user reconcile the fields in the primary record.
+            if sec_hash and sec_hash in pri_hash_map:
+                matched = pri_hash_map[sec_hash]
+                if _metadata_identical(sec, matched):
                     print(
-                        f"         {ICON_INFO}  Metadata also identical. Auto-skipping."
+                        f"         {ICON_INFO}  Exact file + metadata match"
+                        f" -> [{matched.id[:8]}...]. Auto-skipping."
                     )
                     report.add(ReportEntry(
                         action=MergeAction.SKIPPED,
                         secondary_id=sec.id,
-                        primary_id=best_match.id,
+                        primary_id=matched.id,
                         title=sec.title,
                         score=1.0,
-                        reason="same PDF text content and identical metadata",
+                        reason="exact SHA-256 file match and identical metadata",
                     ))
                 else:
                     print(
-                        f"         {ICON_INFO}  Metadata differ. Prompting for merge."
+                        f"         {ICON_INFO}  Exact file match but metadata differ"
+                        f" -> [{matched.id[:8]}...]. Prompting for metadata merge."
                     )
-                    merged = _merge_fields(sec, best_match)
+                    merged = _merge_fields(sec, matched)
                     if not dry_run and pri_conn:
                         _update(pri_conn, table, merged)
                     report.add(ReportEntry(
                         action=MergeAction.REPLACED,
                         secondary_id=sec.id,
-                        primary_id=best_match.id,
+                        primary_id=matched.id,
                         title=merged.title,
                         score=1.0,
-                        reason="same PDF text content, metadata merged by user",
+                        reason="same file, metadata merged by user",
                     ))
                 continue
 
-        # ── 4c. Very high metadata similarity but files differ ────────
-        # The two records look like the same document but the physical files
-        # are not identical (different versions, formats, or editions).
-        # Keep both so neither copy is lost; log the decision.
-        migrate_directly = False   # set True to bypass the interactive prompt
-        if best_score >= high_threshold and best_match:
-            print(
-                f"         {ICON_INFO}  High metadata similarity ({best_score:.0%})"
-                f" but different files -> keeping both."
+            # ── 4b. Best fuzzy metadata match across all primary records ──
+            #     (only against the candidates sharing keys with it; scored in 3b)
+            best_score, best_i, limited = next(scores)
+            best_match: Optional[Record] = (
+                pri_records[best_i] if best_i is not None else None
             )
-            migrate_directly = True
-
-        # ── 4d. Ambiguous -> ask the user ─────────────────────────────
-        if not migrate_directly and best_score >= low_threshold and best_match:
-            choice = _ask_user(sec, best_match, best_score)
-
-            if choice == "s":
-                report.add(ReportEntry(
-                    action=MergeAction.SKIPPED,
-                    secondary_id=sec.id,
-                    primary_id=best_match.id,
-                    title=sec.title,
-                    score=best_score,
-                    reason="user chose skip",
-                ))
-                continue
-
-            if choice == "m":
-                # Field-by-field: user picks which value to keep per field.
-                merged = _merge_fields(sec, best_match)
-                if not dry_run and pri_conn:
-                    _update(pri_conn, table, merged)
+            if limited:
+                report.limited += 1
+
+            # ── 4b'. Same PDF content despite different hash? ─────────────
+            # Happens when one copy has annotations, highlights, or was
+            # re-saved (binary differs but text is identical).
+            # We only run the expensive text extraction (read through the
+            # primary's text cache, so each file is parsed once) when:
+            #   • pypdf is installed
+            #   • a metadata best_match was found (so we have a candidate)
+            #   • both files are PDFs
+            # If text matches, treat exactly like Case 2 (same file, possibly
+            # different metadata) and jump straight to metadata reconciliation.
+            if (
+                best_match is not None
+                and _PYPDF_AVAILABLE
+                and sec_fp.lower().endswith(".pdf")
+            ):
+                pri_fp = _file_path(primary_files, best_match.filename)
+                if _same_pdf_content(sec_fp, pri_fp, sec_hash, best_match.sha256,
+                                     text_cache):
+                    print(
+                        f"         {ICON_INFO}  Same PDF text content (annotated copy?)"
+                        f" -> [{best_match.id[:8]}...]. Checking metadata."
+                    )
+                    if _metadata_identical(sec, best_match):
+                        print(
+                            f"         {ICON_INFO}  Metadata also identical. Auto-skipping."
+                        )
+                        report.add(ReportEntry(
+                            action=MergeAction.SKIPPED,
+                            secondary_id=sec.id,
+                            primary_id=best_match.id,
+                            title=sec.title,
+                            score=1.0,
+                            reason="same PDF text content and identical metadata",
+                        ))
+                    else:
+                        print(
+                            f"         {ICON_INFO}  Metadata differ. Prompting for merge."
+                        )
+                        merged = _merge_fields(sec, best_match)
+                        if not dry_run and pri_conn:
+                            _update(pri_conn, table, merged)
+                        report.add(ReportEntry(
+                            action=MergeAction.REPLACED,
+                            secondary_id=sec.id,
+                            primary_id=best_match.id,
+                            title=merged.title,
+                            score=1.0,
+                            reason="same PDF text content, metadata merged by user",
+                        ))
+                    continue
+
+            # ── 4c. Very high metadata similarity but files differ ────────
+            # The two records look like the same document but the physical files
+            # are not identical (different versions, formats, or editions).
+            # Keep both so neither copy is lost; log the decision.
+            migrate_directly = False   # set True to bypass the interactive prompt
+            if best_score >= high_threshold and best_match:
                 print(
-                    f"         {ICON_INFO}  Primary [{best_match.id[:8]}...]"
-                    " metadata updated with merged values."
+                    f"         {ICON_INFO}  High metadata similarity ({best_score:.0%})"
+                    f" but different files -> keeping both."
                 )
-                report.add(ReportEntry(
-                    action=MergeAction.REPLACED,
-                    secondary_id=sec.id,
-                    primary_id=best_match.id,
-                    title=merged.title,
-                    score=best_score,
-                    reason="user merged field-by-field",
-                ))
-                continue
+                migrate_directly = True
 
-            # choice == "b": fall through to migrate below
-
-        # ── 4e. Migrate: copy file + insert DB record ─────────────────
-        # Reached when:
-        #   - fuzzy score is below low_threshold  (clearly a new record), OR
-        #   - high metadata similarity but different files (auto keep both), OR
-        #   - user chose "keep both" (b) in the interactive prompt
-        #   (choices 's' and 'm' both continue'd above, so they never reach here)
-        if migrate_directly:
-            # high similarity, different files: auto keep both
-            action = MergeAction.KEPT_BOTH
-            reason = (
-                f"auto keep both: high metadata similarity ({best_score:.0%})"
-                " but different files"
-            )
-        elif best_score >= low_threshold:
-            # user explicitly chose "b"
-            action = MergeAction.KEPT_BOTH
-            reason = "user chose keep both"
-        else:
-            action = MergeAction.MIGRATED
-            reason = f"fuzzy score {best_score:.2f} < low threshold {low_threshold}"
-
-        file_note = ""
-        if not os.path.isfile(sec_fp):
-            file_note = " (source file missing - DB record only)"
-        elif not dry_run and pri_conn:
-            dst_fp = _file_path(primary_files, sec.filename)
-
-            # UUID collision: astronomically rare, but handle it cleanly
-            if os.path.exists(dst_fp):
-                _, ext    = os.path.splitext(sec.filename)
-                new_fname = f"{uuid.uuid4()}{ext}"
-                new_id    = new_fname[: -len(ext)]  # strip extension to get bare UUID
-                sec = Record(
-                    id=new_id,
-                    filename=new_fname,
-                    title=sec.title,
-                    authors=sec.authors,
-                    category=sec.category,
-                    keywords=sec.keywords,
-                    description=sec.description,
-                )
-                dst_fp = _file_path(primary_files, sec.filename)
+            # ── 4d. Ambiguous -> ask the user ─────────────────────────────
+            if not migrate_directly and best_score >= low_threshold and best_match:
+                choice = _ask_user(sec, best_match, best_score)
 
-            _ensure_subdir(primary_files, sec.filename)
-            shutil.copy2(sec_fp, dst_fp)
+                if choice == "s":
+                    report.add(ReportEntry(
+                        action=MergeAction.SKIPPED,
+                        secondary_id=sec.id,
+                        primary_id=best_match.id,
+                        title=sec.title,
+                        score=best_score,
+                        reason="user chose skip",
+                    ))
+                    continue
 
-        if not dry_run and pri_conn:
-            _insert(pri_conn, table, sec)
+                if choice == "m":
+                    # Field-by-field: user picks which value to keep per field.
+                    merged = _merge_fields(sec, best_match)
+                    if not dry_run and pri_conn:
+                        _update(pri_conn, table, merged)
+                    print(
+                        f"         {ICON_INFO}  Primary [{best_match.id[:8]}...]"
+                        " metadata updated with merged values."
+                    )
+                    report.add(ReportEntry(
+                        action=MergeAction.REPLACED,
+                        secondary_id=sec.id,
+                        primary_id=best_match.id,
+                        title=merged.title,
+                        score=best_score,
+                        reason="user merged field-by-field",
+                    ))
+                    continue
+
+                # choice == "b": fall through to migrate below
+
+            # ── 4e. Migrate: copy file + insert DB record ─────────────────
+            # Reached when:
+            #   - fuzzy score is below low_threshold  (clearly a new record), OR
+            #   - high metadata similarity but different files (auto keep both), OR
+            #   - user chose "keep both" (b) in the interactive prompt
+            #   (choices 's' and 'm' both continue'd above, so they never reach here)
+            if migrate_directly:
+                # high similarity, different files: auto keep both
+                action = MergeAction.KEPT_BOTH
+                reason = (
+                    f"auto keep both: high metadata similarity ({best_score:.0%})"
+                    " but different files"
+                )
+            elif best_score >= low_threshold:
+                # user explicitly chose "b"
+                action = MergeAction.KEPT_BOTH
+                reason = "user chose keep both"
+            else:
+                action = MergeAction.MIGRATED
+                reason = f"fuzzy score {best_score:.2f} < low threshold {low_threshold}"
+
+            if limited:
+                reason += f"; candidate limit ({candidates}) reached"
+
+            file_note = ""
+            file_info = (None, None)
+            if not os.path.isfile(sec_fp):
+                file_note = " (source file missing - DB record only)"
+                sec.sha256 = None
+            elif not dry_run and pri_conn:
+                dst_fp = _file_path(primary_files, sec.filename)
 
-        print(f"         {ICON_INFO}  Migrated -> [{sec.id[:8]}...].{file_note}")
-        report.add(ReportEntry(
-            action=action,
-            secondary_id=sec.id,
-            primary_id=None,
-            title=sec.title,
-            score=best_score,
-            reason=reason + file_note,
-        ))
+                # UUID collision: astronomically rare, but handle it cleanly
+                if os.path.exists(dst_fp):
+                    _, ext    = os.path.splitext(sec.filename)
+                    new_fname = f"{uuid.uuid4()}{ext}"
+                    new_id    = new_fname[: -len(ext)]  # strip extension to get bare UUID
+                    sec = Record(
+                        id=new_id,
+                        filename=new_fname,
+                        title=sec.title,
+                        authors=sec.authors,
+                        category=sec.category,
+                        keywords=sec.keywords,
+                        description=sec.description,
+                    )
+                    dst_fp = _file_path(primary_files, sec.filename)
+
+                _ensure_subdir(primary_files, sec.filename)
+                # copystat keeps copy2's metadata behaviour.  A content-addressed
+                # primary links to an existing blob instead, whose (shared)
+                # metadata is left alone.
+                result = store.store_file(
+                    sec_fp, dst_fp, primary_files, digest=sec_hash,
+                    strategy=transfer_strategy,
+                )
+                if not store.is_content_addressed(primary_files):
+                    shutil.copystat(sec_fp, dst_fp)
+                sec.sha256 = result.sha256
+                file_info = (result.size, os.stat(dst_fp).st_mtime_ns)
+                file_note = f" (file: {result.method})"
+
+            if not dry_run and pri_conn:
+                _insert(pri_conn, table, sec, *file_info)
+
+            print(f"         {ICON_INFO}  Migrated -> [{sec.id[:8]}...].{file_note}")
+            report.add(ReportEntry(
+                action=action,
+                secondary_id=sec.id,
+                primary_id=None,
+                title=sec.title,
+                score=best_score,
+                reason=reason + file_note,
+            ))
+    finally:
+        # Also on an error or Ctrl-C: stop the extraction and scoring workers
+        if scores is not None:
+            scores.close()
+        if extraction is not None:
+            extraction.close()
 
     # ------------------------------------------------------------------
     # 5. Wrap up
     # ------------------------------------------------------------------
-    if pri_conn:
-        pri_conn.close()
-
+    if hash_cache.hits + hash_cache.misses:
+        print(f"\n  {ICON_INFO}  File hashes: {hash_cache.hits} from the cache,"
+              f" {hash_cache.misses} read")
+    if text_cache is not None and text_cache.hits + text_cache.misses:
+        print(f"\n  {ICON_INFO}  PDF text: {text_cache.hits} from the cache,"
+              f" {text_cache.misses} extracted")
     print(report.summary())
     report.write(report_path)
     print(f"\n  {ICON_INFO}  Report written -> {report_path}\n")
@@ -1018,6 +1573,19 @@ def _build_parser() -> argparse.ArgumentParser:
                    help="Path for the written merge report")
     p.add_argument("--dry-run",          action="store_true",
                    help="Simulate without writing any changes")
+    p.add_argument("--transfer",         default="auto",
+                   choices=transfer.STRATEGIES,
+                   help="How migrated files are copied")
+    p.add_argument("--candidates",       type=int,
+                   default=CANDIDATES_DEFAULT,
+                   help="Primary records scored per secondary record"
+                        " (0: all of them)")
+    p.add_argument("--jobs",             type=int, default=JOBS_DEFAULT,
+                   help="Processes scoring the records")
+    p.add_argument("--min-shared-keys",  type=float,
+                   default=MIN_SHARED_DEFAULT,
+                   help="Weight of the title words, author names and title"
+                        " trigrams a candidate must share")
     return p
 
 
@@ -1044,6 +1612,10 @@ def run_merge_cli(argv: list[str] | None = None):
         low_threshold=args.low_threshold,
         report_path=args.report,
         dry_run=args.dry_run,
+        transfer_strategy=args.transfer,
+        candidates=args.candidates,
+        min_shared=args.min_shared_keys,
+        jobs=args.jobs,
     )
 
 
@@ -0,0 +1,141 @@
+"""
+bookshelf/prefill.py
+
+Suggested metadata for a PDF being added, read in the background.
+
+While the add flow asks for the title, authors, ... the PDF's document
+information and XMP metadata (title, author, subject, keywords) and the
+text of its first page are read with pypdf, in a sandboxed worker process
+(bookshelf.extract) waited for on a daemon thread.  Each field
+is a Future that bookshelf.util.string_input uses as the prompt's default:
+at once if it is ready when the prompt is shown, or typed into the empty
+prompt as soon as it becomes ready.
+
+The prompt never waits for the extraction.  After PREFILL_TIMEOUT seconds
+the fields resolve to "" and the worker is killed, so a huge or malformed
+PDF only means no suggestions.  Without pypdf, or for other file
+types, there is nothing to prefill.
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import os
+import re
+import threading
+from concurrent.futures import Future
+from typing import Dict, Optional
+
+# Seconds after which suggestions are given up
+PREFILL_TIMEOUT = 5.0
+# Longest first line of the first page taken as a title
+MAX_TITLE_LENGTH = 200
+
+FIELDS = ("title", "authors", "keywords", "description")
+
+# Only checked here; pypdf is imported on the worker thread
+_PYPDF_AVAILABLE = importlib.util.find_spec("pypdf") is not None
+
+# Titles that word processors and scanners put in the document information
+_PLACEHOLDER_TITLE = re.compile(
+    r"^(untitled|microsoft word - .*|.*\.(docx?|dvi|tex|pdf|ps|indd))$", re.IGNORECASE
+)
+
+
+def _clean(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, dict):
+        # XMP language alternatives, e.g. {"x-default": "..."}
+        value = value.get("x-default") or next(iter(value.values()), "")
+    if isinstance(value, (list, tuple)):
+        value = ", ".join(filter(None, (_clean(v) for v in value)))
+    return " ".join(str(value).split())
+
+
+def _first_line(text: str) -> str:
+    for line in text.splitlines():
+        line = " ".join(line.split())
+        if line:
+            return line if len(line) <= MAX_TITLE_LENGTH else ""
+    return ""
+
+
+def metadata_from(info, xmp, first_page_text: str) -> Dict[str, str]:
+    """Field suggestions from pypdf's document information, XMP metadata
+    (either may be None) and first-page text; document information wins."""
+    title = _clean(getattr(info, "title", None)) or _clean(getattr(xmp, "dc_title", None))
+    if _PLACEHOLDER_TITLE.match(title):
+        title = ""
+    return {
+        "title": title or _first_line(first_page_text),
+        "authors": _clean(getattr(info, "author", None))
+        or _clean(getattr(xmp, "dc_creator", None)),
+        "keywords": _clean(getattr(info, "keywords", None))
+        or _clean(getattr(xmp, "dc_subject", None)),
+        "description": _clean(getattr(info, "subject", None))
+        or _clean(getattr(xmp, "dc_description", None)),
+    }
+
+
+def extract_metadata(path: str) -> Dict[str, str]:
+    """Read the field suggestions of the PDF at *path*, in this process
+    (slow, and unsafe on a hostile file: see read_metadata)."""
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    try:
+        xmp = reader.xmp_metadata
+    except Exception:
+        xmp = None
+    text = reader.pages[0].extract_text() if len(reader.pages) > 0 else ""
+    return metadata_from(reader.metadata, xmp, text or "")
+
+
+def read_metadata(path: str, timeout: float) -> Dict[str, str]:
+    """extract_metadata() in a worker process; {} on any failure."""
+    from bookshelf.extract import KIND_METADATA, extract_one
+
+    return extract_one(path, KIND_METADATA, timeout).metadata
+
+
+class Prefill:
+    """Field suggestions for one file, computed on a daemon thread."""
+
+    def __init__(self, path: str, timeout: float = PREFILL_TIMEOUT):
+        self.fields: Dict[str, Future] = {name: Future() for name in FIELDS}
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._timer = threading.Timer(timeout, self._resolve, args=({},))
+        self._timer.daemon = True
+        self._timer.start()
+        # A daemon thread, unlike an executor's, does not hold up exit
+        threading.Thread(
+            target=self._run, args=(path,), name="bookshelf-prefill", daemon=True
+        ).start()
+
+    def _run(self, path: str):
+        try:
+            metadata = read_metadata(path, self.timeout)
+        except Exception:
+            metadata = {}
+        self._timer.cancel()
+        self._resolve(metadata)
+
+    def _resolve(self, metadata: Dict[str, str]):
+        # First caller wins: the result, or the timer's empty one
+        with self._lock:
+            for name, future in self.fields.items():
+                if not future.done():
+                    future.set_result(metadata.get(name, ""))
+
+    def get(self, name: str) -> Optional[Future]:
+        return self.fields.get(name)
+
+
+def start_prefill(path: str) -> Optional[Prefill]:
+    """Start reading suggestions for *path*, or return None if there is
+    nothing to read (not a PDF, or pypdf is not installed)."""
+    if not _PYPDF_AVAILABLE or os.path.splitext(path)[1].lower() != ".pdf":
+        return None
+    return Prefill(path)
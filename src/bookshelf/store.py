@@ -0,0 +1,228 @@
+"""
+bookshelf/store.py
+
+Layouts of the file store (the 'files' directory of a shelf).
+
+uuid (default):
+  Every record's file is its own copy at files/<id[:2]>/<id><ext>, so the
+  same paper added three times takes three times the space.
+
+cas (content-addressed):
+  File contents are kept once, as read-only blobs named by their SHA-256:
+
+    files/objects/<sha256[:2]>/<sha256>
+
+  and every record's usual path is a hard link to the blob of its content.
+  Identical uploads, merged shelves and inbox exports link to the same blob
+  instead of copying it.  Because the record paths do not move, everything
+  that opens, moves or hashes files/<id[:2]>/<id><ext> works unchanged in
+  both layouts.  A store is content-addressed once files/objects exists;
+  'bookshelf store migrate' converts a uuid store in place.
+
+  Blobs are read-only, so a program editing a record's file (or an inbox
+  export) in place cannot change every record sharing it; programs that
+  save by writing a new file and renaming it are unaffected.  A replaced
+  file is never written through: a link to the new blob is renamed over it
+  once the blob exists, so a failed replace leaves the old file in place.  A blob whose last record is
+  removed is left behind until 'bookshelf store gc'.
+
+Hard links need the whole store on one file system.
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+import stat
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import bookshelf.util as util
+from bookshelf.transfer import TransferResult, transfer_file
+
+STORAGE_MODES = ("uuid", "cas")
+OBJECTS_DIR = "objects"
+
+# Blobs are read-only for everyone
+BLOB_MODE = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+
+@dataclass
+class MigrateStats:
+    linked: int = 0         # record files now linked to a blob
+    deduplicated: int = 0   # of which had the same content as another record
+    bytes_saved: int = 0
+    hashed: Dict[str, Tuple[str, int]] = field(default_factory=dict)
+    missing: List[str] = field(default_factory=list)
+
+
+def objects_dir(files_dir: str) -> str:
+    return os.path.join(files_dir, OBJECTS_DIR)
+
+
+def is_content_addressed(files_dir: str) -> bool:
+    return os.path.isdir(objects_dir(files_dir))
+
+
+def init(files_dir: str, mode: str):
+    """Prepare *files_dir* for *mode* ('cas' creates the objects directory)."""
+    if mode not in STORAGE_MODES:
+        raise ValueError(
+            f"Unknown storage mode '{mode}' (choose from {', '.join(STORAGE_MODES)})"
+        )
+    if mode == "cas":
+        os.makedirs(objects_dir(files_dir), exist_ok=True)
+
+
+def blob_path(files_dir: str, digest: str) -> str:
+    return os.path.join(objects_dir(files_dir), digest[:2], digest)
+
+
+def _link(blob: str, dst: str):
+    """Make *dst* a hard link to *blob*, replacing whatever is at *dst*."""
+    if _is_linked(dst, blob):
+        # rename() between two links to one file does nothing
+        return
+    tmp = f"{dst}.{uuid.uuid4().hex}.tmp"
+    os.link(blob, tmp)
+    try:
+        os.replace(tmp, dst)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _is_linked(path: str, blob: str) -> bool:
+    try:
+        return os.path.samefile(path, blob)
+    except FileNotFoundError:
+        return False
+
+
+def _adopt(path: str, blob: str):
+    """Make the file at *path* the blob (no copy): link it, mark it read-only."""
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    os.chmod(path, BLOB_MODE)
+    try:
+        os.link(path, blob)
+    except FileExistsError:
+        # Another writer stored the same content first; use its blob
+        _link(blob, path)
+
+
+def store_file(src: str, dst: str, files_dir: str, digest: Optional[str] = None,
+               exclusive: bool = False, strategy: str = "auto") -> TransferResult:
+    """Store *src* as the record file *dst*.
+
+    In a uuid store this is a copy (see bookshelf.transfer for *strategy*).
+    In a cas store, *dst* is linked to the blob of the content, which is
+    only written if it does not exist yet.  With the *digest* of *src*
+    already known, the file is not hashed again after the copy, and not
+    read at all if a blob of the same size exists.  With *exclusive*, an
+    existing *dst* raises FileExistsError instead of being replaced.
+    """
+    if not is_content_addressed(files_dir):
+        return transfer_file(src, dst, strategy, exclusive=exclusive,
+                             digest=digest)
+
+    if exclusive and os.path.lexists(dst):
+        raise FileExistsError(f"File already exists: {dst}")
+
+    if digest is not None:
+        blob = blob_path(files_dir, digest)
+        try:
+            if os.path.getsize(blob) == os.path.getsize(src):
+                _link(blob, dst)
+                return TransferResult("hardlink", digest, os.path.getsize(blob))
+        except FileNotFoundError:
+            pass
+
+    tmp = os.path.join(objects_dir(files_dir), f".{uuid.uuid4().hex}.tmp")
+    result = transfer_file(src, tmp, strategy, exclusive=True, digest=digest)
+    try:
+        _adopt(tmp, blob_path(files_dir, result.sha256))
+        _link(blob_path(files_dir, result.sha256), dst)
+    finally:
+        os.unlink(tmp)
+    return result
+
+
+def export_file(src: str, dst: str, files_dir: str, strategy: str = "auto") -> str:
+    """Put a copy of the record file *src* at *dst*; return how it was made.
+
+    In a cas store the copy is a link to the (read-only) blob.  In a uuid
+    store with the 'hardlink' strategy it is a link to the record file,
+    which is then made read-only as well: editing the export in place
+    would change the stored file.
+    """
+    if is_content_addressed(files_dir):
+        try:
+            _link(src, dst)
+            return "hardlink"
+        except OSError:
+            # e.g. the inbox is on another file system
+            pass
+    result = transfer_file(src, dst, strategy, allow_link=True)
+    if result.method == "hardlink":
+        mode = stat.S_IMODE(os.stat(dst).st_mode)
+        os.chmod(dst, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+    else:
+        shutil.copymode(src, dst)
+    return result.method
+
+
+def migrate(files_dir: str,
+            records: Iterable[Tuple[str, Optional[str]]]) -> MigrateStats:
+    """Convert *files_dir* to the cas layout in place.
+
+    *records* are (filename, recorded sha256 or None) pairs.  Each record
+    file becomes a link to the blob of its content: the first file with a
+    given content becomes the blob itself (no copy), later ones are replaced
+    by links to it.  Every file is hashed, since a blob must never be named
+    after stale content; hashes that differ from the recorded one (or were
+    not recorded) are returned in stats.hashed as {filename: (sha256, size)}.
+    Files already linked to their blob are not read again.
+    """
+    init(files_dir, "cas")
+    stats = MigrateStats()
+    for filename, recorded in records:
+        path = os.path.join(files_dir, filename[:2], filename)
+        if not os.path.isfile(path):
+            stats.missing.append(filename)
+            continue
+        if recorded is not None and _is_linked(path, blob_path(files_dir, recorded)):
+            stats.linked += 1
+            continue
+        digest = util.sha256_file(path)
+        if digest != recorded:
+            stats.hashed[filename] = (digest, os.path.getsize(path))
+
+        blob = blob_path(files_dir, digest)
+        if not os.path.exists(blob):
+            _adopt(path, blob)
+        elif not os.path.samefile(path, blob):
+            size = os.path.getsize(path)
+            _link(blob, path)
+            stats.deduplicated += 1
+            stats.bytes_saved += size
+        stats.linked += 1
+    return stats
+
+
+def gc(files_dir: str) -> Tuple[int, int]:
+    """Remove blobs no record (or export) links to; return (count, bytes)."""
+    removed, freed = 0, 0
+    root = objects_dir(files_dir)
+    if not os.path.isdir(root):
+        return removed, freed
+    for sub in os.scandir(root):
+        if not sub.is_dir():
+            continue
+        for entry in os.scandir(sub.path):
+            st = entry.stat()
+            if st.st_nlink == 1:
+                os.unlink(entry.path)
+                removed += 1
+                freed += st.st_size
+    return removed, freed
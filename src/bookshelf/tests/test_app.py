@@ -0,0 +1,206 @@
+"""
+tests/test_app.py
+
+Test suite for the non-interactive parts of bookshelf.app.
+
+Run with:
+    pytest tests/test_app.py -v
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+
+import pytest
+
+import bookshelf.db as db
+import bookshelf.transfer
+import bookshelf.util
+from bookshelf.app import Bookshelf, DuplicateDocumentError, Metadata
+
+
+@pytest.fixture()
+def shelf(monkeypatch):
+    with tempfile.TemporaryDirectory() as home:
+        monkeypatch.setenv("HOME", home)
+        b = Bookshelf(show_banner=False)
+        for i in range(5):
+            b.register_document(Metadata(
+                f"id{i}.pdf", f"Bloom filters {i}", "Burton Bloom", "Paper",
+                "bloom_filter", "Line one\tand\nline two",
+            ))
+        yield b
+        db.close(b.db_path)
+
+
+def _stream(shelf, keyword, fmt, **kwargs) -> str:
+    out = io.StringIO()
+    shelf.stream_search_results(keyword, fmt, out=out, **kwargs)
+    return out.getvalue()
+
+
+class TestStreamSearchResults:
+
+    def test_ndjson_one_object_per_line(self, shelf):
+        lines = _stream(shelf, "bloom", "ndjson").splitlines()
+        assert len(lines) == 5
+        assert json.loads(lines[0])["title"] == "Bloom filters 0"
+
+    def test_json_is_valid_array(self, shelf):
+        items = json.loads(_stream(shelf, "bloom", "json"))
+        assert [item["id"] for item in items] == [f"id{i}" for i in range(5)]
+
+    def test_json_empty(self, shelf):
+        assert json.loads(_stream(shelf, "nothing-like-this", "json")) == []
+
+    def test_tsv_cells_stay_on_one_line(self, shelf):
+        lines = _stream(shelf, "bloom", "tsv", fields=["id", "description"]).splitlines()
+        assert lines[0] == "id0\tLine one and line two"
+
+    def test_fields_limit_offset(self, shelf):
+        lines = _stream(shelf, "bloom", "ndjson",
+                        fields=["id"], limit=2, offset=1).splitlines()
+        assert [json.loads(line) for line in lines] == [{"id": "id1"}, {"id": "id2"}]
+
+    def test_substring_fallback(self, shelf):
+        assert len(_stream(shelf, "loom_fil", "ndjson").splitlines()) == 5
+
+    def test_substrings_are_found_with_word_matches(self, shelf):
+        for i, title in enumerate(["Loom weaving handbook", "On the bloom filter",
+                                   "bloom_filter tricks"]):
+            shelf.register_document(Metadata(f"loom{i}.pdf", title, "", "", "", ""))
+        ids = [json.loads(line)["id"]
+               for line in _stream(shelf, "loom", "ndjson", fields=["id"]).splitlines()]
+        like = [row[0] for row in shelf.query_documents("loom", "like")]
+        assert sorted(ids) == sorted(like) and len(ids) == 8
+
+    def test_words_in_any_order(self, shelf):
+        assert len(_stream(shelf, "filters bloom", "ndjson").splitlines()) == 5
+
+    def test_unknown_field(self, shelf):
+        with pytest.raises(ValueError):
+            _stream(shelf, "bloom", "tsv", fields=["nope"])
+
+
+class TestFileHashes:
+
+    def _file(self, shelf, name, content):
+        path = os.path.join(os.path.dirname(shelf.root_dir), name)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    def _hash_columns(self, shelf, identifier):
+        return shelf.conn.execute(
+            "SELECT sha256, size, mtime_ns FROM docs WHERE id = ?", (identifier,)
+        ).fetchone()
+
+    def test_add_records_hash_of_copy(self, shelf):
+        identifier = shelf.add_document_with_metadata(
+            self._file(shelf, "a.pdf", b"content"), title="A")
+        digest, size, mtime_ns = self._hash_columns(shelf, identifier)
+        assert digest == hashlib.sha256(b"content").hexdigest()
+        assert size == 7
+        stored = os.path.join(shelf.root_dir, shelf.files_dir,
+                              identifier[0:2], identifier + ".pdf")
+        assert mtime_ns == os.stat(stored).st_mtime_ns
+
+    def test_old_shelf_gets_columns(self, shelf):
+        columns = db.table_columns(shelf.conn, "docs")
+        assert columns[-3:] == ["sha256", "size", "mtime_ns"]
+        db.ensure_file_columns(shelf.conn, "docs")     # idempotent
+        assert db.table_columns(shelf.conn, "docs") == columns
+
+    def test_update_then_verify(self, shelf, capsys):
+        # The fixture's records have no stored files: all missing
+        assert len(shelf.update_hashes()) == 5
+        identifier = shelf.add_document_with_metadata(
+            self._file(shelf, "b.pdf", b"original"))
+        shelf.conn.execute("UPDATE docs SET sha256 = NULL WHERE id = ?", (identifier,))
+        shelf.conn.commit()
+
+        shelf.update_hashes()
+        assert self._hash_columns(shelf, identifier)[0] == \
+            hashlib.sha256(b"original").hexdigest()
+
+        stored = os.path.join(shelf.root_dir, shelf.files_dir,
+                              identifier[0:2], identifier + ".pdf")
+        with open(stored, "wb") as f:
+            f.write(b"tampered")
+        assert identifier in shelf.update_hashes(verify=True)
+
+
+class TestDuplicateOnAdd:
+
+    def _file(self, shelf, name, content):
+        path = os.path.join(os.path.dirname(shelf.root_dir), name)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    def _count(self, shelf):
+        return shelf.conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def test_non_interactive_add_refuses_duplicate(self, shelf):
+        first = shelf.add_document_with_metadata(self._file(shelf, "a.pdf", b"same"))
+        with pytest.raises(DuplicateDocumentError) as e:
+            shelf.add_document_with_metadata(self._file(shelf, "b.pdf", b"same"))
+        assert e.value.identifier == first
+        shelf.add_document_with_metadata(
+            self._file(shelf, "b.pdf", b"same"), allow_duplicate=True)
+        assert self._count(shelf) == 7
+
+    def test_same_size_different_content(self, shelf):
+        shelf.add_document_with_metadata(self._file(shelf, "a.pdf", b"aaaa"))
+        assert shelf.find_duplicate(self._file(shelf, "b.pdf", b"bbbb"))[0] is None
+
+    def test_no_candidate_no_hashing(self, shelf, monkeypatch):
+        shelf.add_document_with_metadata(self._file(shelf, "a.pdf", b"aaaa"))
+        monkeypatch.setattr("bookshelf.util.sha256_file", None)   # must not be called
+        assert shelf.find_duplicate(
+            self._file(shelf, "b.pdf", b"other size")) == (None, None)
+
+    @pytest.mark.parametrize("answer, added", [("c", 0), ("a", 1), ("e", 0)])
+    def test_interactive_add_offers_existing(self, shelf, monkeypatch, answer, added):
+        first = shelf.add_document_with_metadata(self._file(shelf, "a.pdf", b"same"))
+        edited = []
+        monkeypatch.setattr("bookshelf.util.get_terminal_width", lambda: 80)
+        monkeypatch.setattr("bookshelf.util.closed_ended_question",
+                            lambda msg, options: answer)
+        monkeypatch.setattr(Bookshelf, "edit_record", lambda self, i: edited.append(i))
+        monkeypatch.setattr(Bookshelf, "get_metadata",
+                            lambda self, name, prefill=None: Metadata(name, "", "", "", "", ""))
+        before = self._count(shelf)
+        shelf.add_document(self._file(shelf, "b.pdf", b"same"))
+        assert self._count(shelf) == before + added
+        assert edited == ([first] if answer == "e" else [])
+
+    def test_duplicate_is_found_quietly(self, shelf, capsys):
+        first = shelf.add_document_with_metadata(self._file(shelf, "a.pdf", b"same"))
+        capsys.readouterr()
+        record, digest = shelf.find_duplicate(self._file(shelf, "b.pdf", b"same"))
+        assert record[0] == first and digest == hashlib.sha256(b"same").hexdigest()
+        assert capsys.readouterr().out == ""
+
+    def test_adding_anyway_reads_the_file_once(self, shelf, monkeypatch):
+        shelf.add_document_with_metadata(self._file(shelf, "a.pdf", b"same"))
+        path = self._file(shelf, "b.pdf", b"same")
+        reads = []
+        real = bookshelf.util.sha256_file
+        monkeypatch.setattr("bookshelf.util.sha256_file",
+                            lambda p: reads.append(p) or real(p))
+        # A copy that does not hash, like a reflink or an in-kernel copy
+        monkeypatch.setitem(bookshelf.transfer._METHODS, "reflink", shutil.copyfile)
+        shelf.transfer_strategy = "reflink"
+        monkeypatch.setattr("bookshelf.util.get_terminal_width", lambda: 80)
+        monkeypatch.setattr("bookshelf.util.closed_ended_question",
+                            lambda msg, options: "a")
+        monkeypatch.setattr(Bookshelf, "get_metadata",
+                            lambda self, name, prefill=None: Metadata(name, "", "", "", "", ""))
+        shelf.add_document(path)
+        assert reads == [path]
@@ -0,0 +1,85 @@
+"""
+tests/test_cache.py
+
+Test suite for bookshelf.cache.RecordCache.
+
+Run with:
+    pytest tests/test_cache.py -v
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+from bookshelf.cache import RecordCache
+
+
+def _row(i: int) -> tuple:
+    return (f"id{i}", f"id{i}.pdf", f"Title {i}", "A", "Paper", "", "")
+
+
+@pytest.fixture()
+def conns():
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, "_database.db")
+        own   = sqlite3.connect(path)
+        other = sqlite3.connect(path)
+        own.execute("CREATE TABLE docs (id TEXT PRIMARY KEY, title TEXT)")
+        own.commit()
+        yield own, other
+        own.close()
+        other.close()
+
+
+class TestRecordCache:
+
+    def test_hit_and_miss(self, conns):
+        cache = RecordCache(conns[0])
+        assert cache.get("id1") is None
+        cache.put(_row(1))
+        assert cache.get("id1") == _row(1)
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_lru_eviction(self, conns):
+        cache = RecordCache(conns[0], max_size=2)
+        cache.put_many([_row(1), _row(2)])
+        cache.get("id1")               # id1 becomes most recently used
+        cache.put(_row(3))
+        assert cache.get("id2") is None
+        assert cache.get("id1") is not None
+        assert cache.get("id3") is not None
+
+    def test_size_zero_disables(self, conns):
+        cache = RecordCache(conns[0], max_size=0)
+        cache.put(_row(1))
+        assert cache.get("id1") is None
+
+    def test_invalidate_bumps_generation(self, conns):
+        cache = RecordCache(conns[0])
+        cache.put(_row(1))
+        generation = cache.validate()
+        cache.invalidate("id1")
+        assert cache.get("id1") is None
+        assert cache.validate() != generation
+
+    def test_own_write_does_not_clear(self, conns):
+        own, _ = conns
+        cache = RecordCache(own)
+        cache.put(_row(1))
+        own.execute("INSERT INTO docs VALUES ('x', 't')")
+        own.commit()
+        assert cache.get("id1") == _row(1)
+
+    def test_write_by_other_connection_clears(self, conns):
+        own, other = conns
+        cache = RecordCache(own)
+        cache.put(_row(1))
+        generation = cache.validate()
+        other.execute("INSERT INTO docs VALUES ('x', 't')")
+        other.commit()
+        assert cache.get("id1") is None
+        assert cache.validate() != generation
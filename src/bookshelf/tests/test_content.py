@@ -0,0 +1,190 @@
+"""
+tests/test_content.py
+
+Test suite for the full-text index of document contents in bookshelf.content.
+
+Run with:
+    pytest tests/test_content.py -v
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+import bookshelf.content as content
+import bookshelf.db as db
+import bookshelf.textcache as textcache
+from bookshelf.extract import ERROR_TIMEOUT, ExtractResult
+import bookshelf.util
+from bookshelf.app import Bookshelf
+
+TEXTS = {
+    "bloom.txt": "A Bloom filter answers set membership queries with false positives.",
+    "cuckoo.txt": "Cuckoo hashing moves keys between two tables on collisions.",
+    "notes.md": "Reading list: the Bloom filter paper, then quotient filters.",
+}
+
+
+@pytest.fixture()
+def shelf(monkeypatch):
+    with tempfile.TemporaryDirectory() as home:
+        monkeypatch.setenv("HOME", home)
+        b = Bookshelf(show_banner=False)
+        for name, text in TEXTS.items():
+            path = os.path.join(home, name)
+            with open(path, "w") as f:
+                f.write(text)
+            b.add_document_with_metadata(path, title=name.split(".")[0].title())
+        yield b
+        db.close(b.db_path)
+
+
+def _update(shelf):
+    return content.update_content(
+        shelf.db_path, shelf.table_name,
+        os.path.join(shelf.root_dir, shelf.files_dir), jobs=1,
+    )
+
+
+def _titles(shelf, keyword):
+    return [row[2] for row in shelf.query_documents(keyword, "content")]
+
+
+class TestUpdate:
+
+    def test_indexes_new_files_once(self, shelf):
+        stats = _update(shelf)
+        assert (stats.indexed, stats.errors, stats.skipped) == (3, 0, 0)
+        assert content.status(shelf.db_path, shelf.table_name) == {"ok": 3, "pending": 0}
+        assert _update(shelf).indexed == 0
+
+    def test_identical_files_share_one_text(self, shelf):
+        path = os.path.join(os.path.dirname(shelf.root_dir), "bloom.txt")
+        shelf.add_document_with_metadata(path, title="Copy", allow_duplicate=True)
+        assert _update(shelf).indexed == 3
+        assert sorted(_titles(shelf, "membership")) == ["Bloom", "Copy"]
+
+    def test_replaced_file_is_indexed_again(self, shelf):
+        _update(shelf)
+        (identifier, filename), = shelf.conn.execute(
+            "SELECT id, filename FROM docs WHERE title = 'Cuckoo'")
+        path = os.path.join(shelf.root_dir, shelf.files_dir, filename[:2], filename)
+        os.unlink(path)
+        with open(path, "w") as f:
+            f.write("Linear probing scans the next slots.")
+        shelf.conn.execute("UPDATE docs SET sha256 = ? WHERE id = ?",
+                           (bookshelf.util.sha256_file(path), identifier))
+        shelf.conn.commit()
+
+        assert content.status(shelf.db_path, shelf.table_name)["pending"] == 1
+        stats = _update(shelf)
+        assert (stats.indexed, stats.removed) == (1, 1)
+        assert _titles(shelf, "collisions") == []
+        assert _titles(shelf, "probing") == ["Cuckoo"]
+
+    def test_unsupported_and_missing_files_are_skipped(self, shelf):
+        shelf.conn.execute("UPDATE docs SET filename = 'x.bin' WHERE title = 'Notes'")
+        shelf.conn.commit()
+        assert _update(shelf).skipped == 1
+
+    def test_extraction_errors_are_recorded(self, shelf):
+        entry = textcache.extract_here(shelf.root_dir)
+        assert content._status(entry) == content.STATUS_ERROR
+        assert "IsADirectoryError" in entry.error
+
+    def test_no_transaction_is_held_while_extracting(self, shelf, monkeypatch):
+        writes = []
+
+        class Pool:
+            # Between two results, another process writes to the shelf
+            def __init__(self, **kwargs):
+                pass
+
+            def imap(self, work):
+                for sha256, path in work:
+                    other = sqlite3.connect(shelf.db_path, timeout=0)
+                    with other:
+                        other.execute(f"CREATE TABLE probe_{len(writes)} (x)")
+                    other.close()
+                    writes.append(path)
+                    yield sha256, textcache.extract_here(path)
+
+            def close(self):
+                pass
+
+        monkeypatch.setattr(content, "ExtractionPool", Pool)
+        assert _update(shelf).indexed == 3
+        assert len(writes) == 3
+
+    def test_timed_out_files_stay_pending(self, shelf, monkeypatch):
+        class Pool:
+            def __init__(self, **kwargs):
+                pass
+
+            def imap(self, work):
+                for sha256, path in work:
+                    yield sha256, ExtractResult(error=ERROR_TIMEOUT)
+
+            def close(self):
+                pass
+
+        real = content.ExtractionPool
+        monkeypatch.setattr(content, "ExtractionPool", Pool)
+        assert (_update(shelf).errors, _update(shelf).errors) == (3, 3)
+        assert content.status(shelf.db_path, shelf.table_name)["pending"] == 3
+        monkeypatch.setattr(content, "ExtractionPool", real)
+        assert _update(shelf).indexed == 3
+
+    def test_rebuild_reads_the_text_cache(self, shelf, monkeypatch):
+        _update(shelf)
+        content.drop_content(shelf.conn)
+        monkeypatch.setattr(content, "ExtractionPool", None)   # must not be used
+        stats = _update(shelf)
+        assert (stats.indexed, stats.cached) == (3, 3)
+        assert _titles(shelf, "tables") == ["Cuckoo"]
+
+
+class TestSearch:
+
+    def test_ranked_word_prefix_search(self, shelf):
+        _update(shelf)
+        # 'filt' matches 'filter' and 'filters'
+        assert _titles(shelf, "bloom filt") == ["Notes", "Bloom"]
+        assert _titles(shelf, "tables") == ["Cuckoo"]
+        assert _titles(shelf, "nothing") == []
+
+    def test_no_index_no_results(self, shelf):
+        assert _titles(shelf, "bloom") == []
+        assert not shelf.has_content_index()
+
+    def test_keyset_paging(self, shelf):
+        _update(shelf)
+        first = list(shelf.query_documents("filter", "content", limit=1))
+        rest = list(shelf.query_documents(
+            "filter", "content", after=(first[0][-2], first[0][-1])))
+        assert [r[2] for r in first + rest] == _titles(shelf, "filter")
+
+    def test_snippets(self, shelf):
+        _update(shelf)
+        rows = list(shelf.query_documents("quotient", "content"))
+        found = content.snippets(shelf.db_path, shelf.table_name, "quotient",
+                                 [row[-1] for row in rows])
+        assert "[quotient]" in found[rows[0][-1]]
+
+    def test_interactive_search_falls_back_to_body(self, shelf, monkeypatch, capsys):
+        _update(shelf)
+        monkeypatch.setattr("bookshelf.util.get_terminal_width", lambda: 80)
+
+        def cancel(msg, options):
+            raise KeyboardInterrupt
+
+        monkeypatch.setattr("bookshelf.util.closed_ended_question", cancel)
+        shelf.search_documents("collisions")
+        out = capsys.readouterr().out
+        assert "Records found in document text with: collisions" in out
+        assert "[1] : Cuckoo" in out
+        assert "\033[1mcollisions\033[0m" in out
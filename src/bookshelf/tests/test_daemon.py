@@ -0,0 +1,173 @@
+"""
+tests/test_daemon.py
+
+Test suite for the Unix-socket query daemon in bookshelf.daemon.
+
+Run with:
+    pytest tests/test_daemon.py -v
+"""
+
+from __future__ import annotations
+
+import os
+import socket
+import tempfile
+import threading
+import time
+
+import pytest
+
+import bookshelf.content as content
+import bookshelf.daemon as daemon
+from bookshelf.app import Bookshelf, Metadata
+
+
+@pytest.fixture()
+def home(monkeypatch):
+    with tempfile.TemporaryDirectory() as home:
+        monkeypatch.setenv("HOME", home)
+        b = Bookshelf(show_banner=False)
+        for i in range(3):
+            b.register_document(Metadata(
+                f"id{i}.pdf", f"Bloom filters {i}", "Burton Bloom", "Paper",
+                "bloom_filter", "",
+            ))
+        yield home
+
+
+@pytest.fixture()
+def server(home):
+    path = os.path.join(home, "d.sock")
+    thread = threading.Thread(target=daemon.serve, args=(path,), daemon=True)
+    thread.start()
+    for _ in range(200):
+        client = daemon.connect(path)
+        if client is not None:
+            break
+        time.sleep(0.01)
+    yield path, client
+    client.call("shutdown")
+    client.close()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+
+
+class TestDaemon:
+
+    def test_no_daemon(self, home):
+        assert daemon.connect(os.path.join(home, "none.sock")) is None
+
+    def test_ping(self, server):
+        _, client = server
+        assert client.call("ping")["pid"] == os.getpid()
+
+    def test_search_streams_rows(self, server):
+        _, client = server
+        fields, rows = client.search("bloom", ["id", "title"])
+        assert fields == ["id", "title"]
+        assert [row[0] for row in rows] == ["id0", "id1", "id2"]
+
+    def test_search_limit_offset(self, server):
+        _, client = server
+        _, rows = client.search("bloom", ["id"], limit=1, offset=1)
+        assert list(rows) == [["id1"]]
+
+    def test_get(self, server):
+        _, client = server
+        assert client.call("get", id="id1")["record"]["title"] == "Bloom filters 1"
+        with pytest.raises(daemon.DaemonError):
+            client.call("get", id="nope")
+
+    def test_add(self, server, home):
+        _, client = server
+        path = os.path.join(home, "paper.pdf")
+        with open(path, "wb") as f:
+            f.write(b"%PDF")
+        identifier = client.call("add", path=path, title="Cuckoo hashing")["id"]
+        assert client.call("get", id=identifier)["record"]["title"] == "Cuckoo hashing"
+        _, rows = client.search("cuckoo", ["id"])
+        assert list(rows) == [[identifier]]
+
+    def test_add_duplicate_refused(self, server, home):
+        _, client = server
+        path = os.path.join(home, "paper.pdf")
+        with open(path, "wb") as f:
+            f.write(b"%PDF")
+        identifier = client.call("add", path=path)["id"]
+        with pytest.raises(daemon.DaemonError) as e:
+            client.call("add", path=path)
+        assert e.value.reply["duplicate_of"] == identifier
+        assert client.call("add", path=path, allow_duplicate=True)["id"] != identifier
+
+    def test_added_text_is_indexed_in_background(self, server, home):
+        _, client = server
+        path = os.path.join(home, "notes.txt")
+        with open(path, "w") as f:
+            f.write("Quotient filters store fingerprints in a compact table.")
+        identifier = client.call("add", path=path)["id"]
+        db_path = client.call("ping")["db"]
+        for _ in range(300):
+            rows = list(content.search_content(db_path, "docs", "fingerprints"))
+            if rows:
+                break
+            time.sleep(0.05)
+        assert [row[0] for row in rows] == [identifier]
+
+    def test_errors_keep_connection_usable(self, server):
+        _, client = server
+        with pytest.raises(daemon.DaemonError):
+            client.call("frobnicate")
+        with pytest.raises(daemon.DaemonError):
+            client.search("bloom", ["no_such_field"])
+        assert client.call("ping")["ok"] is True
+
+    def test_idle_connection_does_not_block_others(self, server):
+        path, client = server
+        idle = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        idle.connect(path)
+        try:
+            start = time.monotonic()
+            assert client.call("ping")["ok"] is True
+            assert time.monotonic() - start < daemon.CLIENT_TIMEOUT
+        finally:
+            idle.close()
+
+    def test_unresponsive_daemon_is_not_used(self, home):
+        path = os.path.join(home, "d.sock")
+        hung = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        hung.bind(path)
+        hung.listen(1)      # accepts connections, never answers
+        try:
+            assert daemon.connect(path, timeout=0.2) is None
+        finally:
+            hung.close()
+
+    def test_get_prints_nothing(self, server, capfd):
+        _, client = server
+        client.call("get", id="id1")
+        assert "ID:" not in capfd.readouterr().out
+
+    def test_second_daemon_refused(self, server):
+        path, _ = server
+        with pytest.raises(RuntimeError):
+            daemon.serve(path)
+
+    def test_stale_socket_replaced(self, home):
+        path = os.path.join(home, "d.sock")
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(path)
+        stale.close()
+        assert daemon.connect(path) is None
+
+        thread = threading.Thread(target=daemon.serve, args=(path,), daemon=True)
+        thread.start()
+        for _ in range(200):
+            client = daemon.connect(path)
+            if client is not None:
+                break
+            time.sleep(0.01)
+        with client:
+            assert client.call("ping")["ok"] is True
+            client.call("shutdown")
+        thread.join(timeout=5)
+        assert not os.path.exists(path)
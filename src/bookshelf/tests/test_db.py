@@ -0,0 +1,85 @@
+"""
+tests/test_db.py
+
+Test suite for the shared connection manager in bookshelf.db.
+
+Run with:
+    pytest tests/test_db.py -v
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import tempfile
+import threading
+
+import pytest
+
+import bookshelf.db as db
+from bookshelf.config import DEFAULT_SETTINGS
+
+
+@pytest.fixture()
+def db_path():
+    db.configure(DEFAULT_SETTINGS)
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, "_database.db")
+        sqlite3.connect(path).close()
+        yield path
+        db.close(path)
+
+
+class TestGetConnection:
+
+    def test_same_connection_is_reused(self, db_path):
+        assert db.get_connection(db_path) is db.get_connection(db_path)
+
+    def test_pragmas_applied(self, db_path):
+        conn = db.get_connection(db_path)
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1   # NORMAL
+        assert conn.execute("PRAGMA cache_size").fetchone()[0] == -65536
+        assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 5000
+
+    def test_settings_override(self, db_path):
+        db.configure({**DEFAULT_SETTINGS,
+                      "journal_mode": "delete", "synchronous": "full",
+                      "busy_timeout_ms": "250"})
+        conn = db.get_connection(db_path)
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 2   # FULL
+        assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 250
+
+    def test_readonly_leaves_journal_mode(self, db_path):
+        conn = db.get_connection(db_path, readonly=True)
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("CREATE TABLE t (x)")
+
+    def test_readonly_path_with_uri_characters(self):
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "shelf #1?v=2 100%.db")
+            conn = sqlite3.connect(path)
+            conn.execute("CREATE TABLE t (x)")
+            conn.close()
+            try:
+                ro = db.get_connection(path, readonly=True)
+                assert ro.execute("SELECT name FROM sqlite_master").fetchall() == [("t",)]
+            finally:
+                db.close(path)
+
+    def test_threads_get_their_own_connection(self, db_path):
+        main_conn = db.get_connection(db_path)
+        seen = []
+        thread = threading.Thread(
+            target=lambda: seen.append(db.get_connection(db_path))
+        )
+        thread.start()
+        thread.join()
+        assert seen[0] is not main_conn
+
+    def test_close_reopens(self, db_path):
+        first = db.get_connection(db_path)
+        db.close(db_path)
+        assert db.get_connection(db_path) is not first
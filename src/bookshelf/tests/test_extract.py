@@ -0,0 +1,100 @@
+"""
+tests/test_extract.py
+
+Test suite for the sandboxed extraction workers in bookshelf.extract.
+
+Run with:
+    pytest tests/test_extract.py -v
+"""
+
+from __future__ import annotations
+
+import os
+import tempfile
+
+import pytest
+
+import bookshelf.extract as extract
+
+
+@pytest.fixture()
+def files():
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i in range(3):
+            path = os.path.join(tmp, f"{i}.txt")
+            with open(path, "w") as f:
+                f.write(f"file  number\n{i}")
+            paths.append(path)
+        yield tmp, paths
+
+
+class TestExtractionPool:
+
+    def test_results_by_key(self, files):
+        _, paths = files
+        with extract.ExtractionPool(jobs=2) as pool:
+            results = dict(pool.imap(enumerate(paths)))
+        assert {k: r.text for k, r in results.items()} == {
+            0: "file number 0", 1: "file number 1", 2: "file number 2"}
+        assert all(r.ok and r.pages == 1 and r.seconds >= 0 for r in results.values())
+        assert pool.replaced == 0
+
+    def test_errors_are_values(self, files):
+        tmp, paths = files
+        with extract.ExtractionPool(jobs=1) as pool:
+            gone = pool.extract(os.path.join(tmp, "gone.txt"))
+            assert pool.extract(paths[0]).ok
+        assert gone.error == extract.ERROR_MISSING
+        assert extract.run_task(extract.KIND_TEXT, tmp).error == "IsADirectoryError"
+
+    def test_timeout_kills_the_worker(self, files):
+        _, paths = files
+        # Less than a worker needs to start
+        with extract.ExtractionPool(jobs=1, timeout=0.001) as pool:
+            result = pool.extract(paths[0])
+            assert result.error == extract.ERROR_TIMEOUT
+            assert pool.replaced == 1
+            pool.timeout = 30
+            assert pool.extract(paths[1]).text == "file number 1"
+
+    @pytest.mark.skipif(extract.resource is None, reason="no RLIMIT_AS")
+    def test_memory_limit(self, files):
+        tmp, paths = files
+        huge = os.path.join(tmp, "huge.txt")
+        with open(huge, "wb") as f:
+            f.truncate(4 << 30)     # sparse: nothing is written
+        with extract.ExtractionPool(jobs=1, memory_limit=512) as pool:
+            assert pool.extract(huge).error == "MemoryError"
+            assert pool.replaced == 1
+            assert pool.extract(paths[0]).ok
+
+    def test_crash_only_fails_its_file(self, files, monkeypatch):
+        _, paths = files
+        submit = extract._Worker.submit
+
+        def submit_and_die(self, kind, key, path):
+            submit(self, kind, key, path)
+            if key == 1:
+                self.process.kill()
+
+        monkeypatch.setattr(extract._Worker, "submit", submit_and_die)
+        with extract.ExtractionPool(jobs=2) as pool:
+            results = dict(pool.imap(enumerate(paths)))
+        assert results[1].error == extract.ERROR_CRASHED
+        assert results[0].ok and results[2].ok
+
+    def test_abandoned_iterator_kills_busy_workers(self, files):
+        _, paths = files
+        pool = extract.ExtractionPool(jobs=3)
+        results = pool.imap(enumerate(paths))
+        next(results)
+        results.close()
+        pool.close()
+        assert pool.replaced == 2
+
+
+def test_run_task_in_process(files):
+    _, paths = files
+    assert extract.run_task(extract.KIND_TEXT, paths[2]).text == "file number 2"
+    assert extract.run_task(extract.KIND_TEXT, "/nonexistent.txt").error == "FileNotFoundError"
@@ -0,0 +1,289 @@
+"""
+tests/test_fuzzy.py
+
+Test suite for the FTS bootstrap in bookshelf.fuzzy.
+
+Run with:
+    pytest tests/test_fuzzy.py -v
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+from bookshelf.fuzzy import (
+    FTS_SCHEMA_VERSION,
+    check_fts,
+    make_fts_query,
+    make_substring_query,
+    rebuild_fts,
+    row_key,
+    search_fts,
+    search_substring,
+    setup_fts,
+)
+
+TABLE = "docs"
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Shared helpers
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _make_db(path: str, records: list[tuple]) -> None:
+    conn = sqlite3.connect(path)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {TABLE} (
+            id TEXT PRIMARY KEY, filename TEXT,
+            title TEXT, authors TEXT, category TEXT,
+            keywords TEXT, description TEXT
+        )
+    """)
+    for row in records:
+        conn.execute(f"INSERT INTO {TABLE} VALUES (?,?,?,?,?,?,?)", row)
+    conn.commit()
+    conn.close()
+
+
+def _matches(db_path: str, term: str) -> int:
+    conn = sqlite3.connect(db_path)
+    n = conn.execute(
+        "SELECT COUNT(*) FROM bookshelf_fts WHERE bookshelf_fts MATCH ?", (term,)
+    ).fetchone()[0]
+    conn.close()
+    return n
+
+
+def _index_blocks(db_path: str) -> int:
+    """Number of b-tree blocks in the FTS shadow table – grows on re-indexing."""
+    conn = sqlite3.connect(db_path)
+    n = conn.execute("SELECT COUNT(*) FROM bookshelf_fts_data").fetchone()[0]
+    conn.close()
+    return n
+
+
+def _user_version(db_path: str) -> int:
+    conn = sqlite3.connect(db_path)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    conn.close()
+    return version
+
+
+ROWS = [
+    ("a1", "a1.pdf", "Space/time trade-offs in hash coding", "Burton H. Bloom",
+     "Paper", "bloom_filter", "Hash coding with allowable errors."),
+    ("b2", "b2.pdf", "Development of a spelling list", "M. Douglas McIlroy",
+     "Paper", "spell_checker, bloom_filter", "Compact word list."),
+]
+
+
+@pytest.fixture()
+def db_path():
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, "_database.db")
+        _make_db(path, ROWS)
+        yield path
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# setup_fts
+# ─────────────────────────────────────────────────────────────────────────────
+
+class TestSetupFts:
+
+    def test_first_run_builds_index(self, db_path):
+        assert setup_fts(db_path, TABLE) is True
+        assert _user_version(db_path) == FTS_SCHEMA_VERSION
+        assert _matches(db_path, "bloom") == 2
+
+    def test_second_run_is_noop(self, db_path):
+        setup_fts(db_path, TABLE)
+        blocks = _index_blocks(db_path)
+        assert setup_fts(db_path, TABLE) is False
+        # The index must not grow with repeated launches
+        assert _index_blocks(db_path) == blocks
+
+    def test_triggers_keep_index_in_sync(self, db_path):
+        setup_fts(db_path, TABLE)
+        _make_db(db_path, [("c3", "c3.pdf", "Bloom revisited", "X", "Paper", "", "")])
+        assert _matches(db_path, "bloom") == 3
+        assert setup_fts(db_path, TABLE) is False
+
+    def test_drift_triggers_rebuild(self, db_path):
+        setup_fts(db_path, TABLE)
+        conn = sqlite3.connect(db_path)
+        conn.execute("DROP TRIGGER bookshelf_ai")
+        conn.execute(f"INSERT INTO {TABLE} VALUES ('c3','c3.pdf','Bloom','X','P','','')")
+        conn.commit()
+        conn.close()
+        assert setup_fts(db_path, TABLE) is True
+        assert _matches(db_path, "bloom") == 3
+
+    def test_legacy_duplicates_removed_on_upgrade(self, db_path):
+        # Simulate a shelf indexed by an old version: populated twice, version 0
+        setup_fts(db_path, TABLE)
+        blocks = _index_blocks(db_path)
+        conn = sqlite3.connect(db_path)
+        conn.execute(f"""
+            INSERT INTO bookshelf_fts(rowid, id, title, authors, keywords, description)
+            SELECT rowid, id, title, authors, keywords, description FROM {TABLE}
+        """)
+        conn.execute("PRAGMA user_version = 0")
+        conn.commit()
+        conn.close()
+        assert _index_blocks(db_path) > blocks
+
+        assert setup_fts(db_path, TABLE) is True
+        assert _index_blocks(db_path) == blocks
+        assert _matches(db_path, "bloom") == 2
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# rebuild_fts / check_fts
+# ─────────────────────────────────────────────────────────────────────────────
+
+class TestRebuildAndCheck:
+
+    def test_check_clean_index(self, db_path):
+        setup_fts(db_path, TABLE)
+        assert check_fts(db_path, TABLE) == []
+
+    def test_check_reports_old_version(self, db_path):
+        assert check_fts(db_path, TABLE) != []
+
+    def test_rebuild_restores_consistency(self, db_path):
+        setup_fts(db_path, TABLE)
+        conn = sqlite3.connect(db_path)
+        conn.execute("DROP TRIGGER bookshelf_ad")
+        conn.execute(f"DELETE FROM {TABLE} WHERE id = 'a1'")
+        conn.commit()
+        conn.close()
+        assert check_fts(db_path, TABLE) != []
+
+        rebuild_fts(db_path, TABLE)
+        assert check_fts(db_path, TABLE) == []
+        assert _matches(db_path, "bloom") == 1
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# search_fts
+# ─────────────────────────────────────────────────────────────────────────────
+
+class TestSearchFts:
+
+    def test_returns_full_rows(self, db_path):
+        setup_fts(db_path, TABLE)
+        rows = [row[:7] for row in search_fts(db_path, TABLE, "spelling")]
+        assert rows == [ROWS[1]]
+
+    def test_title_ranks_above_description(self, db_path):
+        _make_db(db_path, [
+            ("c3", "c3.pdf", "Other", "X", "Paper", "", "All about hashing."),
+            ("d4", "d4.pdf", "Hashing", "Y", "Paper", "", "Other."),
+        ])
+        setup_fts(db_path, TABLE)
+        ids = [row[0] for row in search_fts(db_path, TABLE, "hashing")]
+        assert ids == ["d4", "c3"]
+
+    def test_underscore_keyword(self, db_path):
+        setup_fts(db_path, TABLE)
+        ids = {row[0] for row in search_fts(db_path, TABLE, "bloom_filter")}
+        assert ids == {"a1", "b2"}
+
+    def test_prefix_and_all_terms(self, db_path):
+        setup_fts(db_path, TABLE)
+        assert [r[0] for r in search_fts(db_path, TABLE, "spell list")] == ["b2"]
+        assert list(search_fts(db_path, TABLE, "spell bloom_filter hash")) == []
+
+    def test_id_column_not_searched(self, db_path):
+        setup_fts(db_path, TABLE)
+        assert list(search_fts(db_path, TABLE, "a1")) == []
+
+    def test_punctuation_is_safe(self, db_path):
+        setup_fts(db_path, TABLE)
+        assert list(search_fts(db_path, TABLE, 'AND "OR ( -')) == []
+
+    def test_empty_keyword(self):
+        assert make_fts_query("   ") == ""
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# search_substring  (trigram index)
+# ─────────────────────────────────────────────────────────────────────────────
+
+class TestSearchSubstring:
+
+    def test_infix_match(self, db_path):
+        setup_fts(db_path, TABLE)
+        ids = {row[0] for row in search_substring(db_path, TABLE, "loom_fil")}
+        assert ids == {"a1", "b2"}
+
+    def test_same_matches_as_like(self, db_path):
+        setup_fts(db_path, TABLE)
+        conn = sqlite3.connect(db_path)
+        for keyword in ("ell", "hash cod", "Bloom", "ICR", "ords"):
+            like = {
+                row[0] for row in conn.execute(
+                    f"SELECT id FROM {TABLE} WHERE title LIKE ? OR authors LIKE ?"
+                    f" OR keywords LIKE ? OR description LIKE ?",
+                    (f"%{keyword}%",) * 4,
+                )
+            }
+            trigram = {row[0] for row in search_substring(db_path, TABLE, keyword)}
+            assert trigram == like, keyword
+        conn.close()
+
+    def test_triggers_maintain_trigram_index(self, db_path):
+        setup_fts(db_path, TABLE)
+        conn = sqlite3.connect(db_path)
+        conn.execute(f"UPDATE {TABLE} SET keywords = 'cuckoo' WHERE id = 'b2'")
+        conn.commit()
+        conn.close()
+        ids = {row[0] for row in search_substring(db_path, TABLE, "bloom_")}
+        assert ids == {"a1"}
+        assert [r[0] for r in search_substring(db_path, TABLE, "ucko")] == ["b2"]
+
+    def test_short_keyword_not_indexed(self):
+        assert make_substring_query("ab") == ""
+        assert make_substring_query(' a"b ') == '"a""b"'
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Keyset pagination
+# ─────────────────────────────────────────────────────────────────────────────
+
+class TestKeysetPagination:
+
+    def _fill(self, db_path, n):
+        _make_db(db_path, [
+            (f"r{i:03}", f"r{i:03}.pdf", f"Graph paper {i}", "X", "Paper",
+             "graph" if i % 3 == 0 else "", "")
+            for i in range(n)
+        ])
+        setup_fts(db_path, TABLE)
+
+    def _pages(self, search, db_path, keyword, size):
+        pages, after = [], None
+        while True:
+            rows = list(search(db_path, TABLE, keyword, after, size))
+            if not rows:
+                return pages
+            pages.append([row[0] for row in rows])
+            after = row_key(rows[-1])
+
+    @pytest.mark.parametrize("search", [search_fts, search_substring])
+    def test_pages_cover_all_rows_in_rank_order(self, db_path, search):
+        self._fill(db_path, 25)
+        everything = [row[0] for row in search(db_path, TABLE, "graph")]
+        pages = self._pages(search, db_path, "graph", 4)
+        assert all(len(page) <= 4 for page in pages)
+        assert [rid for page in pages for rid in page] == everything
+        assert len(everything) == 25
+
+    def test_limit_bounds_rows_fetched(self, db_path):
+        self._fill(db_path, 25)
+        assert len(list(search_fts(db_path, TABLE, "graph", limit=5))) == 5
@@ -0,0 +1,134 @@
+"""
+tests/test_hashcache.py
+
+Test suite for the cache of file hashes in bookshelf.hashcache.
+
+Run with:
+    pytest tests/test_hashcache.py -v
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+import bookshelf.db as db
+import bookshelf.hashcache as hashcache
+import bookshelf.util as util
+from bookshelf.app import Bookshelf
+
+
+@pytest.fixture()
+def tmp():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "shelf.db")
+        yield tmp, db_path
+        db.close(db_path)
+
+
+def _write(path: str, data: bytes) -> str:
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def _count_reads(monkeypatch):
+    calls = []
+    real = util.sha256_file
+
+    def sha256_file(path):
+        calls.append(path)
+        return real(path)
+
+    monkeypatch.setattr(util, "sha256_file", sha256_file)
+    return calls
+
+
+class TestHashFile:
+
+    def test_matches_hashlib_across_buffers(self, tmp):
+        data = os.urandom(int(2.5 * util.COPY_CHUNK))
+        path = _write(os.path.join(tmp[0], "big.bin"), data)
+        assert util.sha256_file(path) == hashlib.sha256(data).hexdigest()
+        empty = _write(os.path.join(tmp[0], "empty.bin"), b"")
+        assert util.sha256_file(empty) == hashlib.sha256(b"").hexdigest()
+
+
+class TestHashCache:
+
+    def test_unchanged_files_are_read_once(self, tmp, monkeypatch):
+        root, db_path = tmp
+        calls = _count_reads(monkeypatch)
+        paths = [_write(os.path.join(root, f"{i}.pdf"), b"%d" % i) for i in range(5)]
+        cache = hashcache.HashCache(db.get_connection(db_path))
+        first = cache.hash_many(paths, jobs=3)
+        assert first == {p: hashlib.sha256(b"%d" % i).hexdigest()
+                         for i, p in enumerate(paths)}
+        assert len(calls) == 5
+
+        # Persistent: a new cache (another run) reads the hashes back
+        db.close(db_path)
+        cache = hashcache.HashCache(db.get_connection(db_path))
+        assert cache.hash_many(paths) == first
+        assert (cache.hits, cache.misses, len(calls)) == (5, 0, 5)
+
+    def test_changed_file_is_hashed_again(self, tmp):
+        root, db_path = tmp
+        path = _write(os.path.join(root, "a.pdf"), b"old")
+        cache = hashcache.HashCache(db.get_connection(db_path))
+        cache.hash(path)
+        st = os.stat(path)
+        _write(path, b"new")
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+        assert cache.hash(path) == hashlib.sha256(b"new").hexdigest()
+        assert (cache.hits, cache.misses) == (0, 2)
+
+    def test_missing_files_and_directories(self, tmp):
+        root, db_path = tmp
+        cache = hashcache.HashCache(db.get_connection(db_path))
+        assert cache.hash_many([os.path.join(root, "none.pdf"), root]) == {
+            os.path.join(root, "none.pdf"): None, root: None}
+        assert cache.misses == 0
+
+    def test_prune_drops_gone_and_changed_files(self, tmp):
+        root, db_path = tmp
+        paths = [_write(os.path.join(root, f"{i}.pdf"), b"%d" % i) for i in range(3)]
+        cache = hashcache.HashCache(db.get_connection(db_path))
+        cache.hash_many(paths)
+        os.unlink(paths[0])
+        _write(paths[1], b"longer")
+        assert cache.prune() == 2
+        assert cache.prune() == 0
+        rows = db.get_connection(db_path).execute(
+            "SELECT path FROM bookshelf_hash_cache").fetchall()
+        assert rows == [(os.path.abspath(paths[2]),)]
+
+    def test_readonly_stores_nothing(self, tmp):
+        root, db_path = tmp
+        sqlite3.connect(db_path).close()
+        path = _write(os.path.join(root, "a.pdf"), b"data")
+        cache = hashcache.HashCache(
+            db.get_connection(db_path, readonly=True), readonly=True)
+        assert cache.hash(path) == hashlib.sha256(b"data").hexdigest()
+        assert cache.hash(path) and cache.misses == 2
+        conn = sqlite3.connect(db_path)
+        assert conn.execute("SELECT name FROM sqlite_master").fetchall() == []
+        conn.close()
+
+
+class TestAddDocument:
+
+    def test_duplicate_check_reuses_the_hash_of_the_added_file(self, monkeypatch):
+        with tempfile.TemporaryDirectory() as home:
+            monkeypatch.setenv("HOME", home)
+            shelf = Bookshelf(show_banner=False)
+            path = _write(os.path.join(home, "paper.pdf"), b"%PDF-1.4 paper")
+            shelf.add_document_with_metadata(path, title="Paper")
+            calls = _count_reads(monkeypatch)
+            assert shelf.find_duplicate(path)[0][2] == "Paper"
+            assert calls == [] and shelf.hash_cache.hits == 1
+            db.close(shelf.db_path)
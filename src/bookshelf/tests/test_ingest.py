@@ -0,0 +1,129 @@
+"""
+tests/test_ingest.py
+
+Test suite for the bulk directory import in bookshelf.ingest.
+
+Run with:
+    pytest tests/test_ingest.py -v
+"""
+
+from __future__ import annotations
+
+import io
+import json
+import os
+import tempfile
+
+import pytest
+
+import bookshelf.db as db
+from bookshelf.app import Bookshelf
+from bookshelf.fuzzy import check_fts, search_fts, search_substring
+from bookshelf.ingest import import_directory, load_sidecar
+
+
+@pytest.fixture()
+def shelf(monkeypatch):
+    with tempfile.TemporaryDirectory() as home:
+        monkeypatch.setenv("HOME", home)
+        b = Bookshelf(show_banner=False)
+        yield b
+        db.close(b.db_path)
+
+
+@pytest.fixture()
+def archive(shelf):
+    root = os.path.join(os.path.dirname(shelf.root_dir), "archive")
+    for rel, content in [
+        ("bloom.pdf", b"bloom"),
+        ("papers/spell.pdf", b"spell"),
+        ("papers/deep/knuth.djvu", b"knuth"),
+        ("papers/copy-of-bloom.pdf", b"bloom"),
+        (".hidden", b"x"),
+    ]:
+        path = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(content)
+    return root
+
+
+def _import(shelf, archive, **kwargs):
+    return import_directory(
+        archive, shelf.db_path, shelf.table_name,
+        os.path.join(shelf.root_dir, shelf.files_dir), out=io.StringIO(), **kwargs
+    )
+
+
+def _rows(shelf):
+    return shelf.conn.execute(
+        f"SELECT id, filename, title, authors FROM {shelf.table_name} ORDER BY rowid"
+    ).fetchall()
+
+
+class TestImportDirectory:
+
+    def test_files_copied_into_store(self, shelf, archive):
+        stats = _import(shelf, archive)
+        assert stats.imported == 3
+        rows = _rows(shelf)
+        assert len(rows) == 3
+        contents = set()
+        for identifier, filename, _, _ in rows:
+            assert filename.startswith(identifier)
+            path = os.path.join(shelf.root_dir, shelf.files_dir, filename[0:2], filename)
+            with open(path, "rb") as f:
+                contents.add(f.read())
+        assert contents == {b"bloom", b"spell", b"knuth"}
+        assert {os.path.splitext(r[1])[1] for r in rows} == {".pdf", ".djvu"}
+
+    def test_identical_files_imported_once(self, shelf, archive):
+        stats = _import(shelf, archive)
+        assert len(stats.duplicates) == 1
+        n_files = sum(len(f) for _, _, f in os.walk(
+            os.path.join(shelf.root_dir, shelf.files_dir)))
+        assert n_files == 3
+
+    def test_files_already_in_shelf_skipped(self, shelf, archive):
+        _import(shelf, archive)
+        stats = _import(shelf, archive)
+        assert stats.imported == 0
+        assert len(stats.duplicates) == 4
+        assert len(_rows(shelf)) == 3
+
+    def test_csv_sidecar(self, shelf, archive):
+        with open(os.path.join(archive, "metadata.csv"), "w") as f:
+            f.write("path,title,authors\n")
+            f.write("papers/spell.pdf,Development of a spelling list,McIlroy\n")
+            f.write("knuth.djvu,Literate programming,Knuth\n")
+        _import(shelf, archive)
+        titles = {r[2]: r[3] for r in _rows(shelf)}
+        assert titles["Development of a spelling list"] == "McIlroy"
+        assert titles["Literate programming"] == "Knuth"   # matched by file name
+        assert "" in titles                                 # no entry: left blank
+        assert len(titles) == 3                             # sidecar not imported
+
+    def test_json_sidecar(self, shelf, archive):
+        path = os.path.join(archive, "list.json")
+        with open(path, "w") as f:
+            json.dump({"bloom.pdf": {"title": "Space/time trade-offs"}}, f)
+        assert load_sidecar(path)["bloom.pdf"]["title"] == "Space/time trade-offs"
+        _import(shelf, archive, metadata_path=path)
+        assert "Space/time trade-offs" in {r[2] for r in _rows(shelf)}
+
+    def test_fts_indexed_and_triggers_restored(self, shelf, archive):
+        with open(os.path.join(archive, "metadata.csv"), "w") as f:
+            f.write("path,title\nbloom.pdf,Bloom filters\n")
+        _import(shelf, archive, batch_size=1, jobs=2)
+        assert check_fts(shelf.db_path, shelf.table_name) == []
+        assert len(list(search_fts(shelf.db_path, shelf.table_name, "bloom"))) == 1
+        assert len(list(search_substring(shelf.db_path, shelf.table_name, "filt"))) == 1
+
+        # Later single adds are indexed by the triggers again
+        shelf.conn.execute(
+            f"INSERT INTO {shelf.table_name} (id, filename, title) "
+            f"VALUES ('x', 'x.pdf', 'Cuckoo filters')"
+        )
+        shelf.conn.commit()
+        assert len(list(search_fts(shelf.db_path, shelf.table_name, "filters"))) == 2
+        assert check_fts(shelf.db_path, shelf.table_name) == []
@@ -29,6 +29,7 @@ Fixes applied vs previous version
 
 from __future__ import annotations
 
+import hashlib
 import os
 import sqlite3
 import tempfile
@@ -37,12 +38,19 @@ from unittest.mock import patch
 import pytest
 
 from bookshelf.merge import (
+    W_AUTHORS,
+    W_DESCRIPTION,
+    W_TITLE,
+    CandidateIndex,
     MergeAction,
     Record,
+    RecordFeatures,
+    ScoreStats,
     _ParsedName,
     _author_similarity,
     _csv_merge,
     _ensure_subdir,
+    _fuzzy,
     _file_path,
     _merge_fields,
     _metadata_identical,
@@ -50,7 +58,9 @@ from bookshelf.merge import (
     _parse_name,
     _pick,
     _same_pdf_content,
+    feature_similarity,
     merge,
+    score_records,
     weighted_similarity,
 )
 
@@ -805,3 +815,315 @@ class TestCase7DifferentDescriptions:
             report = _run_merge(shelves)
         assert report.entries[0].action == MergeAction.REPLACED
         assert _get_record(shelves["pri_db"], pri_id)[6] == new_desc
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Stored file hashes (sha256 / size / mtime_ns columns)
+# ─────────────────────────────────────────────────────────────────────────────
+
+class TestStoredHashes:
+    PRI_ID, SEC_ID   = "ab000007-0000-0000-0000-000000000007", "cd000008-0000-0000-0000-000000000008"
+    PRI_FILE, SEC_FILE = PRI_ID + ".pdf", SEC_ID + ".pdf"
+    PRI_ROW = (PRI_ID, PRI_FILE, "Deep Learning", "LeCun", "book", "neural", "A.")
+    SEC_ROW = (SEC_ID, SEC_FILE, "Compilers", "Aho", "article", "parsing", "Dragon book.")
+
+    def _hash_of(self, db_path, rec_id):
+        conn = sqlite3.connect(db_path)
+        row = conn.execute(
+            f"SELECT sha256, size, mtime_ns FROM {TABLE} WHERE id=?", (rec_id,)
+        ).fetchone()
+        conn.close()
+        return row
+
+    def test_primary_hashes_saved(self, shelves):
+        _make_db(shelves["pri_db"], [self.PRI_ROW])
+        _make_db(shelves["sec_db"], [self.SEC_ROW])
+        _make_file(shelves["pri_files"], self.PRI_FILE, b"primary")
+        _make_file(shelves["sec_files"], self.SEC_FILE, b"secondary")
+        _run_merge(shelves)
+        assert self._hash_of(shelves["pri_db"], self.PRI_ID)[:2] == (
+            hashlib.sha256(b"primary").hexdigest(), 7)
+
+    def test_migrated_record_has_hash_of_copy(self, shelves):
+        _make_db(shelves["pri_db"], [self.PRI_ROW])
+        _make_db(shelves["sec_db"], [self.SEC_ROW])
+        _make_file(shelves["pri_files"], self.PRI_FILE, b"primary")
+        _make_file(shelves["sec_files"], self.SEC_FILE, b"secondary")
+        _run_merge(shelves)
+        digest, size, mtime_ns = self._hash_of(shelves["pri_db"], self.SEC_ID)
+        assert (digest, size) == (hashlib.sha256(b"secondary").hexdigest(), 9)
+        copied = _file_path(shelves["pri_files"], self.SEC_FILE)
+        assert mtime_ns == os.stat(copied).st_mtime_ns
+
+    def test_dry_run_leaves_schema_alone(self, shelves):
+        _make_db(shelves["pri_db"], [self.PRI_ROW])
+        _make_db(shelves["sec_db"], [self.SEC_ROW])
+        _make_file(shelves["pri_files"], self.PRI_FILE, b"primary")
+        _run_merge(shelves, dry_run=True)
+        conn = sqlite3.connect(shelves["pri_db"])
+        columns = [r[1] for r in conn.execute(f"PRAGMA table_info({TABLE})")]
+        conn.close()
+        assert "sha256" not in columns
+
+    def test_stored_hash_used_without_reading_file(self, shelves):
+        """A stored hash identifies the duplicate even if the file is gone."""
+        _make_db(shelves["pri_db"], [self.PRI_ROW])
+        _make_db(shelves["sec_db"], [(self.SEC_ID, self.SEC_FILE) + self.PRI_ROW[2:]])
+        _make_file(shelves["sec_files"], self.SEC_FILE, b"same bytes")
+        conn = sqlite3.connect(shelves["pri_db"])
+        for name, kind in (("sha256", "TEXT"), ("size", "INTEGER"), ("mtime_ns", "INTEGER")):
+            conn.execute(f"ALTER TABLE {TABLE} ADD COLUMN {name} {kind}")
+        conn.execute(f"UPDATE {TABLE} SET sha256=?",
+                     (hashlib.sha256(b"same bytes").hexdigest(),))
+        conn.commit()
+        conn.close()
+
+        report = _run_merge(shelves)
+        assert report.entries[0].action == MergeAction.SKIPPED
+        assert _count_records(shelves["pri_db"]) == 1
+
+    def test_file_changed_since_its_hash_was_stored(self, shelves):
+        """A secondary PDF annotated in place is not taken for its old content."""
+        _make_db(shelves["pri_db"], [self.PRI_ROW])
+        _make_db(shelves["sec_db"], [(self.SEC_ID, self.SEC_FILE) + self.PRI_ROW[2:]])
+        _make_file(shelves["pri_files"], self.PRI_FILE, b"original")
+        path = _make_file(shelves["sec_files"], self.SEC_FILE, b"original")
+        st = os.stat(path)
+        conn = sqlite3.connect(shelves["sec_db"])
+        for name, kind in (("sha256", "TEXT"), ("size", "INTEGER"), ("mtime_ns", "INTEGER")):
+            conn.execute(f"ALTER TABLE {TABLE} ADD COLUMN {name} {kind}")
+        conn.execute(f"UPDATE {TABLE} SET sha256=?, size=?, mtime_ns=?",
+                     (hashlib.sha256(b"original").hexdigest(), st.st_size,
+                      st.st_mtime_ns))
+        conn.commit()
+        conn.close()
+        with open(path, "ab") as f:
+            f.write(b" + annotations")
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+
+        report = _run_merge(shelves)
+        assert report.entries[0].action != MergeAction.SKIPPED
+        assert "SHA-256" not in report.entries[0].reason
+
+    def test_file_hashes_cached_across_merges(self, shelves, monkeypatch):
+        """Files without a stored hash are read once, not on every merge."""
+        _make_db(shelves["pri_db"], [self.PRI_ROW])
+        _make_db(shelves["sec_db"], [(self.SEC_ID, self.SEC_FILE) + self.PRI_ROW[2:]])
+        _make_file(shelves["pri_files"], self.PRI_FILE, b"same bytes")
+        _make_file(shelves["sec_files"], self.SEC_FILE, b"same bytes")
+        assert _run_merge(shelves).entries[0].action == MergeAction.SKIPPED
+
+        def no_reads(path):
+            raise AssertionError(f"read {path}")
+
+        monkeypatch.setattr("bookshelf.util.sha256_file", no_reads)
+        assert _run_merge(shelves).entries[0].action == MergeAction.SKIPPED
+
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Worker processes
+# ─────────────────────────────────────────────────────────────────────────────
+
+class TestWorkers:
+
+    def _shelves(self, shelves):
+        _make_db(shelves["pri_db"], [("p1", "p1.pdf", "Compilers", "Aho", "", "", "")])
+        _make_db(shelves["sec_db"], [("s1", "s1.pdf", "Compilers", "Aho", "", "", "")])
+
+    def test_no_extraction_pool_without_pypdf(self, shelves):
+        self._shelves(shelves)
+        with patch("bookshelf.merge._PYPDF_AVAILABLE", False), \
+             patch("bookshelf.extract.ExtractionPool", None):
+            assert len(_run_merge(shelves, dry_run=True).entries) == 1
+
+    def test_workers_stopped_on_interrupt(self, shelves):
+        self._shelves(shelves)
+        closed = []
+
+        class Pool:
+            def __init__(self, **kwargs):
+                pass
+
+            def extract(self, path):
+                raise AssertionError("not reached")
+
+            def close(self):
+                closed.append(True)
+
+        def interrupt(*args, **kwargs):
+            raise KeyboardInterrupt
+
+        with patch("bookshelf.merge._PYPDF_AVAILABLE", True), \
+             patch("bookshelf.extract.ExtractionPool", Pool), \
+             patch("bookshelf.merge.score_records", interrupt), \
+             pytest.raises(KeyboardInterrupt):
+            _run_merge(shelves, dry_run=True)
+        assert closed == [True]
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Candidate blocking
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _rec(rid: str, title: str = "", authors: str = "") -> Record:
+    return Record(rid, f"{rid}.pdf", title, authors, "", "", "")
+
+
+class TestCandidateIndex:
+
+    def _records(self):
+        titles = [
+            ("Space/time trade-offs in hash coding", "Burton H. Bloom"),
+            ("Cuckoo hashing", "Rasmus Pagh, Flemming Rodler"),
+            ("The Art of Computer Programming", "Donald E. Knuth"),
+            ("Quotient filters", "Michael A. Bender"),
+            ("", ""),
+        ]
+        return [_rec(str(i), t, a) for i, (t, a) in enumerate(titles)]
+
+    def test_typos_and_authors_find_candidates(self):
+        index = CandidateIndex(self._records(), top_k=1)
+        assert index.candidates(_rec("x", "Cukoo hashing")) == ([1], True)
+        assert index.candidates(_rec("x", "Sorting", "Knuth, D."))[0] == [2]
+        assert index.candidates(_rec("x", "", ""))[0] == [4]
+
+    def test_limit_is_reported(self):
+        records = [_rec(str(i), f"Bloom filter {i}") for i in range(5)]
+        ids, limited = CandidateIndex(records, top_k=3).candidates(
+            _rec("x", "Bloom filter 4"))
+        assert limited and len(ids) == 3 and 4 in ids
+
+    def test_small_shelves_are_scored_exhaustively(self):
+        index = CandidateIndex(self._records(), top_k=50)
+        assert index.exhaustive
+        assert index.candidates(_rec("x", "Unrelated"))[0] == [0, 1, 2, 3, 4]
+
+    def test_merge_finds_the_best_match_among_candidates(self, shelves):
+        _make_db(shelves["pri_db"], [
+            (f"p{i:02d}", f"p{i:02d}.pdf", f"Paper number {i} on hashing",
+             "Jane Doe", "", "", "")
+            for i in range(30)
+        ])
+        _make_db(shelves["sec_db"], [
+            ("s1", "s1.pdf", "Paper number 17 on hashng", "J. Doe", "", "", ""),
+        ])
+        report = _run_merge(shelves, candidates=5)
+        entry, = report.entries
+        sec = Record("s1", "s1.pdf", "Paper number 17 on hashng", "J. Doe", "", "", "")
+        best = Record("p17", "p17.pdf", "Paper number 17 on hashing", "Jane Doe", "", "", "")
+        assert entry.score == weighted_similarity(sec, best)
+        assert "candidate limit (5) reached" in entry.reason
+        assert report.limited == 1
+        assert "Candidate limit (5) reached for 1 records" in report.summary()
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Record features
+# ─────────────────────────────────────────────────────────────────────────────
+
+class TestRecordFeatures:
+
+    def test_features_are_immutable_and_picklable(self):
+        import pickle
+
+        features = RecordFeatures(_rec("1", "Cuckoo Hashing", "Pagh, Rasmus"))
+        with pytest.raises(AttributeError):
+            features.title = "other"
+        assert not hasattr(features, "__dict__")
+        copy = pickle.loads(pickle.dumps(features))
+        assert [getattr(copy, n) for n in RecordFeatures.__slots__] == \
+            [getattr(features, n) for n in RecordFeatures.__slots__]
+
+    def test_feature_similarity_equals_record_similarity(self):
+        records = [
+            Record("1", "1.pdf", "Cuckoo Hashing", "Pagh, Rasmus", "", "", "Hash tables"),
+            Record("2", "2.pdf", "cuckoo hashing ", "R. Pagh, F. Rodler", "", "", ""),
+            Record("3", "3.pdf", "", "ACM", "", "", " "),
+            Record("4", "4.pdf", "Sorting", "", "", "", "hash TABLES"),
+        ]
+        features = [RecordFeatures(r) for r in records]
+        for a, fa in zip(records, features):
+            for b, fb in zip(records, features):
+                expected = (W_TITLE * _fuzzy(a.title, b.title)
+                            + W_AUTHORS * _author_similarity(a.authors, b.authors)
+                            + W_DESCRIPTION * _fuzzy(a.description, b.description))
+                assert feature_similarity(fa, fb) == pytest.approx(expected)
+
+    def test_blank_and_empty_fields_stay_distinct(self):
+        assert _fuzzy("", "") == 1.0
+        assert _fuzzy("", " ") == 0.0
+        assert _fuzzy(" ", "  ") == 1.0
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Parallel scoring
+# ─────────────────────────────────────────────────────────────────────────────
+
+class TestScoreRecords:
+
+    def _records(self, prefix, n):
+        return [
+            _rec(f"{prefix}{i}", f"On hashing {i * 7 % 13} and sorting {i % 5}",
+                 f"Author{i % 4} Smith, Jane Doe{i % 3}")
+            for i in range(n)
+        ]
+
+    def test_parallel_matches_serial_in_order(self):
+        pri, sec = self._records("p", 80), self._records("s", 150)
+        serial = list(score_records(sec, pri, top_k=10, jobs=1))
+        parallel = list(score_records(sec, pri, top_k=10, jobs=2, min_pairs=0))
+        assert parallel == serial
+        assert len(serial) == 150
+
+    def test_pruning_keeps_the_exact_best_match(self):
+        pri, sec = self._records("p", 60), self._records("s", 40)
+        pri_features = [RecordFeatures(r) for r in pri]
+        stats = ScoreStats()
+        for rec, (score, best_i, _) in zip(
+                sec, score_records(sec, pri, top_k=0, jobs=1, stats=stats)):
+            scores = [feature_similarity(RecordFeatures(rec), f) for f in pri_features]
+            assert score == max(scores)
+            assert best_i == scores.index(score)
+        assert stats.pairs == 60 * 40
+        assert 0 < stats.pruned < stats.pairs
+
+    def test_parallel_stats_match_serial(self):
+        pri, sec = self._records("p", 30), self._records("s", 100)
+        serial, parallel = ScoreStats(), ScoreStats()
+        list(score_records(sec, pri, jobs=1, stats=serial))
+        list(score_records(sec, pri, jobs=2, min_pairs=0, stats=parallel))
+        assert parallel == serial
+
+    def test_scoring_starts_before_the_first_result_is_read(self, monkeypatch):
+        from concurrent.futures import Future
+
+        submitted = []
+
+        class Pool:
+            def __init__(self, **kwargs):
+                pass
+
+            def submit(self, fn, chunk):
+                submitted.append(len(chunk))
+                future = Future()
+                future.set_result(([(0.0, None, False)] * len(chunk), ScoreStats()))
+                return future
+
+            def shutdown(self, **kwargs):
+                pass
+
+        monkeypatch.setattr("bookshelf.merge.ProcessPoolExecutor", Pool)
+        pri, sec = self._records("p", 10), self._records("s", 100)
+        scores = score_records(sec, pri, jobs=2, min_pairs=0)
+        assert sum(submitted) == 100
+        assert len(list(scores)) == 100
+
+        stats = ScoreStats()
+        score_records(sec, pri, jobs=1, stats=stats)
+        assert stats.pairs > 0
+
+    def test_small_inputs_stay_in_process(self, monkeypatch):
+        monkeypatch.setattr("bookshelf.merge.ProcessPoolExecutor", None)
+        pri, sec = self._records("p", 5), self._records("s", 5)
+        assert len(list(score_records(sec, pri, jobs=8))) == 5
@@ -0,0 +1,137 @@
+"""
+tests/test_prefill.py
+
+Test suite for the background metadata suggestions in bookshelf.prefill.
+
+Run with:
+    pytest tests/test_prefill.py -v
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import pytest
+
+import bookshelf.prefill as prefill
+import bookshelf.util as util
+
+
+class TestMetadataFrom:
+
+    def test_document_information_first(self):
+        info = SimpleNamespace(title="Space/time trade-offs  in hash coding",
+                               author="Burton H. Bloom", subject="Hashing",
+                               keywords="bloom filter")
+        xmp = SimpleNamespace(dc_title={"x-default": "Other"}, dc_creator=["X"])
+        assert prefill.metadata_from(info, xmp, "") == {
+            "title": "Space/time trade-offs in hash coding",
+            "authors": "Burton H. Bloom",
+            "keywords": "bloom filter",
+            "description": "Hashing",
+        }
+
+    def test_xmp_then_first_page(self):
+        info = SimpleNamespace(title="Microsoft Word - draft3.doc", author=None)
+        xmp = SimpleNamespace(dc_creator=["A. Pagh", "F. Rodler"],
+                              dc_subject=["hashing", "cuckoo"])
+        md = prefill.metadata_from(info, xmp, "\n\n  Cuckoo   Hashing \nAbstract ...")
+        assert md["title"] == "Cuckoo Hashing"
+        assert md["authors"] == "A. Pagh, F. Rodler"
+        assert md["keywords"] == "hashing, cuckoo"
+
+    def test_nothing_known(self):
+        assert set(prefill.metadata_from(None, None, "").values()) == {""}
+
+
+class TestPrefill:
+
+    def test_fields_resolve(self, monkeypatch):
+        monkeypatch.setattr(prefill, "read_metadata",
+                            lambda path, timeout: {"title": "Bloom", "authors": "B. Bloom"})
+        p = prefill.Prefill("paper.pdf")
+        assert p.get("title").result(timeout=5) == "Bloom"
+        assert p.get("description").result(timeout=5) == ""
+        assert p.get("category") is None
+
+    def test_failure_gives_no_suggestions(self, monkeypatch):
+        def broken(path, timeout):
+            raise OSError("cannot start worker")
+
+        monkeypatch.setattr(prefill, "read_metadata", broken)
+        assert prefill.Prefill("paper.pdf").get("title").result(timeout=5) == ""
+
+    def test_timeout_drops_late_result(self, monkeypatch):
+        release = threading.Event()
+
+        def slow(path, timeout):
+            release.wait(5)
+            return {"title": "Too late"}
+
+        monkeypatch.setattr(prefill, "read_metadata", slow)
+        p = prefill.Prefill("huge.pdf", timeout=0.05)
+        assert p.get("title").result(timeout=5) == ""
+        release.set()
+        assert p.get("title").result() == ""
+
+    def test_only_pdfs(self):
+        assert prefill.start_prefill("notes.txt") is None
+
+
+class TestStringInput:
+
+    def _prompt(self, monkeypatch, answer=""):
+        calls = []
+
+        def prompt(message, default="", pre_run=None):
+            calls.append((default, pre_run))
+            return answer or default
+
+        monkeypatch.setattr("prompt_toolkit.prompt", prompt)
+        return calls
+
+    def test_ready_suggestion_is_the_default(self, monkeypatch):
+        calls = self._prompt(monkeypatch)
+        pending = Future()
+        pending.set_result("Bloom")
+        assert util.string_input("Title", "", pending=pending) == "Bloom"
+        assert calls == [("Bloom", None)]
+
+    def test_pending_suggestion_fills_later(self, monkeypatch):
+        calls = self._prompt(monkeypatch, answer="typed")
+        assert util.string_input("Title", "", pending=Future()) == "typed"
+        assert calls[0][0] == "" and calls[0][1] is not None
+
+    @pytest.mark.parametrize("done", [True, False])
+    def test_existing_value_wins(self, monkeypatch, done):
+        calls = self._prompt(monkeypatch)
+        pending = Future()
+        if done:
+            pending.set_result("Bloom")
+        assert util.string_input("Title", "Mine", pending=pending) == "Mine"
+        assert calls == [("Mine", None)]
+
+    @pytest.mark.parametrize("typed, expected", [("", "Bloom"), ("Mine", "Mine")])
+    def test_suggestion_typed_into_open_prompt(self, typed, expected):
+        from prompt_toolkit.application import create_app_session
+        from prompt_toolkit.input import create_pipe_input
+        from prompt_toolkit.output import DummyOutput
+
+        pending = Future()
+        with create_pipe_input() as pipe, \
+                create_app_session(input=pipe, output=DummyOutput()):
+            def user():
+                time.sleep(0.1)
+                pipe.send_text(typed)
+                time.sleep(0.1)
+                pending.set_result("Bloom")
+                time.sleep(0.1)
+                pipe.send_text("\r")
+
+            thread = threading.Thread(target=user)
+            thread.start()
+            assert util.string_input("Title", "", pending=pending) == expected
+            thread.join()
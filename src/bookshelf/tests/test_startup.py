@@ -0,0 +1,70 @@
+"""
+tests/test_startup.py
+
+Test suite for the start-up import graph and bookshelf.importprofile.
+
+Run with:
+    pytest tests/test_startup.py -v
+"""
+
+from __future__ import annotations
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import bookshelf
+
+SRC = os.path.dirname(os.path.dirname(bookshelf.__file__))
+
+# Modules that must only be imported by the commands that use them
+LAZY_MODULES = [
+    "prompt_toolkit", "readline", "pypdf", "subprocess", "argparse",
+    "socketserver", "bookshelf.daemon", "bookshelf.merge",
+]
+
+
+def _run(code: str, **env) -> subprocess.CompletedProcess:
+    environ = dict(os.environ, PYTHONPATH=SRC)
+    environ.pop("BOOKSHELF_IMPORT_PROFILE", None)
+    environ.update(env)
+    return subprocess.run(
+        [sys.executable, "-c", code], env=environ,
+        capture_output=True, text=True, check=True,
+    )
+
+
+class TestLazyImports:
+
+    def test_app_import_skips_optional_modules(self):
+        out = _run(
+            "import sys, bookshelf.app\n"
+            f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+        ).stdout
+        assert out.strip() == ""
+
+    def test_merge_import_skips_pypdf(self):
+        out = _run("import sys, bookshelf.merge; print('pypdf' in sys.modules)").stdout
+        assert out.strip() == "False"
+
+
+class TestImportProfile:
+
+    def test_report_on_exit(self):
+        err = _run("import bookshelf.app", BOOKSHELF_IMPORT_PROFILE="1").stderr
+        assert "bookshelf.app" in err
+        assert "[import profile] total" in err
+
+    def test_over_budget_is_flagged(self):
+        err = _run(
+            "import bookshelf.app", BOOKSHELF_IMPORT_PROFILE="1",
+            BOOKSHELF_IMPORT_BUDGET_MS="0",
+        ).stderr
+        assert "OVER BUDGET" in err
+
+    @pytest.mark.parametrize("value", ["", "0"])
+    def test_disabled(self, value):
+        err = _run("import bookshelf.app", BOOKSHELF_IMPORT_PROFILE=value).stderr
+        assert "import profile" not in err
@@ -0,0 +1,191 @@
+"""
+tests/test_store.py
+
+Test suite for the file store layouts in bookshelf.store.
+
+Run with:
+    pytest tests/test_store.py -v
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+
+import pytest
+
+import bookshelf.db as db
+import bookshelf.store as store
+from bookshelf.app import Bookshelf, Metadata
+from bookshelf.ingest import import_directory
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.fixture()
+def home(monkeypatch):
+    with tempfile.TemporaryDirectory() as home:
+        monkeypatch.setenv("HOME", home)
+        yield home
+
+
+def _shelf(home, mode):
+    _write(os.path.join(home, ".config/bookshelf/config.ini"),
+           f"[settings]\nstorage_mode = {mode}\n".encode())
+    return Bookshelf(show_banner=False)
+
+
+def _path(shelf, identifier):
+    filename = shelf.get_record_with_id(identifier)[1]
+    return os.path.join(shelf.root_dir, shelf.files_dir, filename[:2], filename)
+
+
+class TestStoreFile:
+
+    def test_uuid_store_copies(self, home):
+        files = os.path.join(home, "files")
+        store.init(files, "uuid")
+        src = _write(os.path.join(home, "a.pdf"), b"paper")
+        dst = os.path.join(files, "ab", "ab.pdf")
+        os.makedirs(os.path.dirname(dst))
+        result = store.store_file(src, dst, files)
+        assert (result.sha256, result.size) == (hashlib.sha256(b"paper").hexdigest(), 5)
+        assert not os.path.exists(os.path.join(files, "objects"))
+        assert os.stat(dst).st_nlink == 1
+
+    def test_cas_store_links_one_blob(self, home):
+        files = os.path.join(home, "files")
+        store.init(files, "cas")
+        src = _write(os.path.join(home, "a.pdf"), b"paper")
+        os.makedirs(os.path.join(files, "ab"))
+        first = os.path.join(files, "ab", "ab1.pdf")
+        second = os.path.join(files, "ab", "ab2.pdf")
+        digest = store.store_file(src, first, files).sha256
+        assert store.store_file(src, second, files, digest=digest).method == "hardlink"
+
+        blob = store.blob_path(files, digest)
+        assert os.path.samefile(first, blob) and os.path.samefile(second, blob)
+        assert os.stat(blob).st_nlink == 3
+        assert os.listdir(store.objects_dir(files)) == [digest[:2]]  # no temp left
+
+    def test_replace_does_not_touch_shared_blob(self, home):
+        files = os.path.join(home, "files")
+        store.init(files, "cas")
+        os.makedirs(os.path.join(files, "ab"))
+        first = os.path.join(files, "ab", "ab1.pdf")
+        second = os.path.join(files, "ab", "ab2.pdf")
+        src = _write(os.path.join(home, "a.pdf"), b"paper")
+        store.store_file(src, first, files)
+        store.store_file(src, second, files)
+        store.store_file(_write(os.path.join(home, "b.pdf"), b"other"), second, files)
+        assert _read(first) == b"paper"
+        assert _read(second) == b"other"
+
+    def test_linked_export_is_read_only(self, home):
+        files = os.path.join(home, "files")
+        store.init(files, "uuid")
+        src = _write(os.path.join(files, "ab", "ab.pdf"), b"paper")
+        dst = os.path.join(home, "Paper.pdf")
+        assert store.export_file(src, dst, files, "hardlink") == "hardlink"
+        assert os.path.samefile(src, dst)
+        assert os.stat(dst).st_mode & 0o222 == 0
+
+    def test_failed_replace_keeps_the_old_file(self, home):
+        files = os.path.join(home, "files")
+        store.init(files, "cas")
+        os.makedirs(os.path.join(files, "ab"))
+        dst = os.path.join(files, "ab", "rec.pdf")
+        src = _write(os.path.join(home, "a.pdf"), b"paper")
+        store.store_file(src, dst, files)
+        with pytest.raises(FileNotFoundError):
+            store.store_file(os.path.join(home, "none.pdf"), dst, files)
+        assert _read(dst) == b"paper"
+        # Replacing a record's file by itself keeps it too
+        store.store_file(dst, dst, files)
+        assert _read(dst) == b"paper"
+        assert sorted(os.listdir(os.path.dirname(dst))) == ["rec.pdf"]
+
+    def test_unknown_mode(self, home):
+        with pytest.raises(ValueError):
+            store.init(home, "git")
+
+
+class TestContentAddressedShelf:
+
+    def test_identical_adds_share_a_blob(self, home):
+        shelf = _shelf(home, "cas")
+        src = _write(os.path.join(home, "a.pdf"), b"same paper")
+        first = shelf.add_document_with_metadata(src)
+        second = shelf.add_document_with_metadata(src, allow_duplicate=True)
+        assert os.path.samefile(_path(shelf, first), _path(shelf, second))
+        assert shelf.get_storage_layout() == "cas"
+        db.close(shelf.db_path)
+
+    def test_inbox_export_is_a_link(self, home):
+        shelf = _shelf(home, "cas")
+        identifier = shelf.add_document_with_metadata(
+            _write(os.path.join(home, "a.pdf"), b"paper"), title="Bloom")
+        shelf.copy_file_to_inbox_named_as_title(identifier)
+        exported = os.path.join(shelf.root_dir, shelf.inbox_dir, "Bloom.pdf")
+        assert os.path.samefile(exported, _path(shelf, identifier))
+        db.close(shelf.db_path)
+
+    def test_import_links_into_blobs(self, home):
+        shelf = _shelf(home, "cas")
+        _write(os.path.join(home, "tree", "a.pdf"), b"one")
+        _write(os.path.join(home, "tree", "b.pdf"), b"two")
+        files = os.path.join(shelf.root_dir, shelf.files_dir)
+        stats = import_directory(os.path.join(home, "tree"), shelf.db_path,
+                                 shelf.table_name, files, out=open(os.devnull, "w"))
+        assert stats.imported == 2
+        for (identifier, digest) in shelf.conn.execute("SELECT id, sha256 FROM docs"):
+            assert os.path.samefile(_path(shelf, identifier),
+                                    store.blob_path(files, digest))
+        db.close(shelf.db_path)
+
+
+class TestMigrate:
+
+    def test_migrate_uuid_store_in_place(self, home):
+        shelf = _shelf(home, "uuid")
+        src = _write(os.path.join(home, "a.pdf"), b"same paper")
+        ids = [shelf.add_document_with_metadata(src, allow_duplicate=True)
+               for _ in range(3)]
+        other = shelf.add_document_with_metadata(
+            _write(os.path.join(home, "b.pdf"), b"another"))
+        # A record stored before hashes were kept
+        shelf.conn.execute("UPDATE docs SET sha256 = NULL WHERE id = ?", (other,))
+        shelf.conn.commit()
+        assert shelf.get_storage_layout() == "uuid"
+
+        stats = shelf.migrate_store()
+        assert (stats.linked, stats.deduplicated, stats.bytes_saved) == (4, 2, 20)
+        assert shelf.get_storage_layout() == "cas"
+        assert len({os.stat(_path(shelf, i)).st_ino for i in ids}) == 1
+        assert _read(_path(shelf, ids[0])) == b"same paper"
+        assert shelf.get_record_with_id(other)[7] == hashlib.sha256(b"another").hexdigest()
+
+        # Running it again changes nothing
+        stats = shelf.migrate_store()
+        assert (stats.linked, stats.deduplicated, stats.hashed) == (4, 0, {})
+        db.close(shelf.db_path)
+
+    def test_gc_removes_unlinked_blobs(self, home):
+        shelf = _shelf(home, "cas")
+        identifier = shelf.add_document_with_metadata(
+            _write(os.path.join(home, "a.pdf"), b"paper"))
+        assert shelf.gc_store() == 0
+        os.unlink(_path(shelf, identifier))
+        assert shelf.gc_store() == 1
+        db.close(shelf.db_path)
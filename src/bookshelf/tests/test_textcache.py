@@ -0,0 +1,130 @@
+"""
+tests/test_textcache.py
+
+Test suite for the extracted-text cache in bookshelf.textcache.
+
+Run with:
+    pytest tests/test_textcache.py -v
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+import bookshelf.db as db
+import bookshelf.extract as extract
+import bookshelf.merge as merge
+import bookshelf.textcache as textcache
+
+TEXT = "Cuckoo   hashing\nmoves keys  between two tables. " * 50
+
+
+@pytest.fixture()
+def tmp():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "paper.txt")
+        with open(path, "w") as f:
+            f.write(TEXT)
+        db_path = os.path.join(tmp, "shelf.db")
+        yield tmp, path, db_path
+        db.close(db_path)
+
+
+def _count_extractions(monkeypatch):
+    calls = []
+    real = textcache.read_text
+
+    def read_text(path):
+        calls.append(path)
+        return real(path)
+
+    monkeypatch.setattr(textcache, "read_text", read_text)
+    return calls
+
+
+class TestTextCache:
+
+    def test_each_content_is_extracted_once(self, tmp, monkeypatch):
+        _, path, db_path = tmp
+        calls = _count_extractions(monkeypatch)
+        cache = textcache.TextCache(db.get_connection(db_path))
+        first = cache.text("abc", path)
+        assert first.text == " ".join(TEXT.split()) and first.pages == 1
+        assert cache.text("abc", path) == first
+        assert (cache.hits, cache.misses, len(calls)) == (1, 1, 1)
+
+        # Persistent: a new cache (another run) reads it back
+        db.close(db_path)
+        again = textcache.TextCache(db.get_connection(db_path))
+        assert again.text("abc", path) == first
+        assert len(calls) == 1
+
+    def test_stored_compressed(self, tmp):
+        _, path, db_path = tmp
+        conn = db.get_connection(db_path)
+        textcache.TextCache(conn).text("abc", path)
+        stored, = conn.execute("SELECT text FROM bookshelf_text_cache").fetchone()
+        assert len(stored) < len(" ".join(TEXT.split())) / 4
+
+    def test_failures_are_cached_until_forgotten(self, tmp, monkeypatch):
+        _, path, db_path = tmp
+        conn = db.get_connection(db_path)
+        cache = textcache.TextCache(conn)
+
+        def broken(path):
+            raise ValueError("malformed PDF")
+
+        monkeypatch.setattr(textcache, "read_text", broken)
+        failed = cache.text("abc", path)
+        assert (failed.error, failed.message) == ("ValueError", "malformed PDF")
+        monkeypatch.setattr(textcache, "read_text", None)   # must not be called
+        assert cache.text("abc", path).error is not None
+        assert textcache.forget_errors(conn) == 1
+        assert cache.get("abc") is None
+
+    @pytest.mark.parametrize("error", [extract.ERROR_TIMEOUT, extract.ERROR_CRASHED])
+    def test_timeouts_and_crashes_are_tried_again(self, tmp, error):
+        _, path, db_path = tmp
+        conn = db.get_connection(db_path)
+        failing = textcache.TextCache(
+            conn, extractor=lambda path: extract.ExtractResult(error=error))
+        assert failing.text("abc", path).error == error
+        assert failing.get("abc") is None
+        assert textcache.TextCache(conn).text("abc", path).error is None
+
+    def test_missing_files_and_unknown_hashes_are_not_cached(self, tmp):
+        folder, path, db_path = tmp
+        conn = db.get_connection(db_path)
+        cache = textcache.TextCache(conn)
+        assert cache.text("gone", os.path.join(folder, "gone.txt")).error
+        cache.text(None, path)
+        assert conn.execute("SELECT COUNT(*) FROM bookshelf_text_cache").fetchone() == (0,)
+
+    def test_readonly_looks_up_only(self, tmp):
+        _, path, db_path = tmp
+        sqlite3.connect(db_path).close()
+        cache = textcache.TextCache(db.get_connection(db_path, readonly=True),
+                                    readonly=True)
+        assert cache.text("abc", path).text
+        assert cache.get("abc") is None
+
+
+class TestMergeReadsThrough:
+
+    def test_same_pdf_content_uses_the_cache(self, tmp, monkeypatch):
+        folder, path, db_path = tmp
+        monkeypatch.setattr(merge, "_PYPDF_AVAILABLE", True)
+        monkeypatch.setattr(textcache, "read_text", lambda p: ("same text", 3))
+        cache = textcache.TextCache(db.get_connection(db_path))
+        a, b = (os.path.join(folder, name) for name in ("a.pdf", "b.pdf"))
+        for p in (a, b):
+            open(p, "w").close()
+        assert merge._same_pdf_content(a, b, "ha", "hb", cache)
+
+        monkeypatch.setattr(textcache, "read_text", None)   # must not be called
+        assert merge._same_pdf_content(a, b, "ha", "hb", cache)
+        assert (cache.hits, cache.misses) == (2, 2)
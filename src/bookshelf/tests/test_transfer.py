@@ -0,0 +1,120 @@
+"""
+tests/test_transfer.py
+
+Test suite for the file-transfer strategies in bookshelf.transfer.
+
+Run with:
+    pytest tests/test_transfer.py -v
+"""
+
+from __future__ import annotations
+
+import errno
+import hashlib
+import os
+import tempfile
+
+import pytest
+
+import bookshelf.transfer as transfer
+
+CONTENT = os.urandom(3 << 20) + b"tail"
+
+
+@pytest.fixture()
+def tmp():
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "src.pdf")
+        with open(src, "wb") as f:
+            f.write(CONTENT)
+        yield tmp, src
+
+
+def _check(result, dst):
+    with open(dst, "rb") as f:
+        assert f.read() == CONTENT
+    assert result.sha256 == hashlib.sha256(CONTENT).hexdigest()
+    assert result.size == len(CONTENT)
+
+
+def _fail(*args):
+    raise OSError(errno.EOPNOTSUPP, "not here")
+
+
+class TestTransfer:
+
+    @pytest.mark.parametrize("strategy", transfer.STRATEGIES)
+    def test_every_strategy_copies_and_hashes(self, tmp, strategy):
+        folder, src = tmp
+        dst = os.path.join(folder, "dst.pdf")
+        result = transfer.transfer_file(src, dst, strategy)
+        _check(result, dst)
+        assert result.method in transfer.STRATEGIES
+        assert result.method != "hardlink"
+        assert not os.path.samefile(src, dst)
+
+    def test_falls_back_in_order(self, tmp, monkeypatch):
+        folder, src = tmp
+        monkeypatch.setitem(transfer._METHODS, "reflink", _fail)
+        monkeypatch.setitem(transfer._METHODS, "copy_file_range", _fail)
+        dst = os.path.join(folder, "dst.pdf")
+        result = transfer.transfer_file(src, dst)
+        _check(result, dst)
+        assert result.method in ("sendfile", "copy")
+
+        monkeypatch.setitem(transfer._METHODS, "sendfile", _fail)
+        result = transfer.transfer_file(src, dst)
+        _check(result, dst)
+        assert result.method == "copy"
+
+    def test_hardlink_only_when_allowed(self, tmp):
+        folder, src = tmp
+        dst = os.path.join(folder, "dst.pdf")
+        result = transfer.transfer_file(src, dst, "hardlink", allow_link=True)
+        assert result.method == "hardlink"
+        assert os.path.samefile(src, dst)
+        _check(result, dst)
+
+    def test_existing_destination_is_replaced_not_written(self, tmp):
+        folder, src = tmp
+        dst = os.path.join(folder, "dst.pdf")
+        other = os.path.join(folder, "other.pdf")
+        with open(other, "wb") as f:
+            f.write(b"keep me")
+        os.link(other, dst)
+        transfer.transfer_file(src, dst, "copy")
+        with open(other, "rb") as f:
+            assert f.read() == b"keep me"
+        with pytest.raises(FileExistsError):
+            transfer.transfer_file(src, dst, exclusive=True)
+
+    def test_failed_copy_keeps_the_destination(self, tmp, monkeypatch):
+        folder, src = tmp
+        dst = os.path.join(folder, "dst.pdf")
+        with open(dst, "wb") as f:
+            f.write(b"keep me")
+
+        def copy_file_with_hash(src, dst, exclusive=False):
+            open(dst, "xb").close()
+            raise OSError(errno.ENOSPC, "No space left on device")
+
+        monkeypatch.setattr("bookshelf.util.copy_file_with_hash", copy_file_with_hash)
+        with pytest.raises(OSError):
+            transfer.transfer_file(src, dst, "copy")
+        with open(dst, "rb") as f:
+            assert f.read() == b"keep me"
+        assert sorted(os.listdir(folder)) == ["dst.pdf", "src.pdf"]   # no temp left
+
+    def test_known_digest_is_not_recomputed(self, tmp, monkeypatch):
+        folder, src = tmp
+        monkeypatch.setattr("bookshelf.util.sha256_file", None)   # must not be called
+        result = transfer.transfer_file(
+            src, os.path.join(folder, "dst.pdf"), "hardlink",
+            allow_link=True, digest="abc",
+        )
+        assert result.sha256 == "abc"
+
+    def test_unknown_strategy(self, tmp):
+        folder, src = tmp
+        with pytest.raises(ValueError):
+            transfer.transfer_file(src, os.path.join(folder, "dst.pdf"), "teleport")
@@ -0,0 +1,184 @@
+"""
+tests/test_watch.py
+
+Test suite for the inbox watcher and the review queue in bookshelf.watch.
+
+Run with:
+    pytest tests/test_watch.py -v
+"""
+
+from __future__ import annotations
+
+import os
+import tempfile
+import time
+
+import pytest
+
+import bookshelf.db as db
+import bookshelf.watch as watch
+from bookshelf.app import Bookshelf
+
+
+@pytest.fixture()
+def shelf(monkeypatch):
+    with tempfile.TemporaryDirectory() as home:
+        monkeypatch.setenv("HOME", home)
+        b = Bookshelf(show_banner=False)
+        yield b
+        db.close(b.db_path)
+
+
+def _watcher(shelf, **kwargs):
+    return watch.InboxWatcher(
+        os.path.join(shelf.root_dir, shelf.inbox_dir),
+        shelf.db_path, shelf.table_name,
+        os.path.join(shelf.root_dir, shelf.files_dir),
+        settle=1.0, jobs=2, **kwargs,
+    )
+
+
+def _drop(shelf, name, content, age=10.0):
+    path = os.path.join(shelf.root_dir, shelf.inbox_dir, name)
+    with open(path, "wb") as f:
+        f.write(content)
+    then = time.time() - age
+    os.utime(path, (then, then))
+    return path
+
+
+def _poll(watcher):
+    # A file is only added once seen unchanged by two polls
+    watcher.scan()
+    return watcher.poll()
+
+
+def _titles(shelf):
+    return [row[0] for row in shelf.conn.execute(
+        f"SELECT title FROM {shelf.table_name} ORDER BY title")]
+
+
+class TestCandidates:
+
+    @pytest.mark.parametrize("name, expected", [
+        ("bloom.pdf", True),
+        ("notes.md", True),
+        (".DS_Store", False),
+        ("paper.pdf.crdownload", False),
+        ("paper.pdf.part", False),
+        ("~$draft.docx", False),
+        ("0b5e2f9c-3c4d-4e1a-9f0e-0123456789ab.pdf", False),
+    ])
+    def test_is_candidate(self, name, expected):
+        assert watch.is_candidate(name) is expected
+
+    def test_placeholder_title_from_file_name(self):
+        md = watch.placeholder_metadata("/in/space_time  trade-offs.pdf", {})
+        assert md["title"] == "space time trade-offs"
+        md = watch.placeholder_metadata("/in/x.pdf", {"title": "Bloom", "authors": "B"})
+        assert (md["title"], md["authors"], md["category"]) == ("Bloom", "B", "")
+
+
+class TestWatcher:
+
+    def test_settled_files_are_added_as_one_batch(self, shelf):
+        a = _drop(shelf, "cuckoo_hashing.txt", b"cuckoo")
+        b = _drop(shelf, "bloom.txt", b"bloom")
+        batch = _poll(_watcher(shelf, index_content=False))
+        assert len(batch.added) == 2 and not batch.errors
+        assert _titles(shelf) == ["bloom", "cuckoo hashing"]
+        assert not os.path.exists(a) and not os.path.exists(b)
+        queue = watch.review_queue(shelf.conn, shelf.table_name)
+        assert sorted(source for _, source in queue) == ["bloom.txt", "cuckoo_hashing.txt"]
+        # Searchable at once (the FTS triggers ran)
+        assert [row[2] for row in shelf.query_documents("cuckoo", "fts")] == ["cuckoo hashing"]
+
+    def test_files_being_written_wait(self, shelf):
+        watcher = _watcher(shelf, index_content=False)
+        path = _drop(shelf, "fresh.txt", b"half", age=0)
+        assert watcher.poll() is None
+        assert watcher.scan() == ([], 1)
+
+        # Grows between two polls: not settled, even though it is old
+        with open(path, "ab") as f:
+            f.write(b" done")
+        then = time.time() - 10
+        os.utime(path, (then, then))
+        assert watcher.scan()[0] == []
+        assert watcher.scan()[0] == [path]
+
+    def test_file_seen_once_waits_for_the_next_poll(self, shelf):
+        watcher = _watcher(shelf, index_content=False)
+        # Old mtime, but possibly still being written: not added yet
+        path = _drop(shelf, "old.txt", b"old", age=3600)
+        assert watcher.poll() is None
+        assert watcher.scan() == ([path], 0)
+
+    def test_duplicates_stay_and_are_not_retried(self, shelf):
+        watcher = _watcher(shelf, index_content=False)
+        _drop(shelf, "bloom.txt", b"bloom")
+        _poll(watcher)
+        copy = _drop(shelf, "Bloom (copy).txt", b"bloom")
+        batch = _poll(watcher)
+        assert batch.duplicates == [copy] and batch.added == []
+        assert os.path.exists(copy)
+        assert watcher.poll() is None
+        assert _titles(shelf) == ["bloom"]
+
+    def test_duplicates_are_not_copied_nor_retried_after_a_restart(
+            self, shelf, monkeypatch):
+        _drop(shelf, "bloom.txt", b"bloom")
+        _poll(_watcher(shelf, index_content=False))
+        copy = _drop(shelf, "Bloom (copy).txt", b"bloom")
+        copied = []
+        real = watch.ingest.copy_and_hash
+        monkeypatch.setattr(watch.ingest, "copy_and_hash",
+                            lambda src, *a: copied.append(src) or real(src, *a))
+        assert _poll(_watcher(shelf, index_content=False)).duplicates == [copy]
+        assert copied == []
+        # Another watcher (e.g. after a restart) still ignores it
+        assert _poll(_watcher(shelf, index_content=False)) is None
+        os.unlink(copy)
+        _watcher(shelf, index_content=False).scan()
+        assert shelf.conn.execute(
+            "SELECT count(*) FROM bookshelf_watch_ignored").fetchone() == (0,)
+
+    def test_removed_files_are_not_added_back(self, shelf):
+        watcher = _watcher(shelf, index_content=False)
+        _drop(shelf, "bloom.txt", b"bloom")
+        identifier, = _poll(watcher).added
+        shelf.remove_document(identifier)
+        assert watcher.poll() is None
+        assert _titles(shelf) == []
+
+    def test_text_is_indexed(self, shelf):
+        _drop(shelf, "notes.md", b"quotient filters are compact")
+        watcher = _watcher(shelf)
+        watcher.run(interval=0.01, once=True)
+        assert [row[2] for row in shelf.query_documents("compact", "content")] == ["notes"]
+
+
+class TestReview:
+
+    def test_review_keeps_skips_and_edits(self, shelf, monkeypatch):
+        for name in ("a.txt", "b.txt", "c.txt"):
+            _drop(shelf, name, name.encode())
+        _poll(_watcher(shelf, index_content=False))
+
+        monkeypatch.setattr("bookshelf.util.get_terminal_width", lambda: 80)
+        answers = iter(["k", "s", "e"])
+        monkeypatch.setattr("bookshelf.util.closed_ended_question",
+                            lambda msg, options: next(answers))
+        edited = []
+        monkeypatch.setattr(shelf, "edit_record", edited.append)
+        shelf.review_documents()
+
+        queue = watch.review_queue(shelf.conn, shelf.table_name)
+        assert [source for _, source in queue] == ["b.txt"]
+        assert len(edited) == 1
+
+    def test_removed_records_leave_the_queue(self, shelf):
+        _drop(shelf, "a.txt", b"a")
+        identifier, = _poll(_watcher(shelf, index_content=False)).added
+        shelf.remove_record(identifier)
+        assert watch.review_queue(shelf.conn, shelf.table_name) == []
@@ -0,0 +1,178 @@
+"""
+bookshelf/textcache.py
+
+Extracted text of files, cached in the shelf database by content hash.
+
+Table (in the shelf database):
+  bookshelf_text_cache  sha256 of the file, its normalised text (whitespace
+                        collapsed, zlib-compressed), page count, the error
+                        class and message if extraction failed, and the
+                        time extraction took
+
+Parsing a PDF with pypdf is by far the slowest thing bookshelf does, and the
+text of a given file never changes, so each content is parsed at most once:
+the content index, merge's annotated-copy check and anything else that
+needs a file's text read through TextCache.text(), which only extracts on a
+miss (with the extractor given, normally a sandboxed
+bookshelf.extract.ExtractionPool).  Failures of the extraction code are
+cached as well, so a broken file is not retried on every run; 'bookshelf
+content rebuild' forgets them.  A worker that timed out or crashed, or a
+missing file, says nothing about the content (the machine may just have
+been busy), so those are not cached and the file is tried again.
+
+Entries are not tied to records: a merge caches the text of the secondary
+shelf's files too, and the text of a removed file is found again if it is
+added back.
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import zlib
+from typing import Callable, Optional, Tuple
+
+from bookshelf.extract import (
+    ERROR_CRASHED,
+    ERROR_MISSING,
+    ERROR_TIMEOUT,
+    KIND_TEXT,
+    ExtractResult,
+    run_task,
+)
+
+# zlib level of the stored text; normalised text compresses about 3:1
+COMPRESS_LEVEL = 6
+# Failures outside the extraction code, never cached
+TRANSIENT_ERRORS = (ERROR_TIMEOUT, ERROR_CRASHED, ERROR_MISSING)
+
+
+def read_text(path: str) -> Tuple[str, int]:
+    """Text of a PDF or plain-text file with whitespace collapsed, and its
+    number of pages (1 for text files).  Raises on unreadable files."""
+    if os.path.splitext(path)[1].lower() != ".pdf":
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return " ".join(f.read().split()), 1
+
+    import logging
+
+    import pypdf
+
+    logging.getLogger("pypdf").setLevel(logging.ERROR)
+    reader = pypdf.PdfReader(path)
+    text = " ".join(page.extract_text() or "" for page in reader.pages)
+    return " ".join(text.split()), len(reader.pages)
+
+
+def is_cacheable(entry: ExtractResult) -> bool:
+    """False for results that depend on the run, not on the content."""
+    return entry.error not in TRANSIENT_ERRORS
+
+
+def extract_here(path: str) -> ExtractResult:
+    """read_text() in this process, without a sandbox."""
+    return run_task(KIND_TEXT, path)
+
+
+# ---------------------------------------------------------------------------
+# Schema
+# ---------------------------------------------------------------------------
+
+def setup_text_cache(conn: sqlite3.Connection):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS bookshelf_text_cache (
+        sha256 TEXT PRIMARY KEY,
+        text BLOB NOT NULL,
+        pages INTEGER NOT NULL,
+        error TEXT,
+        message TEXT NOT NULL DEFAULT '',
+        seconds REAL NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+    """)
+    conn.commit()
+
+
+def forget_errors(conn: sqlite3.Connection) -> int:
+    """Drop the cached failures so the files are extracted again."""
+    setup_text_cache(conn)
+    with conn:
+        return conn.execute(
+            "DELETE FROM bookshelf_text_cache WHERE error IS NOT NULL;"
+        ).rowcount
+
+
+# ---------------------------------------------------------------------------
+# Cache
+# ---------------------------------------------------------------------------
+
+class TextCache:
+    """Read-through cache of extracted text on one connection.
+
+    *extractor* extracts a file on a miss.  With *readonly* (e.g. a dry-run
+    merge, whose primary database is opened read-only) entries are looked
+    up but nothing is stored.  put() leaves committing to the caller; text()
+    commits each entry it adds.
+    """
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        readonly: bool = False,
+        extractor: Callable[[str], ExtractResult] = extract_here,
+    ):
+        self._conn = conn
+        self._readonly = readonly
+        self._extractor = extractor
+        self.hits = 0
+        self.misses = 0
+        if readonly:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'bookshelf_text_cache';"
+            ).fetchone()
+            self._table = exists is not None
+        else:
+            setup_text_cache(conn)
+            self._table = True
+
+    def get(self, sha256: str) -> Optional[ExtractResult]:
+        if not self._table:
+            return None
+        row = self._conn.execute(
+            "SELECT text, pages, error, message, seconds FROM bookshelf_text_cache"
+            " WHERE sha256 = ?;",
+            (sha256,),
+        ).fetchone()
+        if row is None:
+            return None
+        text, pages, error, message, seconds = row
+        return ExtractResult(zlib.decompress(text).decode("utf-8"), pages,
+                             error, message, seconds)
+
+    def put(self, sha256: str, entry: ExtractResult):
+        if self._readonly:
+            return
+        self._conn.execute(
+            "INSERT OR REPLACE INTO bookshelf_text_cache"
+            "(sha256, text, pages, error, message, seconds)"
+            " VALUES (?, ?, ?, ?, ?, ?);",
+            (sha256, zlib.compress(entry.text.encode("utf-8"), COMPRESS_LEVEL),
+             entry.pages, entry.error, entry.message, entry.seconds),
+        )
+
+    def text(self, sha256: Optional[str], path: str) -> ExtractResult:
+        """The text of the file at *path*, whose content hash is *sha256*;
+        extracted and stored on a miss.  Without a hash nothing is cached."""
+        if sha256:
+            entry = self.get(sha256)
+            if entry is not None:
+                self.hits += 1
+                return entry
+        if not os.path.isfile(path):
+            # Not a property of the content: not cached
+            return ExtractResult(error=ERROR_MISSING, message=path)
+        self.misses += 1
+        entry = self._extractor(path)
+        if sha256 and not self._readonly and is_cacheable(entry):
+            self.put(sha256, entry)
+            self._conn.commit()
+        return entry
@@ -0,0 +1,201 @@
+"""
+bookshelf/transfer.py
+
+Copying files into and out of the store without streaming the bytes through
+Python where the file system allows it.
+
+Strategies (the 'transfer_strategy' setting):
+  reflink          copy-on-write clone (FICLONE on Linux btrfs/XFS, clonefile
+                   on APFS): instant, and no extra space until a copy changes
+  copy_file_range  in-kernel copy (Linux); server-side on NFS 4.2
+  sendfile         in-kernel copy for kernels without copy_file_range
+  copy             buffered read/write through Python; always works
+  hardlink         a hard link, for copies nobody writes to (inbox exports,
+                   made read-only by bookshelf.store.export_file); anything
+                   else falls through to the 'auto' order
+
+'auto' tries reflink, copy_file_range, sendfile and copy, in that order, until
+one works.  Naming a strategy tries it and then falls back to 'copy'.
+
+Every transfer returns the SHA-256 and size of the file.  The buffered copy
+hashes the buffers it writes.  After any other strategy the source is read
+once more to hash it (unless the caller knows the hash): a read, but no
+write, and usually from the page cache.
+"""
+
+from __future__ import annotations
+
+import errno
+import os
+import sys
+import uuid
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+import bookshelf.util as util
+
+STRATEGIES = ("auto", "reflink", "copy_file_range", "sendfile", "copy", "hardlink")
+AUTO_ORDER = ("reflink", "copy_file_range", "sendfile", "copy")
+
+# ioctl request number of FICLONE (linux/fs.h)
+FICLONE = 0x40049409
+# Bytes asked of copy_file_range/sendfile per call
+KERNEL_CHUNK = 1 << 30
+
+
+@dataclass
+class TransferResult:
+    method: str     # strategy that made the copy
+    sha256: str
+    size: int
+
+
+def _unsupported(what: str) -> OSError:
+    return OSError(errno.ENOTSUP, f"{what} is not supported on this platform")
+
+
+def _kernel_copy(src: str, dst: str, copy: Callable[[int, int, int], None]):
+    """Open *src*, create *dst* and let *copy*(fd_in, fd_out, size) move the bytes."""
+    with open(src, "rb") as fin:
+        fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        try:
+            copy(fin.fileno(), fd, os.fstat(fin.fileno()).st_size)
+        except BaseException:
+            os.close(fd)
+            os.unlink(dst)
+            raise
+        os.close(fd)
+
+
+def _ficlone(fd_in: int, fd_out: int, size: int):
+    import fcntl
+
+    fcntl.ioctl(fd_out, FICLONE, fd_in)
+
+
+def _copy_file_range(fd_in: int, fd_out: int, size: int):
+    copied = 0
+    while copied < size:
+        n = os.copy_file_range(fd_in, fd_out, min(KERNEL_CHUNK, size - copied))
+        if n == 0:
+            raise OSError(errno.EIO, "copy_file_range stopped early")
+        copied += n
+
+
+def _sendfile(fd_in: int, fd_out: int, size: int):
+    copied = 0
+    while copied < size:
+        n = os.sendfile(fd_out, fd_in, copied, min(KERNEL_CHUNK, size - copied))
+        if n == 0:
+            raise OSError(errno.EIO, "sendfile stopped early")
+        copied += n
+
+
+def _reflink(src: str, dst: str):
+    if sys.platform == "darwin":
+        import ctypes
+
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), dst)
+    elif sys.platform.startswith("linux"):
+        _kernel_copy(src, dst, _ficlone)
+    else:
+        raise _unsupported("reflink")
+
+
+def _copy_range(src: str, dst: str):
+    if not hasattr(os, "copy_file_range"):
+        raise _unsupported("copy_file_range")
+    _kernel_copy(src, dst, _copy_file_range)
+
+
+def _send(src: str, dst: str):
+    if not sys.platform.startswith("linux"):
+        # Elsewhere sendfile only writes to sockets
+        raise _unsupported("sendfile to a file")
+    _kernel_copy(src, dst, _sendfile)
+
+
+def _hardlink(src: str, dst: str):
+    os.link(src, dst)
+
+
+_METHODS: Dict[str, Callable[[str, str], None]] = {
+    "reflink": _reflink,
+    "copy_file_range": _copy_range,
+    "sendfile": _send,
+    "hardlink": _hardlink,
+}
+
+
+def strategy_order(strategy: str, allow_link: bool = False) -> List[str]:
+    """Strategies tried for *strategy*, in order."""
+    if strategy not in STRATEGIES:
+        raise ValueError(
+            f"Unknown transfer strategy '{strategy}'"
+            f" (choose from {', '.join(STRATEGIES)})"
+        )
+    if strategy == "hardlink":
+        return (["hardlink"] if allow_link else []) + list(AUTO_ORDER)
+    if strategy == "auto":
+        return list(AUTO_ORDER)
+    if strategy == "copy":
+        return ["copy"]
+    return [strategy, "copy"]
+
+
+def transfer_file(
+    src: str,
+    dst: str,
+    strategy: str = "auto",
+    exclusive: bool = False,
+    allow_link: bool = False,
+    digest: Optional[str] = None,
+) -> TransferResult:
+    """Copy *src* to *dst* with the first strategy that works.
+
+    An existing *dst* is replaced, never written through (it may be a link
+    shared with other files): the copy is made next to it and renamed over
+    it, so *dst* stays intact if the copy fails.  With *exclusive*,
+    FileExistsError is raised instead.  *allow_link* permits a hard link
+    when the strategy is 'hardlink'.  A known *digest* of *src* saves
+    hashing it.
+    """
+    order = strategy_order(strategy, allow_link)
+    if not os.path.lexists(dst):
+        return _transfer(src, dst, order, digest)
+    if exclusive:
+        raise FileExistsError(errno.EEXIST, "File already exists", dst)
+
+    tmp = os.path.join(
+        os.path.dirname(dst), f".{os.path.basename(dst)}.{uuid.uuid4().hex}.tmp"
+    )
+    try:
+        result = _transfer(src, tmp, order, digest)
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        raise
+    return result
+
+
+def _transfer(src: str, dst: str, order: List[str],
+              digest: Optional[str]) -> TransferResult:
+    """Create *dst* (which must not exist) as a copy of *src*."""
+    # The buffered copy comes last in every order
+    for method in order[:-1]:
+        try:
+            _METHODS[method](src, dst)
+        except FileExistsError:
+            raise
+        except OSError:
+            # Not supported here (file system, platform, cross-device): next
+            continue
+        return TransferResult(
+            method, digest or util.sha256_file(src), os.path.getsize(dst)
+        )
+    sha256, size = util.copy_file_with_hash(src, dst, exclusive=True)
+    return TransferResult("copy", sha256, size)
@@ -1,10 +1,10 @@
+import hashlib
 import os
 import re
 import sys
+import threading
 import uuid
 import textwrap
-from pathlib import Path
-from prompt_toolkit import prompt
 
 # ------------------------------------------------------------------------------
 #                                                              Utility routines
@@ -44,9 +44,21 @@ def closed_ended_question(msg: str, options=["y", "n"], set_default=False):
         print(f"\uf02d Answer with {option_str}")
 
 
-def string_input(msg: str, default_str: str, prohibited=[]):
+# With 'pending' (a Future of a suggested value), an empty default is
+# replaced by the suggestion: right away if it is ready, otherwise it is
+# typed into the prompt when it arrives, unless something was typed first.
+def string_input(msg: str, default_str: str, prohibited=[], pending=None):
+    # prompt_toolkit takes longer to import than the rest of the app together
+    from prompt_toolkit import prompt
+
     while True:
-        input_str = prompt(f"{msg}: ", default=default_str)
+        pre_run = None
+        if pending is not None and len(default_str) == 0:
+            if pending.done():
+                default_str = pending.result()
+            else:
+                pre_run = lambda: _fill_when_ready(pending)
+        input_str = prompt(f"{msg}: ", default=default_str, pre_run=pre_run)
         if input_str in prohibited:
             print("\uea87  Invalid (prohibited) input data")
             continue
@@ -57,6 +69,76 @@ def string_input(msg: str, default_str: str, prohibited=[]):
         return input_str
 
 
+# Called by prompt_toolkit when a prompt starts: put the result of 'pending'
+# into the prompt's buffer once it is done, from the prompt's event loop.
+def _fill_when_ready(pending):
+    import asyncio
+
+    from prompt_toolkit.application import get_app
+
+    app = get_app()
+    buffer = app.current_buffer
+    loop = asyncio.get_running_loop()
+
+    def fill():
+        value = pending.result()
+        if app.is_running and app.current_buffer is buffer and buffer.text == "":
+            buffer.text = value
+            buffer.cursor_position = len(value)
+            app.invalidate()
+
+    def schedule(_):
+        try:
+            loop.call_soon_threadsafe(fill)
+        except RuntimeError:
+            # The prompt is over and its loop closed
+            pass
+
+    pending.add_done_callback(schedule)
+
+
+# Buffer size for copying and hashing files
+COPY_CHUNK = 1 << 20
+
+
+# Copy a file and compute its SHA-256 from the same buffers, so the source is
+# read only once.  With 'exclusive', an existing 'dst' is an error instead of
+# being overwritten.  Returns (hex digest, size in bytes).
+def copy_file_with_hash(src: str, dst: str, exclusive: bool = False):
+    h = hashlib.sha256()
+    size = 0
+    with open(src, "rb") as fin, open(dst, "xb" if exclusive else "wb") as fout:
+        try:
+            while chunk := fin.read(COPY_CHUNK):
+                h.update(chunk)
+                fout.write(chunk)
+                size += len(chunk)
+        except BaseException:
+            fout.close()
+            os.unlink(dst)
+            raise
+    return h.hexdigest(), size
+
+
+# Read buffer of each thread hashing files, allocated on first use
+_hash_buffers = threading.local()
+
+
+# SHA-256 of a file as a hex string.  The file is read with readinto() into
+# one reused buffer per thread, so several threads can hash at once (hashlib
+# releases the GIL on large buffers) without allocating a chunk per read.
+def sha256_file(path: str) -> str:
+    buf = getattr(_hash_buffers, "buf", None)
+    if buf is None:
+        buf = _hash_buffers.buf = bytearray(COPY_CHUNK)
+    view = memoryview(buf)
+    h = hashlib.sha256()
+    with open(path, "rb", buffering=0) as f:
+        while n := f.readinto(buf):
+            h.update(view[:n])
+    return h.hexdigest()
+
+
 # Make a new directory if there is none
 def mkdir(dir):
     if os.path.exists(dir):
@@ -0,0 +1,462 @@
+"""
+bookshelf/watch.py
+
+Watch the inbox and add the files dropped into it, without prompts.
+
+'bookshelf watch' polls <root>/<inbox_directory> and adds every new file
+once it has settled: its size and mtime must be unchanged since the last
+poll and its mtime at least SETTLE_DEFAULT seconds old, so a file still
+being written or downloaded is left for a later poll.  Hidden files,
+partial downloads (.part, .crdownload, ...) and uuid-named files (those
+'remove' moves to the inbox) are never added.
+
+The settled files of a poll are added as one batch:
+  * Copied into the store and hashed on a thread pool (a buffered copy
+    hashes what it writes; after a reflink or an in-kernel copy the file
+    is read once more to hash it, see bookshelf.transfer), while the
+    metadata of the PDFs is read on sandboxed worker processes
+    (bookshelf.extract, as for the prefill of the add prompts).
+  * Registered in a single transaction, with the PDF's metadata or, for
+    the fields it does not give, a placeholder title made from the file
+    name, and queued for review.  The file is then removed from the inbox.
+  * A file whose content is already in the shelf (e.g. a copy 'inbox'
+    exported) is not added and stays in the inbox; it is not looked at
+    again until it changes, even by a later 'watch'.  Files with the size
+    of a record are hashed (through bookshelf.hashcache) before anything
+    is copied, so such a copy is never copied into the store.
+  * The content index is then brought up to date (bookshelf.content).
+
+Tables (in the shelf database):
+  bookshelf_review          id of a record added without a human, the name
+                            of the file it came from, and when it was added
+  bookshelf_watch_ignored   path, size and mtime (ns) of the inbox files not
+                            to add unless they change
+
+'bookshelf review' goes through the queue to check and complete the
+metadata.  Polling rather than inotify keeps this portable (and works on
+network and iCloud folders, which do not send events); an inbox is small
+and a poll is one scandir.
+
+Usage:
+    bookshelf watch [--interval 2] [--settle 2] [--jobs 4] [--once]
+                    [--no-content]
+    bookshelf review
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import bookshelf.db as db
+import bookshelf.ingest as ingest
+import bookshelf.util as util
+
+# ---------------------------------------------------------------------------
+# Constants & tuneable defaults
+# ---------------------------------------------------------------------------
+
+# Seconds between two polls
+INTERVAL_DEFAULT = 2.0
+# Seconds a file's mtime must be old before it is added
+SETTLE_DEFAULT = 2.0
+JOBS_DEFAULT = max(1, min(4, os.cpu_count() or 1))
+# Seconds allowed to read the metadata of one PDF
+METADATA_TIMEOUT = 30.0
+
+# Names of files still being written by browsers and download tools
+PARTIAL_SUFFIXES = (".part", ".partial", ".crdownload", ".download", ".tmp")
+# The name of a stored file, as 'remove' moves it to the inbox
+_UUID_NAME = re.compile(
+    r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}(\.[^.]*)?$"
+)
+
+ICON_INFO = "\uf02d"
+ICON_WARN = "\uea6c"
+
+# pypdf is optional; only its presence is checked here
+_PYPDF_AVAILABLE = importlib.util.find_spec("pypdf") is not None
+
+
+@dataclass
+class BatchResult:
+    added: List[str] = field(default_factory=list)          # record ids
+    duplicates: List[str] = field(default_factory=list)     # inbox paths
+    errors: List[Tuple[str, str]] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    def summary(self) -> str:
+        lines = [
+            f"{ICON_INFO}  Added {len(self.added)} files in {self.elapsed:.1f} s,"
+            f" queued for review"
+        ]
+        for path in self.duplicates:
+            lines.append(f"{ICON_INFO}  Already in the shelf: {os.path.basename(path)}")
+        for path, error in self.errors:
+            lines.append(util.make_bold_red(f"{ICON_WARN}  {path}: {error}"))
+        return "\n".join(lines)
+
+
+# ---------------------------------------------------------------------------
+# Review queue
+# ---------------------------------------------------------------------------
+
+def setup_review(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS bookshelf_review (
+        id TEXT PRIMARY KEY,
+        source TEXT NOT NULL,
+        added_at TEXT NOT NULL
+    );
+    """)
+    conn.commit()
+
+
+def setup_ignored(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS bookshelf_watch_ignored (
+        path TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    """)
+    conn.commit()
+
+
+def review_queue(conn, table: str) -> List[Tuple[str, str]]:
+    """(record id, source file name) of the records waiting for review,
+    oldest first; records removed since they were queued are left out."""
+    setup_review(conn)
+    return conn.execute(f"""
+    SELECT r.id, r.source FROM bookshelf_review r
+    JOIN {table} d ON d.id = r.id
+    ORDER BY r.added_at, r.rowid;
+    """).fetchall()
+
+
+def mark_reviewed(conn, identifier: str):
+    with conn:
+        conn.execute("DELETE FROM bookshelf_review WHERE id = ?;", (identifier,))
+
+
+# ---------------------------------------------------------------------------
+# Watching
+# ---------------------------------------------------------------------------
+
+def is_candidate(name: str) -> bool:
+    """False for files the watcher never adds (see the module docstring)."""
+    lower = name.lower()
+    return not (
+        name.startswith((".", "~$"))
+        or lower.endswith(PARTIAL_SUFFIXES)
+        or _UUID_NAME.match(lower)
+    )
+
+
+def placeholder_metadata(path: str, suggested: Dict[str, str]) -> Dict[str, str]:
+    """Metadata of a file added without a human: what the file suggests,
+    and its name (separators as spaces) as the title otherwise."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    title = " ".join(re.split(r"[\s_]+", stem)).strip()
+    return {
+        "title": suggested.get("title") or title,
+        "authors": suggested.get("authors", ""),
+        "category": "",
+        "keywords": suggested.get("keywords", ""),
+        "description": suggested.get("description", ""),
+    }
+
+
+class InboxWatcher:
+    """Adds the files settling in an inbox directory to a shelf."""
+
+    def __init__(
+        self,
+        inbox: str,
+        db_path: str,
+        table: str,
+        files_dir: str,
+        settle: float = SETTLE_DEFAULT,
+        jobs: int = JOBS_DEFAULT,
+        strategy: str = "auto",
+        index_content: bool = True,
+        out=None,
+    ):
+        self.inbox = inbox
+        self.db_path = db_path
+        self.table = table
+        self.files_dir = files_dir
+        self.settle = settle
+        self.jobs = max(1, jobs)
+        self.strategy = strategy
+        self.index_content = index_content
+        self.out = out
+        # path -> (size, mtime_ns) at the last poll
+        self._seen: Dict[str, Tuple[int, int]] = {}
+        self._hash_cache = None
+
+        conn = db.get_connection(db_path)
+        db.ensure_file_columns(conn, table)
+        setup_review(conn)
+        setup_ignored(conn)
+        # path -> (size, mtime_ns) of files not to add unless they change
+        self._ignored: Dict[str, Tuple[int, int]] = {
+            path: (size, mtime_ns) for path, size, mtime_ns in conn.execute(
+                "SELECT path, size, mtime_ns FROM bookshelf_watch_ignored;")
+        }
+
+    @property
+    def hash_cache(self):
+        if self._hash_cache is None:
+            from bookshelf import hashcache
+
+            self._hash_cache = hashcache.HashCache(db.get_connection(self.db_path))
+        return self._hash_cache
+
+    def scan(self) -> Tuple[List[str], int]:
+        """Settled files to add, and the number of files still settling."""
+        now = time.time()
+        seen: Dict[str, Tuple[int, int]] = {}
+        ready: List[str] = []
+        with os.scandir(self.inbox) as entries:
+            for entry in entries:
+                if not is_candidate(entry.name) or not entry.is_file(follow_symlinks=False):
+                    continue
+                st = entry.stat(follow_symlinks=False)
+                signature = (st.st_size, st.st_mtime_ns)
+                if self._ignored.get(entry.path) == signature:
+                    continue
+                seen[entry.path] = signature
+                if (
+                    st.st_size > 0
+                    # Seen at the last poll already, and unchanged since
+                    and self._seen.get(entry.path) == signature
+                    and now - st.st_mtime_ns / 1e9 >= self.settle
+                ):
+                    ready.append(entry.path)
+        self._seen = seen
+        # Ignored files that are gone no longer need remembering
+        gone = [p for p in self._ignored if not os.path.exists(p)]
+        if gone:
+            for path in gone:
+                del self._ignored[path]
+            conn = db.get_connection(self.db_path)
+            with conn:
+                conn.executemany(
+                    "DELETE FROM bookshelf_watch_ignored WHERE path = ?;",
+                    [(p,) for p in gone],
+                )
+        return sorted(ready), len(seen) - len(ready)
+
+    def _ignore(self, path: str):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        self._ignored[path] = (st.st_size, st.st_mtime_ns)
+        conn = db.get_connection(self.db_path)
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO bookshelf_watch_ignored(path, size, mtime_ns)"
+                " VALUES (?, ?, ?);",
+                (path, st.st_size, st.st_mtime_ns),
+            )
+
+    def _in_shelf(self, paths: List[str]) -> List[str]:
+        """Those of *paths* whose content is already in the shelf, found
+        without copying them: only files with the size of a record are
+        hashed, through the hash cache."""
+        conn = db.get_connection(self.db_path)
+        sized = []
+        for path in paths:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            if conn.execute(
+                f"SELECT 1 FROM {self.table} WHERE size = ? LIMIT 1", (size,)
+            ).fetchone():
+                sized.append(path)
+        if not sized:
+            return []
+        hashes = self.hash_cache.hash_many(sized, jobs=self.jobs)
+        return [
+            path for path in sized
+            if hashes[path] is not None and conn.execute(
+                f"SELECT 1 FROM {self.table} WHERE sha256 = ? LIMIT 1",
+                (hashes[path],),
+            ).fetchone()
+        ]
+
+    def _suggestions(self, paths: List[str]) -> Dict[str, Dict[str, str]]:
+        pdfs = [(p, p) for p in paths if p.lower().endswith(".pdf")]
+        if not pdfs or not _PYPDF_AVAILABLE:
+            return {}
+        from bookshelf.extract import KIND_METADATA, ExtractionPool
+
+        with ExtractionPool(KIND_METADATA, self.jobs, METADATA_TIMEOUT) as pool:
+            return {path: result.metadata for path, result in pool.imap(pdfs)}
+
+    def add(self, paths: List[str]) -> BatchResult:
+        """Add *paths* (files of the inbox) as one batch."""
+        batch = BatchResult()
+        start = time.perf_counter()
+        conn = db.get_connection(self.db_path)
+
+        for path in self._in_shelf(paths):
+            batch.duplicates.append(path)
+            self._ignore(path)
+        paths = [p for p in paths if p not in batch.duplicates]
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as threads:
+            copies = {
+                path: threads.submit(
+                    ingest.copy_and_hash, path, self.files_dir, self.strategy
+                )
+                for path in paths
+            }
+            # The metadata is read while the files are being copied
+            suggestions = self._suggestions(paths)
+
+        rows, review, added_paths = [], [], []
+        hashes = set()
+        now = datetime.now().isoformat(timespec="seconds")
+        for path in paths:
+            try:
+                result = copies[path].result()
+            except OSError as e:
+                batch.errors.append((path, str(e)))
+                self._ignore(path)
+                continue
+            if result.sha256 in hashes or conn.execute(
+                f"SELECT 1 FROM {self.table} WHERE sha256 = ? LIMIT 1",
+                (result.sha256,),
+            ).fetchone():
+                os.unlink(os.path.join(
+                    self.files_dir, result.filename[0:2], result.filename
+                ))
+                batch.duplicates.append(path)
+                self._ignore(path)
+                continue
+            hashes.add(result.sha256)
+            identifier = os.path.splitext(result.filename)[0]
+            md = placeholder_metadata(path, suggestions.get(path, {}))
+            rows.append((
+                identifier, result.filename,
+                md["title"], md["authors"], md["category"],
+                md["keywords"], md["description"],
+                result.sha256, result.size, result.mtime_ns,
+            ))
+            review.append((identifier, os.path.basename(path), now))
+            added_paths.append(path)
+            batch.added.append(identifier)
+
+        with conn:
+            conn.executemany(
+                f"""INSERT INTO {self.table}
+                (id, filename, title, authors, category, keywords, description,
+                sha256, size, mtime_ns)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                rows,
+            )
+            conn.executemany(
+                "INSERT INTO bookshelf_review(id, source, added_at) VALUES (?, ?, ?);",
+                review,
+            )
+        # Only once the records are committed: the file is now in the shelf
+        for path in added_paths:
+            os.unlink(path)
+            self._seen.pop(path, None)
+
+        if batch.added and self.index_content:
+            from bookshelf import content
+
+            content.update_content(self.db_path, self.table, self.files_dir, self.jobs)
+        batch.elapsed = time.perf_counter() - start
+        return batch
+
+    def poll(self) -> Optional[BatchResult]:
+        """Add the files settled since the last poll, if any."""
+        ready, _ = self.scan()
+        return self._add_ready(ready)
+
+    def _add_ready(self, ready: List[str]) -> Optional[BatchResult]:
+        if not ready:
+            return None
+        batch = self.add(ready)
+        if self.out is not None:
+            print(batch.summary(), file=self.out)
+        return batch
+
+    def run(self, interval: float = INTERVAL_DEFAULT,
+            stop: Optional[threading.Event] = None, once: bool = False):
+        """Poll every *interval* seconds until *stop* is set.  With *once*,
+        return as soon as no file is left settling."""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            ready, settling = self.scan()
+            if ready:
+                self._add_ready(ready)
+            elif once and settling == 0:
+                return
+            stop.wait(interval)
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def _build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(
+        prog="bookshelf watch",
+        description="Add the files dropped into the inbox, queued for review.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    p.add_argument("--interval", type=float, default=INTERVAL_DEFAULT,
+                   help="Seconds between two polls of the inbox")
+    p.add_argument("--settle", type=float, default=SETTLE_DEFAULT,
+                   help="Seconds a file must be unchanged before it is added")
+    p.add_argument("--jobs", type=int, default=JOBS_DEFAULT,
+                   help="Files copied and read in parallel")
+    p.add_argument("--once", action="store_true",
+                   help="Add what is in the inbox, then exit")
+    p.add_argument("--no-content", action="store_true",
+                   help="Do not index the text of the files added")
+    return p
+
+
+def run_watch_cli(argv: list[str] | None = None):
+    from bookshelf.app import Bookshelf
+
+    args = _build_parser().parse_args(argv)
+    shelf = Bookshelf(show_banner=False)
+    inbox = os.path.join(shelf.root_dir, shelf.inbox_dir)
+    watcher = InboxWatcher(
+        inbox,
+        shelf.db_path,
+        shelf.table_name,
+        os.path.join(shelf.root_dir, shelf.files_dir),
+        settle=args.settle,
+        jobs=args.jobs,
+        strategy=shelf.transfer_strategy,
+        index_content=not args.no_content,
+        out=sys.stdout,
+    )
+    if not args.once:
+        print(f"{ICON_INFO}  Watching {inbox} (Ctrl-C to stop)")
+    try:
+        watcher.run(args.interval, once=args.once)
+    except KeyboardInterrupt:
+        pass
+    queued = len(review_queue(shelf.conn, shelf.table_name))
+    if queued:
+        print(f"{ICON_INFO}  {queued} records to review: bookshelf review")